@@ -0,0 +1,339 @@
+"""WebSocket load generator and latency harness.
+
+``pszcz-loadgen`` (``python -m client.loadgen``) opens ``--clients``
+concurrent connections to a server, performs the ``hello`` handshake of
+:func:`client.net.build_hello` on each and records every snapshot or delta
+they receive for ``--duration`` seconds. With ``--edit-every`` the first
+connection also acts as the controller and sends an ``edit_grid`` burst of
+``--edit-burst`` operations that often; the last operation of each burst
+flips one probe cell, and the burst's round-trip time is measured until a
+frame showing the flipped cell arrives.
+
+The report covers frames and bytes per second, snapshot inter-arrival
+times and their jitter (standard deviation), latency from a frame's server
+``ts`` to its receipt, and edit round-trip times. Latencies compare the
+server's clock with the local one, so they are only meaningful against a
+server on the same machine or with synchronised clocks. ``--json`` prints
+the report as JSON.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import websockets  # type: ignore[import-not-found]
+
+from client.net import build_hello
+from client.t0.state import (
+    BINARY_HEADER,
+    BINARY_MAGIC,
+    ClientState,
+    make_decompressor,
+    unwrap_message,
+)
+
+PERCENTILES = (50, 90, 99)
+
+
+@dataclass
+class ClientStats:
+    """What one connection received."""
+
+    frames: int = 0
+    bytes: int = 0
+    arrivals: List[float] = field(default_factory=list)
+    latencies_ms: List[float] = field(default_factory=list)
+    edit_rtts_ms: List[float] = field(default_factory=list)
+    edits_sent: int = 0
+    errors: Dict[str, int] = field(default_factory=dict)
+    failed: Optional[str] = None
+
+
+@dataclass
+class _Probe:
+    """The cell flipped by the last edit burst and when it was sent."""
+
+    r: int
+    c: int
+    material: str
+    sent: float
+
+
+def _frame_ts(message: str | bytes) -> Tuple[Optional[str], Optional[int]]:
+    """Return the type and server ``ts`` of a received message."""
+
+    if isinstance(message, bytes):
+        if not message.startswith(BINARY_MAGIC) or len(message) < BINARY_HEADER.size:
+            return None, None
+        return "binary", BINARY_HEADER.unpack_from(message)[5]
+    try:
+        msg = json.loads(message)
+    except json.JSONDecodeError:
+        return None, None
+    return msg.get("t"), msg.get("ts")
+
+
+def _percentiles(
+    values: Sequence[float], percentiles: Iterable[int] = PERCENTILES
+) -> Dict[str, Any]:
+    """Summarise ``values`` with nearest-rank percentiles and the maximum."""
+
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    summary: Dict[str, Any] = {"count": len(ordered)}
+    for p in percentiles:
+        rank = max(-(-p * len(ordered) // 100) - 1, 0)
+        summary[f"p{p}"] = round(ordered[rank], 3)
+    summary["max"] = round(ordered[-1], 3)
+    return summary
+
+
+async def _client(
+    url: str,
+    features: Sequence[str],
+    deadline: float,
+    stats: ClientStats,
+    edit_every: float = 0.0,
+    edit_burst: int = 1,
+    rng: Optional[random.Random] = None,
+) -> None:
+    """Run one connection until ``deadline``; controllers also send edits."""
+
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            await ws.send(json.dumps(build_hello(features=features)))
+            welcome = json.loads(await ws.recv())
+            if welcome.get("t") != "welcome":
+                stats.failed = welcome.get("code", "handshake failed")
+                return
+            decompressor = make_decompressor(welcome)
+            controller = edit_every > 0
+            grid = ClientState() if controller else None
+            probe: List[Optional[_Probe]] = [None]
+            tasks = [asyncio.create_task(_receive(ws, stats, decompressor, grid, probe))]
+            if controller:
+                assert grid is not None
+                rng = rng or random.Random()
+                edits = _edit(ws, stats, grid, probe, edit_every, edit_burst, rng)
+                tasks.append(asyncio.create_task(edits))
+            try:
+                await asyncio.wait(tasks, timeout=max(deadline - time.monotonic(), 0.0))
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+    except (OSError, websockets.WebSocketException) as exc:
+        stats.failed = str(exc) or type(exc).__name__
+
+
+async def _receive(
+    ws: Any,
+    stats: ClientStats,
+    decompressor: Any,
+    grid: Optional[ClientState],
+    probe: List[Optional[_Probe]],
+) -> None:
+    async for raw in ws:
+        now_ms = time.time() * 1000.0
+        received = time.monotonic()
+        stats.bytes += len(raw)
+        message = unwrap_message(raw, decompressor)
+        kind, ts = _frame_ts(message)
+        if kind == "error":
+            code = json.loads(message).get("code", "")
+            stats.errors[code] = stats.errors.get(code, 0) + 1
+            probe[0] = None  # the burst was refused; its probe never lands
+            continue
+        if kind not in ("snapshot", "delta", "binary"):
+            continue
+        stats.frames += 1
+        stats.arrivals.append(received)
+        if isinstance(ts, int):
+            stats.latencies_ms.append(now_ms - ts)
+        if grid is None:
+            continue
+        if isinstance(message, bytes):
+            applied = grid.apply_binary(message)
+        elif kind == "snapshot":
+            grid.update(json.loads(message))
+            applied = True
+        else:
+            applied = grid.apply_delta(json.loads(message))
+        if not applied:
+            await ws.send(json.dumps({"t": "resync", "seq": "0", "ts": int(now_ms)}))
+            continue
+        pending = probe[0]
+        if pending is not None and grid.material_at(pending.r, pending.c) == pending.material:
+            stats.edit_rtts_ms.append((received - pending.sent) * 1000.0)
+            probe[0] = None
+
+
+async def _edit(
+    ws: Any,
+    stats: ClientStats,
+    grid: ClientState,
+    probe: List[Optional[_Probe]],
+    every: float,
+    burst: int,
+    rng: random.Random,
+) -> None:
+    seq = 0
+    while True:
+        await asyncio.sleep(every)
+        rows = len(grid.grid)
+        cols = len(grid.grid[0]) if rows else 0
+        # One probe at a time, so every round trip is attributed correctly.
+        if not rows or not cols or probe[0] is not None:
+            continue
+        r0, c0 = grid.origin
+        cells = [(r0 + rng.randrange(rows), c0 + rng.randrange(cols)) for _ in range(burst)]
+        ops: List[Dict[str, Any]] = [
+            {"op": "set_pixel", "r": r, "c": c, "material": rng.choice(("space", "stone"))}
+            for r, c in cells[:-1]
+        ]
+        r, c = cells[-1]
+        material = "space" if grid.material_at(r, c) == "stone" else "stone"
+        ops.append({"op": "set_pixel", "r": r, "c": c, "material": material})
+        seq += 1
+        probe[0] = _Probe(r, c, material, time.monotonic())
+        await ws.send(json.dumps({"t": "edit_grid", "seq": str(seq), "ts": 0, "ops": ops}))
+        stats.edits_sent += 1
+
+
+async def run_load(
+    url: str = "ws://127.0.0.1:7777/ws",
+    clients: int = 10,
+    duration: float = 10.0,
+    features: Sequence[str] = (),
+    edit_every: float = 0.0,
+    edit_burst: int = 1,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Run ``clients`` connections for ``duration`` seconds and return the report."""
+
+    rng = random.Random(seed)
+    deadline = time.monotonic() + duration
+    stats = [ClientStats() for _ in range(clients)]
+    start = time.monotonic()
+    await asyncio.gather(
+        *(
+            _client(
+                url,
+                features,
+                deadline,
+                s,
+                edit_every if i == 0 else 0.0,
+                edit_burst,
+                rng,
+            )
+            for i, s in enumerate(stats)
+        )
+    )
+    return summarize(stats, time.monotonic() - start)
+
+
+def summarize(stats: Sequence[ClientStats], elapsed: float) -> Dict[str, Any]:
+    """Combine per-connection statistics into the loadgen report."""
+
+    elapsed = max(elapsed, 1e-9)
+    intervals = [
+        (b - a) * 1000.0 for s in stats for a, b in zip(s.arrivals, s.arrivals[1:])
+    ]
+    interarrival = _percentiles(intervals)
+    if intervals:
+        interarrival["mean"] = round(statistics.fmean(intervals), 3)
+        interarrival["jitter"] = round(statistics.pstdev(intervals), 3)
+    errors: Dict[str, int] = {}
+    for s in stats:
+        for code, n in s.errors.items():
+            errors[code] = errors.get(code, 0) + n
+    frames = sum(s.frames for s in stats)
+    received = sum(s.bytes for s in stats)
+    return {
+        "clients": len(stats),
+        "connected": sum(s.failed is None for s in stats),
+        "duration_s": round(elapsed, 3),
+        "frames": frames,
+        "frames_per_s": round(frames / elapsed, 3),
+        "bytes": received,
+        "bytes_per_s": round(received / elapsed, 3),
+        "interarrival_ms": interarrival,
+        "latency_ms": _percentiles([v for s in stats for v in s.latencies_ms]),
+        "edits_sent": sum(s.edits_sent for s in stats),
+        "edit_rtt_ms": _percentiles([v for s in stats for v in s.edit_rtts_ms]),
+        "errors": errors,
+        "failures": sorted({s.failed for s in stats if s.failed is not None}),
+    }
+
+
+def _format(report: Dict[str, Any]) -> str:
+    def stats(summary: Dict[str, Any]) -> str:
+        if not summary.get("count"):
+            return "n/a"
+        return " ".join(f"{k}={v}" for k, v in summary.items() if k != "count")
+
+    lines = [
+        f"clients {report['connected']}/{report['clients']} for {report['duration_s']} s",
+        f"frames {report['frames']} ({report['frames_per_s']}/s), "
+        f"{report['bytes_per_s'] / 1024:.1f} KiB/s",
+        f"inter-arrival ms: {stats(report['interarrival_ms'])}",
+        f"latency ms:       {stats(report['latency_ms'])}",
+        f"edit rtt ms:      {stats(report['edit_rtt_ms'])} ({report['edits_sent']} bursts)",
+    ]
+    if report["errors"]:
+        lines.append(f"errors: {report['errors']}")
+    if report["failures"]:
+        lines.append(f"failed connections: {report['failures']}")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    """Run the load generator and print its report."""
+
+    parser = argparse.ArgumentParser(description="PSZCZ Flow Simulator load generator")
+    parser.add_argument("--url", default="ws://127.0.0.1:7777/ws")
+    parser.add_argument("--clients", type=int, default=10, help="concurrent connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument(
+        "--features",
+        nargs="*",
+        default=[],
+        help="protocol features every client requests (e.g. delta-1 binary-1)",
+    )
+    parser.add_argument(
+        "--edit-every",
+        type=float,
+        default=0.0,
+        help="seconds between the controller's edit bursts (0: no controller)",
+    )
+    parser.add_argument("--edit-burst", type=int, default=1, help="operations per edit burst")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the edited cells")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    if args.clients < 1 or args.edit_burst < 1:
+        parser.error("--clients and --edit-burst must be at least 1")
+
+    report = asyncio.run(
+        run_load(
+            args.url,
+            args.clients,
+            args.duration,
+            args.features,
+            args.edit_every,
+            args.edit_burst,
+            args.seed,
+        )
+    )
+    print(json.dumps(report, indent=2) if args.json else _format(report))
+
+
+if __name__ == "__main__":
+    main()
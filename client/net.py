@@ -3,15 +3,19 @@
 from __future__ import annotations
 
 import time
-from typing import Any, Dict
+from typing import Any, Dict, Iterable
 
 from client.t0 import net as _t0_net
 
 
-def build_hello(seq: str = "1") -> Dict[str, Any]:
-    """Return a hello message following :mod:`PROTOCOL`."""
+def build_hello(seq: str = "1", features: Iterable[str] = ()) -> Dict[str, Any]:
+    """Return a hello message following :mod:`PROTOCOL`.
 
-    return {
+    ``features`` lists optional protocol feature flags to request; the
+    server echoes the ones it enables in ``welcome``.
+    """
+
+    hello: Dict[str, Any] = {
         "t": "hello",
         "seq": seq,
         "ts": int(time.time() * 1000),
@@ -19,6 +23,10 @@ def build_hello(seq: str = "1") -> Dict[str, Any]:
         "min_minor": 0,
         "client_version": "0.2.0",
     }
+    features = list(features)
+    if features:
+        hello["features"] = features
+    return hello
 
 
 def main() -> None:  # pragma: no cover - thin wrapper
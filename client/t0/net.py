@@ -12,7 +12,7 @@ import time
 from dataclasses import dataclass
 from typing import Any, Dict, Optional
 
-from .state import ClientState
+from .state import ClientState, make_decompressor, unwrap_message, zstandard
 
 import websockets  # type: ignore[import-not-found]
 
@@ -49,6 +49,7 @@ def build_hello(seq: str = "1") -> Dict[str, Any]:
         "accept_major": [2],
         "min_minor": 0,
         "client_version": "0.2.0",
+        "features": ["delta-1", "binary-1"] + (["zstd-1"] if zstandard else []),
     }
 
 
@@ -106,27 +107,47 @@ def parse_command(line: str, seq: Seq, state: ClientState) -> Optional[Dict[str,
     return None
 
 
-async def _recv_loop(ws, state: ClientState) -> None:
+async def _recv_loop(ws, state: ClientState, seq: Seq, decompressor: Any = None) -> None:
     start = time.monotonic()
     count = 0
+    # After a gap, ask for a resync once and ignore deltas until it arrives.
+    resync_pending = False
     async for raw in ws:
-        try:
-            msg = json.loads(raw)
-        except json.JSONDecodeError:  # pragma: no cover - ignore bad messages
+        raw = unwrap_message(raw, decompressor)
+        if isinstance(raw, bytes):
+            try:
+                applied = state.apply_binary(raw)
+            except ValueError:  # pragma: no cover - ignore bad frames
+                continue
+        else:
+            try:
+                msg = json.loads(raw)
+            except json.JSONDecodeError:  # pragma: no cover - ignore bad messages
+                continue
+            t = msg.get("t")
+            if t == "snapshot":
+                state.update(msg)
+                applied = True
+            elif t == "delta":
+                applied = state.apply_delta(msg)
+            else:
+                if t in ("error", "save_done"):
+                    print(json.dumps(msg))
+                continue
+        if not applied:
+            if not resync_pending:
+                resync_pending = True
+                await ws.send(json.dumps({"t": "resync", "seq": seq.next(), "ts": _now_ms()}))
             continue
-        t = msg.get("t")
-        if t == "snapshot":
-            state.update(msg)
-            count += 1
-            elapsed = time.monotonic() - start
-            rate = count / elapsed if elapsed else 0.0
-            grid = state.grid
-            for row in grid:
-                line = "".join(cell.get("material", "?")[0] for cell in row)
-                print(line)
-            print(f"rate={rate:.1f} msg/s")
-        elif t == "error":
-            print(json.dumps(msg))
+        resync_pending = False
+        count += 1
+        elapsed = time.monotonic() - start
+        rate = count / elapsed if elapsed else 0.0
+        grid = state.grid
+        for row in grid:
+            line = "".join(cell.get("material", "?")[0] for cell in row)
+            print(line)
+        print(f"rate={rate:.1f} msg/s")
 
 
 async def _input_loop(ws, seq: Seq, state: ClientState) -> None:
@@ -162,7 +183,9 @@ def main() -> None:
             welcome = json.loads(await ws.recv())
             print(welcome)
 
-            recv_task = asyncio.create_task(_recv_loop(ws, state))
+            recv_task = asyncio.create_task(
+                _recv_loop(ws, state, seq, make_decompressor(welcome))
+            )
             send_task = asyncio.create_task(_input_loop(ws, seq, state))
             done, pending = await asyncio.wait(
                 [recv_task, send_task], return_when=asyncio.FIRST_COMPLETED
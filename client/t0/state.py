@@ -2,8 +2,143 @@
 
 from __future__ import annotations
 
+import base64
+import struct
+import sys
+from array import array
 from dataclasses import dataclass, field
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
+
+try:  # optional dependency for the ``zstd-1`` feature
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None  # type: ignore[assignment]
+
+# Binary frame layout of the ``binary-1`` feature, mirroring ``server.wire``.
+BINARY_MAGIC = b"PSZB"
+BINARY_HEADER = struct.Struct("<4sBBHQQQQQIIfffI")
+BINARY_VERSION = 1
+BINARY_WINDOW = struct.Struct("<II")
+BINARY_FLAG_WINDOW = 1
+BINARY_KIND_FULL = 0
+BINARY_KIND_DELTA = 1
+MATERIAL_NAMES = ("space", "stone", "spring", "sink")
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def make_decompressor(welcome: Dict[str, Any]) -> Any:
+    """Return a zstd decompressor matching ``welcome`` or ``None``.
+
+    ``None`` is returned when ``zstd-1`` was not enabled for the connection.
+    """
+
+    if "zstd-1" not in welcome.get("features", []) or zstandard is None:
+        return None
+    encoded = welcome.get("zstd", {}).get("dict")
+    if encoded:
+        dict_data = zstandard.ZstdCompressionDict(base64.b64decode(encoded))
+        return zstandard.ZstdDecompressor(dict_data=dict_data)
+    return zstandard.ZstdDecompressor()
+
+
+def unwrap_message(raw: str | bytes, decompressor: Any = None) -> str | bytes:
+    """Undo ``zstd-1`` compression of a received message.
+
+    Returns JSON text as ``str`` and binary frames as ``bytes``.
+    """
+
+    if isinstance(raw, bytes) and raw.startswith(ZSTD_MAGIC) and decompressor is not None:
+        data = decompressor.decompress(raw)
+        return data if data.startswith(BINARY_MAGIC) else data.decode("utf-8")
+    return raw
+
+
+@dataclass
+class BinaryFrame:
+    """Decoded ``binary-1`` frame.
+
+    For full frames ``materials`` and ``depths`` hold the whole grid in
+    row-major order; for deltas they hold one entry per changed cell and
+    ``index`` holds the flat cell positions ``r * cols + c``. Windowed frames
+    cover ``rows`` x ``cols`` cells starting at ``origin``.
+    """
+
+    kind: int
+    seq: int
+    ts: int
+    frame: int
+    base: int
+    tick: int
+    rows: int
+    cols: int
+    cm_per_pixel: float
+    solve_ms: float
+    tick_lag_ms: float
+    materials: bytes
+    depths: array
+    index: array = field(default_factory=lambda: array("I"))
+    origin: Tuple[int, int] = (0, 0)
+
+
+def _le_array(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":  # pragma: no cover - wire format is little-endian
+        values.byteswap()
+    return values
+
+
+def decode_binary_frame(data: bytes) -> BinaryFrame:
+    """Decode a binary snapshot or delta; raises ``ValueError`` if malformed."""
+
+    if len(data) < BINARY_HEADER.size:
+        raise ValueError("short binary frame")
+    (
+        magic, version, kind, flags, seq, ts, frame, base, tick,
+        rows, cols, cm_per_pixel, solve_ms, tick_lag_ms, count,
+    ) = BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC:
+        raise ValueError("not a binary frame")
+    if version != BINARY_VERSION:
+        raise ValueError(f"unsupported binary frame version {version}")
+    start = BINARY_HEADER.size
+    origin = (0, 0)
+    if flags & BINARY_FLAG_WINDOW:
+        if len(data) < start + BINARY_WINDOW.size:
+            raise ValueError("short binary frame")
+        origin = BINARY_WINDOW.unpack_from(data, start)
+        start += BINARY_WINDOW.size
+    body = memoryview(data)[start:]
+    if kind == BINARY_KIND_FULL:
+        n = rows * cols
+        index = array("I")
+        offset = 0
+    elif kind == BINARY_KIND_DELTA:
+        n = count
+        index = _le_array("I", bytes(body[: 4 * n]))
+        offset = 4 * n
+    else:
+        raise ValueError(f"unknown binary frame kind {kind}")
+    if len(body) != offset + 5 * n:
+        raise ValueError("binary frame length does not match header")
+    return BinaryFrame(
+        kind=kind,
+        seq=seq,
+        ts=ts,
+        frame=frame,
+        base=base,
+        tick=tick,
+        rows=rows,
+        cols=cols,
+        cm_per_pixel=cm_per_pixel,
+        solve_ms=solve_ms,
+        tick_lag_ms=tick_lag_ms,
+        materials=bytes(body[offset : offset + n]),
+        depths=_le_array("f", bytes(body[offset + n :])),
+        index=index,
+        origin=origin,
+    )
 
 
 @dataclass
@@ -12,21 +147,94 @@ class ClientState:
 
     The interactive ``t0`` client keeps a copy of the server's grid so that
     commands such as ``set_depth`` can reuse the existing material when only the
-    water level changes.
+    water level changes. After a ``subscribe`` the grid may only cover a
+    window of the server's grid whose top-left cell is ``origin``.
     """
 
     grid: List[List[Dict[str, Any]]] = field(default_factory=list)
+    frame: Optional[int] = None
+    origin: Tuple[int, int] = (0, 0)
 
     def update(self, snapshot: Dict[str, Any]) -> None:
         """Update state from a ``snapshot`` message."""
 
-        grid = snapshot.get("grid", {}).get("cells", [])
+        grid_msg = snapshot.get("grid", {})
+        grid = grid_msg.get("cells", [])
         if isinstance(grid, list):
             self.grid = grid
+        origin = grid_msg.get("origin", (0, 0))
+        self.origin = (int(origin[0]), int(origin[1]))
+        frame = snapshot.get("frame")
+        self.frame = frame if isinstance(frame, int) else None
+
+    def apply_delta(self, delta: Dict[str, Any]) -> bool:
+        """Apply a ``delta-1`` ``delta`` message on top of the current grid.
+
+        Returns ``False`` without changing anything when the delta does not
+        follow the last applied frame; the caller should then send a
+        ``resync`` request and wait for the next full snapshot.
+        """
+
+        if self.frame is None or delta.get("base") != self.frame:
+            self.frame = None
+            return False
+        r0, c0 = self.origin
+        for cell in delta.get("cells", []):
+            try:
+                r, c = cell["r"] - r0, cell["c"] - c0
+                if r < 0 or c < 0:
+                    raise IndexError
+                self.grid[r][c] = {
+                    "material": cell["material"],
+                    "depth": cell["depth"],
+                }
+            except (KeyError, IndexError, TypeError):
+                self.frame = None
+                return False
+        self.frame = delta.get("frame")
+        return True
+
+    def apply_binary(self, data: bytes) -> bool:
+        """Apply a ``binary-1`` frame; see :meth:`apply_delta` for the result.
+
+        Raises ``ValueError`` for malformed frames, including unknown
+        material codes.
+        """
+
+        frame = decode_binary_frame(data)
+        if frame.materials and max(frame.materials) >= len(MATERIAL_NAMES):
+            raise ValueError("unknown material code in binary frame")
+        names = MATERIAL_NAMES
+        cols = frame.cols
+        if frame.kind == BINARY_KIND_FULL:
+            mats = frame.materials
+            depths = frame.depths
+            self.grid = [
+                [
+                    {"material": names[m], "depth": d}
+                    for m, d in zip(mats[i : i + cols], depths[i : i + cols])
+                ]
+                for i in range(0, frame.rows * cols, cols)
+            ]
+            self.frame = frame.frame
+            self.origin = frame.origin
+            return True
+        r0, c0 = frame.origin
+        cells = [
+            {"r": r0 + i // cols, "c": c0 + i % cols, "material": names[m], "depth": d}
+            for i, m, d in zip(frame.index, frame.materials, frame.depths)
+        ]
+        return self.apply_delta(
+            {"frame": frame.frame, "base": frame.base, "cells": cells}
+        )
 
     def material_at(self, r: int, c: int) -> str:
         """Return material at ``r``, ``c`` or ``space`` if unknown."""
 
+        r -= self.origin[0]
+        c -= self.origin[1]
+        if r < 0 or c < 0:
+            return "space"
         try:
             return self.grid[r][c]["material"]
         except Exception:  # pragma: no cover - out-of-bounds or malformed data
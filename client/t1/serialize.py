@@ -1,15 +1,16 @@
 """JSON import/export helpers for :class:`~client.t1.model.MapState`.
 
 The file format stores `rows`, `cols`, global `cm_per_pixel` and a `grid`
-array of pixels with `material` and `depth` fields.
+array of pixels with `material` and `depth` fields. :func:`load_map` and
+:func:`save_map` stream the grid row by row (see :mod:`.jsonstream`).
 """
 
 from __future__ import annotations
 
-import json
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterator, List
 
+from .jsonstream import ROW, iter_map, write_map
 from .model import MapState, Pixel
 
 
@@ -29,11 +30,15 @@ def import_map(data: dict[str, Any]) -> MapState:
     rows = data["rows"]
     cols = data["cols"]
     cm_per_pixel = float(data.get("cm_per_pixel", 1.0))
-    grid_data = data.get("grid", [])
-    grid = [
-        [Pixel(cell.get("material", "space"), float(cell.get("depth", 0.0))) for cell in row]
-        for row in grid_data
-    ]
+    grid = [_pixel_row(row) for row in data.get("grid", [])]
+    return _sized_map(grid, rows, cols, cm_per_pixel)
+
+
+def _pixel_row(row: Any) -> List[Pixel]:
+    return [Pixel(cell.get("material", "space"), float(cell.get("depth", 0.0))) for cell in row]
+
+
+def _sized_map(grid: List[List[Pixel]], rows: int, cols: int, cm_per_pixel: float) -> MapState:
     # Ensure grid has correct size
     if len(grid) < rows:
         grid.extend([[Pixel("space", 0.0) for _ in range(cols)] for _ in range(rows - len(grid))])
@@ -44,11 +49,25 @@ def import_map(data: dict[str, Any]) -> MapState:
 
 
 def save_map(state: MapState, path: str | Path) -> None:
+    header = {"rows": state.rows, "cols": state.cols, "cm_per_pixel": state.cm_per_pixel}
+
+    def rows() -> Iterator[list[dict[str, Any]]]:
+        for row in state.grid:
+            yield [{"material": p.material, "depth": p.depth} for p in row]
+
     with open(path, "w", encoding="utf-8") as f:
-        json.dump(export_map(state), f)
+        write_map(f, header, rows())
 
 
 def load_map(path: str | Path) -> MapState:
+    header: dict[str, Any] = {}
+    grid: List[List[Pixel]] = []
     with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return import_map(data)
+        for key, value in iter_map(f):
+            if key is ROW:
+                grid.append(_pixel_row(value))
+            else:
+                header[key] = value
+    return _sized_map(
+        grid, header["rows"], header["cols"], float(header.get("cm_per_pixel", 1.0))
+    )
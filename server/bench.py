@@ -0,0 +1,343 @@
+"""Hot-path benchmarks with a stored baseline.
+
+``pszcz-bench`` (``python -m server.bench``) times the code every tick and
+broadcast runs through on a large synthetic level (see
+:func:`synthetic_level`):
+
+``flow_step``
+    One step of the selected solver.
+``snapshot_json``
+    :meth:`~server.state.SimState.snapshot` plus ``json.dumps``.
+``apply_edits``
+    A batch of ``--edit-ops`` operations, mostly ``set_pixel``.
+``save_level`` / ``load_level`` (``_json`` and ``_binary``)
+    A level round trip through :mod:`server.io`.
+``broadcast``
+    One frame queued for ``--clients`` fake connections with a mix of
+    ``delta-1``/``binary-1`` features and written by their writer tasks.
+
+Each benchmark is repeated and its median and best times in milliseconds
+are written as JSON (``--out``). With ``--baseline`` the medians are
+compared against a stored result; any that grew by more than
+``--tolerance`` is reported and the command exits with status 1.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from . import net
+from .io import load_level, save_level
+from .state import DEPTH_DTYPE, MATERIAL_CODES, MATERIAL_DTYPE, SimState
+from .tick import DEFAULT_SOLVER, SOLVERS, Solver, get_solver
+
+BENCH_VERSION = 1
+
+SPACE = MATERIAL_CODES["space"]
+STONE = MATERIAL_CODES["stone"]
+SPRING = MATERIAL_CODES["spring"]
+SINK = MATERIAL_CODES["sink"]
+
+# Feature sets the fake broadcast clients cycle through.
+CLIENT_FEATURES = ({"delta-1"}, set(), {"binary-1"}, {"delta-1", "binary-1"})
+
+
+def synthetic_level(rows: int, cols: int, seed: int = 0) -> SimState:
+    """Return a reproducible ``rows`` x ``cols`` level that keeps water moving.
+
+    The grid has a stone floor and walls, sloping channels crossing it with
+    gaps that drain into the level below, open-topped basins sitting on the
+    channels, and scattered springs and sinks with some water already
+    standing in the basins.
+    """
+
+    rng = np.random.default_rng(seed)
+    materials = np.full((rows, cols), SPACE, dtype=MATERIAL_DTYPE)
+    depths = np.zeros((rows, cols), dtype=DEPTH_DTYPE)
+    materials[-1] = STONE
+    materials[:, 0] = materials[:, -1] = STONE
+
+    # Channels: stone ledges every ``spacing`` rows, stepping down one row
+    # every ``run`` columns, with gaps the water falls through.
+    spacing = max(rows // 12, 4)
+    for top in range(spacing, rows - 2, spacing):
+        run = int(rng.integers(8, 32))
+        c = np.arange(1, cols - 1)
+        r = np.minimum(top + c // run, rows - 2)
+        materials[r, c] = STONE
+        for start in rng.integers(1, cols - 1, max(cols // 64, 1)):
+            materials[r[start - 1 : start + 2], c[start - 1 : start + 2]] = SPACE
+
+        # Basins: U-shaped walls resting on the ledge, partly filled.
+        for _ in range(max(cols // 96, 1)):
+            width = int(rng.integers(6, 24))
+            height = int(rng.integers(3, max(spacing - 1, 4)))
+            left = int(rng.integers(1, max(cols - width - 1, 2)))
+            floor = int(r[min(left, c.size - 1)]) - 1
+            roof = max(floor - height, 0)
+            right = min(left + width, cols - 1)
+            materials[floor, left:right] = STONE
+            materials[roof:floor, left] = STONE
+            materials[roof:floor, right - 1] = STONE
+            depths[roof + 1 : floor, left + 1 : right - 1] = rng.random(
+                (max(floor - roof - 1, 0), max(right - left - 2, 0)), dtype=DEPTH_DTYPE
+            )
+
+    # Spring and sink fields.
+    open_ = materials == SPACE
+    field = rng.random((rows, cols))
+    materials[open_ & (field < 0.002)] = SPRING
+    materials[open_ & (field > 0.999)] = SINK
+    depths[materials == STONE] = 0.0
+    return SimState(materials, depths)
+
+
+def edit_batch(rows: int, cols: int, ops: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Return an ``edit_grid`` batch of ``ops`` operations, mostly ``set_pixel``."""
+
+    rng = np.random.default_rng(seed)
+    names = sorted(MATERIAL_CODES)
+    batch: List[Dict[str, Any]] = []
+    for i in range(ops):
+        r, c = int(rng.integers(0, rows)), int(rng.integers(0, cols))
+        material = names[int(rng.integers(0, len(names)))]
+        if i % 50 == 49:
+            batch.append(
+                {
+                    "op": "fill_rect",
+                    "r": r,
+                    "c": c,
+                    "rows": min(8, rows - r),
+                    "cols": min(8, cols - c),
+                    "material": material,
+                }
+            )
+        else:
+            batch.append({"op": "set_pixel", "r": r, "c": c, "material": material, "depth": 0.5})
+    return batch
+
+
+def _timed(run: Callable[[], Any], repeats: int) -> Dict[str, float]:
+    times = []
+    for i in range(repeats + 1):  # the first run warms up caches
+        start = time.perf_counter()
+        run()
+        elapsed = (time.perf_counter() - start) * 1000.0
+        if i:
+            times.append(elapsed)
+    return _summary(times)
+
+
+def _summary(times: List[float]) -> Dict[str, float]:
+    return {
+        "ms": round(statistics.median(times), 3),
+        "best_ms": round(min(times), 3),
+        "repeats": len(times),
+    }
+
+
+class _FakeClient:
+    """A connection that accepts every message and counts what it got."""
+
+    def __init__(self, received: Callable[[], None]) -> None:
+        self.remote_address = ("bench", 0)
+        self.bytes = 0
+        self._received = received
+
+    async def send(self, message: str | bytes) -> None:
+        self.bytes += len(message)
+        self._received()
+
+
+async def _bench_broadcast(
+    sim: SimState, clients: int, repeats: int, solver: Solver
+) -> Dict[str, float]:
+    state = net.ServerState(sim=sim)
+    pending = 0
+    all_sent = asyncio.Event()
+
+    def received() -> None:
+        nonlocal pending
+        pending -= 1
+        if pending == 0:
+            all_sent.set()
+
+    writers = []
+    for i in range(clients):
+        ws = _FakeClient(received)
+        session = net.ClientSession(features=set(CLIENT_FEATURES[i % len(CLIENT_FEATURES)]))
+        state.sessions[ws] = session  # type: ignore[index]
+        writer = net._write_loop(ws, state, session.outbox)  # type: ignore[arg-type]
+        writers.append(asyncio.create_task(writer))
+    times = []
+    try:
+        for i in range(repeats + 1):
+            solver(sim)  # give delta-1 clients something to send
+            pending = clients
+            all_sent.clear()
+            start = time.perf_counter()
+            net._broadcast_frame(state)
+            await all_sent.wait()
+            elapsed = (time.perf_counter() - start) * 1000.0
+            if i:
+                times.append(elapsed)
+    finally:
+        for writer in writers:
+            writer.cancel()
+        await asyncio.gather(*writers, return_exceptions=True)
+    return _summary(times)
+
+
+def run_benchmarks(
+    rows: int = 512,
+    cols: int = 512,
+    solver: str = DEFAULT_SOLVER,
+    repeats: int = 5,
+    clients: int = 32,
+    edit_ops: int = 5000,
+    seed: int = 0,
+    only: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Run the benchmarks and return the result document ``--out`` writes."""
+
+    step = get_solver(solver)
+    base = synthetic_level(rows, cols, seed)
+    results: Dict[str, Dict[str, float]] = {}
+
+    def wanted(name: str) -> bool:
+        return only is None or any(name.startswith(prefix) for prefix in only)
+
+    def fresh() -> SimState:
+        return SimState(base.materials.copy(), base.depths.copy())
+
+    if wanted("flow_step"):
+        sim = fresh()
+        results["flow_step"] = _timed(lambda: step(sim), repeats)
+    if wanted("snapshot_json"):
+        sim = fresh()
+        results["snapshot_json"] = _timed(lambda: json.dumps(sim.snapshot()), repeats)
+    if wanted("apply_edits"):
+        sim = fresh()
+        batch = edit_batch(rows, cols, edit_ops, seed)
+        results["apply_edits"] = _timed(lambda: sim.apply_edits(batch), repeats)
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind, suffix in (("json", ".json"), ("binary", ".pszl")):
+            path = Path(tmp) / f"level{suffix}"
+            if wanted(f"save_level_{kind}"):
+                sim = fresh()
+                results[f"save_level_{kind}"] = _timed(lambda: save_level(path, sim), repeats)
+            if wanted(f"load_level_{kind}"):
+                save_level(path, base)
+                target = SimState()
+                results[f"load_level_{kind}"] = _timed(lambda: load_level(path, target), repeats)
+    if wanted("broadcast"):
+        results["broadcast"] = asyncio.run(_bench_broadcast(fresh(), clients, repeats, step))
+
+    return {
+        "version": BENCH_VERSION,
+        "params": {
+            "rows": rows,
+            "cols": cols,
+            "solver": solver,
+            "clients": clients,
+            "edit_ops": edit_ops,
+            "seed": seed,
+        },
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return a line for every benchmark whose median regressed beyond ``tolerance``.
+
+    Raises ``ValueError`` if the two documents were run with different
+    parameters and so cannot be compared.
+    """
+
+    if current.get("params") != baseline.get("params"):
+        raise ValueError(
+            f"baseline parameters {baseline.get('params')} differ from {current.get('params')}"
+        )
+    regressions = []
+    for name, result in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            continue
+        ratio = result["ms"] / old["ms"] if old["ms"] > 0 else float("inf")
+        if ratio > 1.0 + tolerance:
+            regressions.append(
+                f"{name}: {result['ms']:.2f} ms vs {old['ms']:.2f} ms baseline ({ratio:.2f}x)"
+            )
+    return regressions
+
+
+def main() -> None:
+    """Run the benchmarks, print them and optionally compare with a baseline."""
+
+    parser = argparse.ArgumentParser(description="Benchmark the simulator's hot paths")
+    parser.add_argument("--rows", type=int, default=512)
+    parser.add_argument("--cols", type=int, default=512)
+    parser.add_argument("--solver", choices=sorted(SOLVERS), default=DEFAULT_SOLVER)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=32, help="fake broadcast clients")
+    parser.add_argument("--edit-ops", type=int, default=5000, help="operations per edit batch")
+    parser.add_argument("--seed", type=int, default=0, help="synthetic level seed")
+    parser.add_argument(
+        "--only", nargs="+", help="run only benchmarks whose name starts with these"
+    )
+    parser.add_argument("--out", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results written by --out")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed slowdown against the baseline (0.25 = 25%%)",
+    )
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        rows=args.rows,
+        cols=args.cols,
+        solver=args.solver,
+        repeats=args.repeats,
+        clients=args.clients,
+        edit_ops=args.edit_ops,
+        seed=args.seed,
+        only=args.only,
+    )
+    for name, result in report["results"].items():
+        print(f"{name:20} {result['ms']:10.2f} ms  (best {result['best_ms']:.2f})")
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        try:
+            regressions = compare(report, baseline, args.tolerance)
+        except ValueError as exc:
+            parser.error(str(exc))
+        if regressions:
+            print("regressions against", args.baseline)
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Periodic incremental checkpoints and crash recovery.
+
+A checkpoint directory holds a base level (``base.pszl``, the binary format
+of :mod:`server.io`) and an append-only journal (``journal.bin``) of the
+rows that changed since the base was written. A checkpoint appends one
+journal record holding only the rows whose
+:attr:`~server.state.SimState.row_version` moved since the previous one, so
+its cost follows the amount of change rather than the grid size. Once the
+journal outgrows the base, the next checkpoint compacts: it writes a fresh
+base and starts an empty journal.
+
+The journal is little-endian: a header (``JOURNAL_HEADER``)::
+
+    magic      4s   b"PSZJ"
+    version    u16  1
+    flags      u16  0
+    rows       u32
+    cols       u32
+    generation u64  must equal the base's ``meta.generation``
+
+followed by records of a ``RECORD_HEADER`` (``tick`` u64, ``count`` u32,
+CRC-32 of the payload u32) and a payload of ``count`` row indices (``u32``),
+``count * cols`` material codes (``u8``) and ``count * cols`` depths
+(``f32``). Compaction bumps the generation, so a journal left over from
+before a crash in the middle of compacting is recognised and ignored, and a
+record torn by a crash fails its checksum and ends the replay.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .io import level_meta, load_level, save_level
+from .state import CODE_MATERIALS, DEPTH_DTYPE, MATERIAL_DTYPE, SimState
+
+logger = logging.getLogger(__name__)
+
+BASE_NAME = "base.pszl"
+JOURNAL_NAME = "journal.bin"
+JOURNAL_MAGIC = b"PSZJ"
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = struct.Struct("<4sHHIIQ")
+RECORD_HEADER = struct.Struct("<QII")
+
+
+@dataclass
+class Checkpoint:
+    """Grid data captured for one checkpoint, ready to be written.
+
+    ``full`` is set when the checkpoint compacts; otherwise ``rows`` holds
+    the changed row indices and ``materials``/``depths`` their contents.
+    """
+
+    tick: int
+    full: Optional[SimState] = None
+    rows: Optional[np.ndarray] = None
+    materials: Optional[np.ndarray] = None
+    depths: Optional[np.ndarray] = None
+
+
+class Checkpointer:
+    """Write checkpoints of one grid to ``directory``.
+
+    :meth:`capture` copies what changed and must run where the grid is not
+    being stepped (the event loop, or a leased worker frame); :meth:`write`
+    does the file I/O and may run on a thread. The first checkpoint always
+    compacts. ``compact_ratio`` is the journal size, relative to the size of
+    the grid planes, at which the next checkpoint compacts.
+    """
+
+    def __init__(
+        self, directory: str | Path, cm_per_pixel: float = 1.0, compact_ratio: float = 1.0
+    ) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.cm_per_pixel = cm_per_pixel
+        self.compact_ratio = compact_ratio
+        self.generation = 0
+        base = self.directory / BASE_NAME
+        if base.exists():
+            try:
+                self.generation = int(level_meta(base).get("generation", 0))
+            except (OSError, ValueError):
+                logger.warning("unreadable checkpoint base %s; overwriting it", base)
+        self._version = 0
+        self._shape: Optional[Tuple[int, int]] = None
+        self._journal_bytes = 0
+
+    def capture(self, sim: SimState, tick: int) -> Checkpoint:
+        """Return the data the next checkpoint of ``sim`` has to write."""
+
+        rows, cols = sim.shape
+        plane_bytes = rows * cols * (MATERIAL_DTYPE().itemsize + DEPTH_DTYPE().itemsize)
+        compact = (
+            self._shape != sim.shape or self._journal_bytes > self.compact_ratio * plane_bytes
+        )
+        since, self._version = self._version, sim.version
+        if compact:
+            self._shape = sim.shape
+            self._journal_bytes = 0
+            return Checkpoint(tick, full=sim.freeze())
+        changed = np.flatnonzero(sim.row_version > since)
+        self._journal_bytes += RECORD_HEADER.size + changed.size * (4 + cols * 5)
+        return Checkpoint(
+            tick, rows=changed, materials=sim.materials[changed], depths=sim.depths[changed]
+        )
+
+    def write(self, checkpoint: Checkpoint) -> None:
+        """Write ``checkpoint`` captured by :meth:`capture`.
+
+        If writing fails the next checkpoint compacts, so no change is lost.
+        """
+
+        try:
+            if checkpoint.full is not None:
+                self._compact(checkpoint.full, checkpoint.tick)
+            elif checkpoint.rows is not None and checkpoint.rows.size:
+                self._append(checkpoint)
+        except BaseException:
+            self._shape = None
+            raise
+
+    def _compact(self, sim: SimState, tick: int) -> None:
+        self.generation += 1
+        rows, cols = sim.shape
+        meta = {"generation": self.generation, "tick": tick}
+        save_level(self.directory / BASE_NAME, sim, cm_per_pixel=self.cm_per_pixel, meta=meta)
+        journal = self.directory / JOURNAL_NAME
+        tmp = journal.with_name(journal.name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(
+                JOURNAL_HEADER.pack(
+                    JOURNAL_MAGIC, JOURNAL_VERSION, 0, rows, cols, self.generation
+                )
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, journal)
+        logger.info("checkpoint compacted to %s (generation %d)", self.directory, self.generation)
+
+    def _append(self, checkpoint: Checkpoint) -> None:
+        assert checkpoint.rows is not None
+        assert checkpoint.materials is not None and checkpoint.depths is not None
+        payload = b"".join(
+            (
+                checkpoint.rows.astype("<u4").tobytes(),
+                np.ascontiguousarray(checkpoint.materials).tobytes(),
+                np.ascontiguousarray(checkpoint.depths, dtype="<f4").tobytes(),
+            )
+        )
+        record = RECORD_HEADER.pack(checkpoint.tick, checkpoint.rows.size, zlib.crc32(payload))
+        with open(self.directory / JOURNAL_NAME, "ab") as f:
+            f.write(record + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def resume(directory: str | Path, sim: SimState) -> Tuple[float, int]:
+    """Rebuild ``sim`` from the base and journal in ``directory``.
+
+    Returns ``(cm_per_pixel, tick)`` of the latest checkpoint. Raises
+    ``FileNotFoundError`` if there is no base. Journal records after a torn
+    or corrupt one are ignored.
+    """
+
+    directory = Path(directory)
+    base = directory / BASE_NAME
+    meta = level_meta(base)
+    cm_per_pixel = load_level(base, sim)
+    tick = int(meta.get("tick", 0))
+    rows, cols = sim.shape
+    journal = directory / JOURNAL_NAME
+    if not journal.exists():
+        return cm_per_pixel, tick
+    with open(journal, "rb") as f:
+        header = f.read(JOURNAL_HEADER.size)
+        if len(header) < JOURNAL_HEADER.size:
+            logger.warning("%s: truncated journal header; using the base only", journal)
+            return cm_per_pixel, tick
+        magic, version, _flags, j_rows, j_cols, generation = JOURNAL_HEADER.unpack(header)
+        if (
+            magic != JOURNAL_MAGIC
+            or version != JOURNAL_VERSION
+            or (j_rows, j_cols) != (rows, cols)
+            or generation != meta.get("generation")
+        ):
+            logger.warning("%s does not belong to %s; using the base only", journal, base)
+            return cm_per_pixel, tick
+        applied = 0
+        while True:
+            head = f.read(RECORD_HEADER.size)
+            if not head:
+                break
+            if len(head) < RECORD_HEADER.size:
+                logger.warning("%s: torn record after %d records", journal, applied)
+                break
+            record_tick, count, crc = RECORD_HEADER.unpack(head)
+            payload = f.read(count * (4 + cols * 5))
+            if len(payload) < count * (4 + cols * 5) or zlib.crc32(payload) != crc:
+                logger.warning("%s: torn record after %d records", journal, applied)
+                break
+            index = np.frombuffer(payload, dtype="<u4", count=count)
+            if count and int(index.max()) >= rows:
+                logger.warning("%s: bad row index after %d records", journal, applied)
+                break
+            cells = count * cols
+            materials = np.frombuffer(payload, dtype=MATERIAL_DTYPE, count=cells, offset=4 * count)
+            depths = np.frombuffer(payload, dtype="<f4", count=cells, offset=4 * count + cells)
+            if cells and int(materials.max()) >= len(CODE_MATERIALS):
+                logger.warning("%s: bad material code after %d records", journal, applied)
+                break
+            sim.writable("materials")[index] = materials.reshape(count, cols)
+            sim.writable("depths")[index] = depths.reshape(count, cols)
+            tick = record_tick
+            applied += 1
+    sim.touch_terrain()
+    sim.mark_rows(slice(None))
+    logger.info("resumed from %s at tick %d (%d journal records)", directory, tick, applied)
+    return cm_per_pixel, tick
@@ -0,0 +1,71 @@
+"""Change detection for ``delta-1`` snapshots.
+
+:class:`DeltaTracker` keeps a copy of the grid as it was last broadcast and
+uses :attr:`SimState.row_version` to compare only rows stamped as changed
+since then, so the cost of a delta scales with the number of dirty rows
+rather than with the grid size.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+from .state import SimState
+
+
+@dataclass
+class CellChanges:
+    """Cells whose material or depth differ from the previous frame."""
+
+    rows: np.ndarray
+    cols: np.ndarray
+    materials: np.ndarray
+    depths: np.ndarray
+
+    def __len__(self) -> int:
+        return int(self.rows.size)
+
+
+@dataclass
+class DeltaTracker:
+    """Compute per-frame cell changes against the previously sent grid."""
+
+    materials: Optional[np.ndarray] = field(default=None, repr=False)
+    depths: Optional[np.ndarray] = field(default=None, repr=False)
+    seen_version: int = 0
+
+    def reset(self) -> None:
+        """Forget the previous frame; the next :meth:`diff` returns ``None``."""
+
+        self.materials = None
+        self.depths = None
+
+    def diff(self, sim: SimState) -> Optional[CellChanges]:
+        """Return cells changed since the last call and remember the new grid.
+
+        Returns ``None`` when there is no usable previous frame (first call,
+        after :meth:`reset` or when the grid shape changed); receivers then
+        need a full keyframe.
+        """
+
+        if self.materials is None or self.depths is None or self.materials.shape != sim.shape:
+            self.materials = sim.materials.copy()
+            self.depths = sim.depths.copy()
+            self.seen_version = sim.version
+            return None
+
+        dirty = np.flatnonzero(sim.row_version > self.seen_version)
+        self.seen_version = sim.version
+        new_m = sim.materials[dirty]
+        new_d = sim.depths[dirty]
+        changed = (new_m != self.materials[dirty]) | (new_d != self.depths[dirty])
+        rr, cc = np.nonzero(changed)
+        rows = dirty[rr]
+        materials = new_m[rr, cc]
+        depths = new_d[rr, cc]
+        self.materials[rows, cc] = materials
+        self.depths[rows, cc] = depths
+        return CellChanges(rows, cc, materials, depths)
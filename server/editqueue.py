@@ -0,0 +1,129 @@
+"""Tick-aligned queue of pending ``edit_grid`` batches.
+
+Connection handlers never write to the grid. They :meth:`~EditQueue.put`
+each batch into an :class:`EditQueue`, and whatever steps the simulation
+(the in-loop tick task or the :class:`~server.worker.SimulationWorker`)
+calls :meth:`~EditQueue.drain` once at the start of each step, so edits
+land between ticks and never while a snapshot is being built.
+
+A drain applies the queued batches with
+:meth:`~server.state.SimState.apply_batches`, which coalesces runs of
+``set_pixel`` operations (the last write to a cell wins). It stops at
+``tick_budget`` operations, leaving later batches for the next tick, so a
+burst of edits is spread over several ticks instead of stretching one.
+``client_limit`` caps the operations one client may have waiting; batches
+beyond it are refused, which keeps a flooding client from crowding out the
+others.
+"""
+
+from __future__ import annotations
+
+import collections
+import threading
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from .state import SimState
+
+EditResult = Optional[Dict[str, str]]
+# A queued batch: the client it came from, its operations and the callback
+# receiving its result.
+_Batch = Tuple[Hashable, List[Dict[str, Any]], Callable[[EditResult], None]]
+
+
+class EditQueue:
+    """Edit batches waiting for the next tick, safe to use from any thread.
+
+    A batch is never split, so a drain applies at least one batch even if
+    it alone exceeds ``tick_budget``. ``applied_ops`` and ``rejected_ops``
+    (by error code) count the operations of the batches drained so far and
+    ``refused_ops`` those :meth:`put` turned away.
+    """
+
+    def __init__(self, tick_budget: int = 10000, client_limit: int = 50000) -> None:
+        self.tick_budget = tick_budget
+        self.client_limit = client_limit
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+        self._batches: Deque[_Batch] = collections.deque()
+        self._pending: Dict[Hashable, int] = {}
+        self.applied_ops = 0
+        self.rejected_ops: Dict[str, int] = {}
+        self.refused_ops = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._batches)
+
+    def pending(self, client: Hashable) -> int:
+        """Return how many operations of ``client`` are waiting."""
+
+        with self._lock:
+            return self._pending.get(client, 0)
+
+    def put(
+        self,
+        client: Hashable,
+        edits: List[Dict[str, Any]],
+        done: Callable[[EditResult], None],
+    ) -> bool:
+        """Queue ``edits`` from ``client``; ``done`` receives the result.
+
+        ``done`` is called on the draining thread. Returns ``False``, without
+        queueing anything, if the batch would take ``client`` over
+        ``client_limit`` waiting operations.
+        """
+
+        with self._lock:
+            pending = self._pending.get(client, 0) + len(edits)
+            if pending > self.client_limit:
+                self.refused_ops += len(edits)
+                return False
+            self._pending[client] = pending
+            self._batches.append((client, edits, done))
+            self._queued.notify()
+        return True
+
+    def wait(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for a batch; return whether one is queued."""
+
+        with self._queued:
+            if not self._batches and timeout > 0:
+                self._queued.wait(timeout)
+            return bool(self._batches)
+
+    def drain(self, sim: SimState, recorder: Any = None, tick: int = 0) -> int:
+        """Apply queued batches to ``sim`` up to ``tick_budget`` operations.
+
+        Each batch is handed to ``recorder`` (a
+        :class:`~server.replay.Recorder`) at ``tick`` first. Returns the
+        number of batches applied.
+        """
+
+        taken: List[_Batch] = []
+        with self._lock:
+            ops = 0
+            while self._batches:
+                client, edits, _done = self._batches[0]
+                if taken and ops + len(edits) > self.tick_budget:
+                    break
+                taken.append(self._batches.popleft())
+                ops += len(edits)
+                left = self._pending[client] - len(edits)
+                if left:
+                    self._pending[client] = left
+                else:
+                    del self._pending[client]
+        if not taken:
+            return 0
+        if recorder is not None:
+            for _client, edits, _done in taken:
+                recorder.edits(tick, edits)
+        results = sim.apply_batches([edits for _client, edits, _done in taken])
+        for (_client, edits, done), result in zip(taken, results):
+            if result is None:
+                self.applied_ops += len(edits)
+            else:
+                code = result["code"]
+                self.rejected_ops[code] = self.rejected_ops.get(code, 0) + len(edits)
+            done(result)
+        return len(taken)
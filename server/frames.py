@@ -0,0 +1,212 @@
+"""Per-frame message encoding shared between sessions.
+
+A :class:`FrameCache` is built once per broadcast frame and hands out the
+encoded message for each combination of viewport, delta/full, JSON/binary
+and compression, encoding every combination at most once. Viewports are
+rounded out to :data:`TILE`-sized tiles. JSON snapshots, the expensive
+encoding, are assembled from per-tile row fragments so that sessions whose
+viewports overlap share the tile encodings even when their windows differ.
+Binary windows and deltas are cached per exact window only: they are a
+slice copy of the planes, which is cheaper than stitching tiles together.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from . import wire
+from .delta import CellChanges
+from .state import CODE_MATERIALS, SimState, depth_values
+
+# ``(r0, c0, r1, c1)`` with exclusive ends.
+Region = wire.Window
+
+# Edge length of the square tiles viewports are rounded out to.
+TILE = 32
+
+_CELL_JSON = '{{"material": "{}", "depth": {!r}}}'
+_DELTA_CELL_JSON = '{{"r": {}, "c": {}, "material": "{}", "depth": {!r}}}'
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def tile_region(
+    r: int, c: int, rows: int, cols: int, shape: Tuple[int, int]
+) -> Optional[Region]:
+    """Round a viewport out to tile boundaries and clip it to ``shape``.
+
+    Returns ``None`` when the viewport lies entirely outside the grid.
+    """
+
+    r0 = max(0, r) // TILE * TILE
+    c0 = max(0, c) // TILE * TILE
+    r1 = min(shape[0], -(-(r + rows) // TILE) * TILE)
+    c1 = min(shape[1], -(-(c + cols) // TILE) * TILE)
+    if r0 >= r1 or c0 >= c1:
+        return None
+    return r0, c0, r1, c1
+
+
+@dataclass
+class FrameCache:
+    """Encoded messages for one broadcast frame."""
+
+    sim: SimState
+    frame: int
+    tick: int
+    seq: Iterator[int]
+    cm_per_pixel: float
+    meta: Dict[str, Any]
+    changes: Optional[CellChanges] = None
+    compressor: Optional[wire.Compressor] = None
+    _messages: Dict[Tuple[Any, ...], str | bytes] = field(default_factory=dict)
+    _tiles: Dict[Tuple[int, int], List[str]] = field(default_factory=dict)
+    _regional: Dict[Region, CellChanges] = field(default_factory=dict)
+
+    @property
+    def encoded_tiles(self) -> int:
+        """Number of distinct tiles encoded for JSON windows so far."""
+
+        return len(self._tiles)
+
+    @property
+    def encoded_messages(self) -> int:
+        """Number of distinct messages encoded so far."""
+
+        return len(self._messages)
+
+    def message(
+        self, region: Optional[Region], delta: bool, binary: bool, compress: bool
+    ) -> str | bytes:
+        """Return the frame for ``region`` (``None`` is the whole grid).
+
+        A region is always sent as a window, with its origin, even when it
+        covers the whole grid. ``delta`` requires :attr:`changes`;
+        ``compress`` requires :attr:`compressor`.
+        """
+
+        key = (region, delta, binary, compress)
+        message = self._messages.get(key)
+        if message is not None:
+            return message
+        if compress:
+            assert self.compressor is not None
+            message = self.compressor.compress(self.message(region, delta, binary, False))
+        elif binary:
+            message = self._encode_binary(region, delta)
+        elif delta:
+            message = self._encode_delta_json(region)
+        else:
+            message = self._encode_full_json(region)
+        self._messages[key] = message
+        return message
+
+    def _region_changes(self, region: Optional[Region]) -> CellChanges:
+        changes = self.changes
+        assert changes is not None
+        if region is None:
+            return changes
+        cached = self._regional.get(region)
+        if cached is None:
+            r0, c0, r1, c1 = region
+            inside = (
+                (changes.rows >= r0)
+                & (changes.rows < r1)
+                & (changes.cols >= c0)
+                & (changes.cols < c1)
+            )
+            cached = CellChanges(
+                changes.rows[inside],
+                changes.cols[inside],
+                changes.materials[inside],
+                changes.depths[inside],
+            )
+            self._regional[region] = cached
+        return cached
+
+    def _header(self) -> Dict[str, Any]:
+        return {"seq": str(next(self.seq)), "ts": _now_ms(), "frame": self.frame}
+
+    def _encode_binary(self, region: Optional[Region], delta: bool) -> bytes:
+        header = wire.FrameHeader(
+            seq=next(self.seq),
+            ts=_now_ms(),
+            frame=self.frame,
+            tick=self.tick,
+            cm_per_pixel=self.cm_per_pixel,
+            solve_ms=float(self.meta.get("solve_ms", 0.0)),
+            tick_lag_ms=float(self.meta.get("tick_lag_ms", 0.0)),
+        )
+        if delta:
+            return wire.encode_delta(
+                self.sim, self._region_changes(region), header, window=region
+            )
+        return wire.encode_full(self.sim, header, window=region)
+
+    def _encode_full_json(self, region: Optional[Region]) -> str:
+        if region is None:
+            cells = self.sim.snapshot()["grid"]
+            payload = {
+                "t": "snapshot",
+                **self._header(),
+                "grid": {"cm_per_pixel": self.cm_per_pixel, "cells": cells},
+                "meta": self.meta,
+            }
+            return json.dumps(payload)
+
+        r0, c0, r1, c1 = region
+        tile_cols = range(c0 // TILE, -(-c1 // TILE))
+        rows = []
+        for r in range(r0, r1):
+            tr, offset = divmod(r, TILE)
+            rows.append(
+                "[" + ",".join(self._tile(tr, tc)[offset] for tc in tile_cols) + "]"
+            )
+        grid = json.dumps(
+            {
+                "cm_per_pixel": self.cm_per_pixel,
+                "origin": [r0, c0],
+                "rows": r1 - r0,
+                "cols": c1 - c0,
+            }
+        )
+        head = json.dumps({"t": "snapshot", **self._header(), "meta": self.meta})
+        return f'{head[:-1]}, "grid": {grid[:-1]}, "cells": [{",".join(rows)}]}}}}'
+
+    def _tile(self, tr: int, tc: int) -> List[str]:
+        """Return the JSON text of each row of tile ``(tr, tc)``, without brackets."""
+
+        fragments = self._tiles.get((tr, tc))
+        if fragments is None:
+            sl = (slice(tr * TILE, (tr + 1) * TILE), slice(tc * TILE, (tc + 1) * TILE))
+            names = CODE_MATERIALS
+            fragments = [
+                ",".join(_CELL_JSON.format(names[m], d) for m, d in zip(mrow, drow))
+                for mrow, drow in zip(
+                    self.sim.materials[sl].tolist(), depth_values(self.sim.depths[sl])
+                )
+            ]
+            self._tiles[tr, tc] = fragments
+        return fragments
+
+    def _encode_delta_json(self, region: Optional[Region]) -> str:
+        changes = self._region_changes(region)
+        names = CODE_MATERIALS
+        cells = ",".join(
+            _DELTA_CELL_JSON.format(r, c, names[m], d)
+            for r, c, m, d in zip(
+                changes.rows.tolist(),
+                changes.cols.tolist(),
+                changes.materials.tolist(),
+                depth_values(changes.depths),
+            )
+        )
+        head = json.dumps(
+            {"t": "delta", **self._header(), "base": self.frame - 1, "meta": self.meta}
+        )
+        return f'{head[:-1]}, "cells": [{cells}]}}'
@@ -1,34 +1,246 @@
-"""Input/output utilities for the server."""
+"""Input/output utilities for the server.
+
+Levels are stored as JSON (any extension) or, for large grids, in the binary
+level format (``.pszl``); the format is chosen by file extension. A binary
+level is a little-endian header (``LEVEL_HEADER``)::
+
+    magic        4s   b"PSZL"
+    version      u16  1
+    flags        u16  0
+    rows         u32
+    cols         u32
+    cm_per_pixel f64
+    meta_len     u32  length of the UTF-8 JSON ``meta`` that follows
+
+followed by the ``meta`` bytes, zero padding to an 8-byte boundary, the
+``rows * cols`` material codes (``u8``), zero padding to a 4-byte boundary
+and the ``rows * cols`` depths (``f32``), both row-major. Loading memory-maps
+the planes copy-on-write, so a level is paged in as the simulation touches
+it and edits never reach the file.
+
+JSON levels whose name ends in ``.gz`` are gzip-compressed. Saves write a
+temporary file next to the target and rename it into place, so readers see
+either the old file or the complete new one.
+
+``python -m server.io SRC DST`` converts between the two formats.
+"""
 
 from __future__ import annotations
 
+import argparse
+import contextlib
+import gzip
 import json
+import os
+import struct
 from pathlib import Path
-from typing import Any
+from typing import IO, Any, Iterator, Tuple
+
+import numpy as np
+
+from .jsonstream import ROW, iter_level, write_level
+from .state import (
+    CODE_MATERIALS,
+    DEPTH_DTYPE,
+    MATERIAL_CODES,
+    MATERIAL_DTYPE,
+    SPACE,
+    SimState,
+    depth_values,
+)
+
+
+BINARY_LEVEL_SUFFIX = ".pszl"
+GZIP_SUFFIX = ".gz"
+LEVEL_MAGIC = b"PSZL"
+LEVEL_VERSION = 1
+LEVEL_HEADER = struct.Struct("<4sHHIIdI")
+
+
+def _plane_offsets(rows: int, cols: int, meta_len: int) -> Tuple[int, int]:
+    """Return the file offsets of the material and depth planes."""
+
+    materials = -(-(LEVEL_HEADER.size + meta_len) // 8) * 8
+    depths = -(-(materials + rows * cols) // 4) * 4
+    return materials, depths
+
+
+def _read_binary_header(path: Path) -> Tuple[int, int, float, int, bytes]:
+    """Return ``(rows, cols, cm_per_pixel, meta_len, meta)`` of a binary level."""
+
+    with open(path, "rb") as f:
+        header = f.read(LEVEL_HEADER.size)
+        if len(header) < LEVEL_HEADER.size:
+            raise ValueError(f"{path}: truncated level header")
+        magic, version, _flags, rows, cols, cm_per_pixel, meta_len = LEVEL_HEADER.unpack(
+            header
+        )
+        if magic != LEVEL_MAGIC or version != LEVEL_VERSION:
+            raise ValueError(f"{path}: not a version {LEVEL_VERSION} binary level")
+        meta = f.read(meta_len)
+    return rows, cols, cm_per_pixel, meta_len, meta
+
+
+def _load_binary_level(path: Path, sim: SimState) -> float:
+    rows, cols, cm_per_pixel, meta_len, _meta = _read_binary_header(path)
+    m_off, d_off = _plane_offsets(rows, cols, meta_len)
+    if path.stat().st_size < d_off + 4 * rows * cols:
+        raise ValueError(f"{path}: truncated level planes")
+    if rows * cols == 0:
+        sim.clear(rows, cols)
+        return cm_per_pixel
+    shape = (rows, cols)
+    materials = np.memmap(path, dtype=MATERIAL_DTYPE, mode="c", offset=m_off, shape=shape)
+    depths = np.memmap(path, dtype="<f4", mode="c", offset=d_off, shape=shape)
+    if materials.max() >= len(CODE_MATERIALS):
+        raise ValueError(f"{path}: unknown material code")
+    sim.set_planes(materials, depths)
+    return cm_per_pixel
+
+
+def _save_binary_level(
+    path: Path, sim: SimState, cm_per_pixel: float, meta: dict[str, Any] | None
+) -> None:
+    meta_bytes = json.dumps(meta).encode("utf-8") if meta else b""
+    rows, cols = sim.shape
+    m_off, d_off = _plane_offsets(rows, cols, len(meta_bytes))
+    # The old file may be memory-mapped by a loaded level; never overwrite it
+    # in place.
+    with _replacing(path) as tmp, open(tmp, "wb") as f:
+        f.write(
+            LEVEL_HEADER.pack(
+                LEVEL_MAGIC, LEVEL_VERSION, 0, rows, cols, cm_per_pixel, len(meta_bytes)
+            )
+        )
+        f.write(meta_bytes)
+        f.write(bytes(m_off - f.tell()))
+        np.ascontiguousarray(sim.materials).tofile(f)
+        f.write(bytes(d_off - f.tell()))
+        np.ascontiguousarray(sim.depths, dtype="<f4").tofile(f)
+
+
+@contextlib.contextmanager
+def _replacing(path: Path) -> Iterator[Path]:
+    """Yield a temporary path that replaces ``path`` once the block succeeds."""
+
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+
+
+def _open_text(path: Path, mode: str, compressed: bool) -> IO[str]:
+    if compressed:
+        return gzip.open(path, mode + "t", encoding="utf-8")  # type: ignore[return-value]
+    return open(path, mode, encoding="utf-8")
+
 
-from .state import Pixel, SimState
+class _PlaneBuilder:
+    """Material and depth planes grown one row at a time.
+
+    Capacity starts at the document's ``rows``/``cols`` when they precede
+    the grid and doubles when rows turn out longer or more numerous.
+    """
+
+    def __init__(self, rows_hint: int = 0, cols_hint: int = 0) -> None:
+        self.rows = 0
+        self.cols = 0
+        self.materials = np.full((rows_hint, cols_hint), SPACE, dtype=MATERIAL_DTYPE)
+        self.depths = np.zeros((rows_hint, cols_hint), dtype=DEPTH_DTYPE)
+
+    def _reserve(self, rows: int, cols: int) -> None:
+        cap_rows, cap_cols = self.materials.shape
+        if rows <= cap_rows and cols <= cap_cols:
+            return
+        if rows > cap_rows:
+            cap_rows = max(rows, 2 * cap_rows)
+        if cols > cap_cols:
+            cap_cols = max(cols, 2 * cap_cols)
+        materials = np.full((cap_rows, cap_cols), SPACE, dtype=MATERIAL_DTYPE)
+        depths = np.zeros((cap_rows, cap_cols), dtype=DEPTH_DTYPE)
+        old_rows, old_cols = self.materials.shape
+        materials[:old_rows, :old_cols] = self.materials
+        depths[:old_rows, :old_cols] = self.depths
+        self.materials, self.depths = materials, depths
+
+    def add(self, row: Any) -> None:
+        cells = row if isinstance(row, list) else []
+        n = len(cells)
+        self._reserve(self.rows + 1, n)
+        r = self.rows
+        self.materials[r, :n] = [
+            MATERIAL_CODES.get(str(cell.get("material", "space")), SPACE) for cell in cells
+        ]
+        self.depths[r, :n] = [float(cell.get("depth", 0.0)) for cell in cells]
+        self.rows += 1
+        self.cols = max(self.cols, n)
+
+    def planes(self) -> Tuple[np.ndarray, np.ndarray]:
+        shape = (self.rows, self.cols)
+        if self.materials.shape == shape:
+            return self.materials, self.depths
+        r, c = shape
+        return self.materials[:r, :c].copy(), self.depths[:r, :c].copy()
 
 
-def load_level(path: str | Path, sim: SimState) -> None:
-    """Load a level file into ``sim``.
+def _size_hint(header: dict[str, Any]) -> Tuple[int, int]:
+    """Return the declared ``(rows, cols)`` if they are plausible, else zeros."""
+
+    rows, cols = header.get("rows"), header.get("cols")
+    if isinstance(rows, int) and isinstance(cols, int) and 0 < rows * cols <= 1 << 28:
+        return rows, cols
+    return 0, 0
+
+
+def load_level(path: str | Path, sim: SimState) -> float:
+    """Load a level file into ``sim`` and return its ``cm_per_pixel``.
+
+    ``.pszl`` files are read as binary levels (see the module docstring),
+    anything else as JSON (gzip-compressed if the name ends in ``.gz``).
 
     The level schema is a JSON document containing only ``rows``, ``cols``,
     ``cm_per_pixel`` and a two-dimensional ``grid`` array. Each grid cell
     stores ``material`` and ``depth`` fields. Unknown fields are ignored to
-    allow forward compatibility.
+    allow forward compatibility. Short rows are padded with dry ``space`` and
+    unknown materials load as ``space``. The document is read row by row
+    (see :mod:`server.jsonstream`), so memory use is bounded by the grid
+    planes plus one row of JSON.
     """
 
-    data: dict[str, Any] = json.loads(Path(path).read_text(encoding="utf-8"))
-    grid_data = data.get("grid") or data.get("pixels")
-    if not isinstance(grid_data, list):
-        grid_data = []
-    sim.grid = [
-        [
-            Pixel(str(cell.get("material", "space")), float(cell.get("depth", 0.0)))
-            for cell in row
-        ]
-        for row in grid_data
-    ]
+    path = Path(path)
+    if path.suffix == BINARY_LEVEL_SUFFIX:
+        return _load_binary_level(path, sim)
+    header: dict[str, Any] = {}
+    builder: _PlaneBuilder | None = None
+    with _open_text(path, "r", path.suffix == GZIP_SUFFIX) as f:
+        for key, value in iter_level(f):
+            if key is ROW:
+                if builder is None:
+                    builder = _PlaneBuilder(*_size_hint(header))
+                builder.add(value)
+            else:
+                header[key] = value
+    if builder is None:
+        builder = _PlaneBuilder()
+    sim.set_planes(*builder.planes())
+    return float(header.get("cm_per_pixel", 1.0))
+
+
+def level_meta(path: str | Path) -> dict[str, Any]:
+    """Return the ``meta`` stored with a level (empty if there is none)."""
+
+    path = Path(path)
+    if path.suffix == BINARY_LEVEL_SUFFIX:
+        meta = _read_binary_header(path)[4]
+        return json.loads(meta) if meta else {}
+    with _open_text(path, "r", path.suffix == GZIP_SUFFIX) as f:
+        for key, value in iter_level(f):
+            if key == "meta" and isinstance(value, dict):
+                return value
+    return {}
 
 
 def save_level(
@@ -38,20 +250,54 @@ def save_level(
     cm_per_pixel: float = 1.0,
     meta: dict[str, Any] | None = None,
 ) -> None:
-    """Export ``sim`` to ``path`` using the level JSON format."""
-
-    rows = len(sim.grid)
-    cols = len(sim.grid[0]) if rows else 0
-    data: dict[str, Any] = {
-        "rows": rows,
-        "cols": cols,
-        "cm_per_pixel": cm_per_pixel,
-        "grid": [
-            [{"material": cell.material, "depth": cell.depth} for cell in row]
-            for row in sim.grid
-        ],
-    }
+    """Export ``sim`` to ``path``; ``.pszl`` paths get the binary format.
+
+    JSON is written one row at a time (see :mod:`server.jsonstream`) and
+    gzip-compressed for ``.gz`` paths. The file is replaced atomically.
+    """
+
+    path = Path(path)
+    if path.suffix == BINARY_LEVEL_SUFFIX:
+        _save_binary_level(path, sim, cm_per_pixel, meta)
+        return
+    if path.suffixes[-2:] == [BINARY_LEVEL_SUFFIX, GZIP_SUFFIX]:
+        raise ValueError("binary levels cannot be compressed")
+    rows, cols = sim.shape
+    header: dict[str, Any] = {"rows": rows, "cols": cols, "cm_per_pixel": cm_per_pixel}
     if meta:
-        data["meta"] = meta
-    Path(path).write_text(json.dumps(data), encoding="utf-8")
+        header["meta"] = meta
+    names = CODE_MATERIALS
+
+    def grid_rows() -> Iterator[list[dict[str, Any]]]:
+        for r in range(rows):
+            yield [
+                {"material": names[m], "depth": d}
+                for m, d in zip(sim.materials[r].tolist(), depth_values(sim.depths[r]))
+            ]
+
+    with _replacing(path) as tmp, _open_text(
+        tmp, "w", path.suffix == GZIP_SUFFIX
+    ) as f:
+        write_level(f, header, grid_rows())
+
+
+def convert_level(src: str | Path, dst: str | Path) -> None:
+    """Convert a level between the JSON and binary formats."""
+
+    sim = SimState()
+    cm_per_pixel = load_level(src, sim)
+    save_level(dst, sim, cm_per_pixel=cm_per_pixel)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert a level between JSON and the binary .pszl format"
+    )
+    parser.add_argument("src", help="level to read")
+    parser.add_argument("dst", help="level to write; the extension picks the format")
+    args = parser.parse_args()
+    convert_level(args.src, args.dst)
+
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Row-by-row reading and writing of JSON level documents.
+
+A level document is one JSON object whose ``grid`` (or legacy ``pixels``)
+member is an array of rows. :func:`iter_level` yields the top-level members
+and the grid rows one at a time, holding only the text of the current row in
+memory, and :func:`write_level` writes rows as they are produced. Together
+they let levels far larger than the parse tree that ``json.load`` would build
+be imported and exported.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import IO, Any, Dict, Iterable, Iterator, Tuple
+
+# Members holding the grid rows, in order of preference.
+GRID_KEYS = ("grid", "pixels")
+
+# Characters read from the file at a time.
+READ_SIZE = 1 << 16
+
+# Event kind yielded by :func:`iter_level` for each grid row.
+ROW = object()
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+_DECODER = json.JSONDecoder()
+
+
+class _Reader:
+    """Buffered view of a text stream with a read position."""
+
+    def __init__(self, fp: IO[str]) -> None:
+        self.fp = fp
+        self.text = ""
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        chunk = self.fp.read(READ_SIZE)
+        if not chunk:
+            return False
+        self.text = self.text[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character ("" at the end)."""
+
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()  # type: ignore[union-attr]
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self._fill():
+                return ""
+
+    def take(self, expected: str) -> str:
+        """Consume the next character, which must be one of ``expected``."""
+
+        char = self.peek()
+        if not char or char not in expected:
+            raise ValueError(f"expected one of {expected!r} in level JSON, got {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self) -> Any:
+        """Decode the next JSON value, reading more text as needed."""
+
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next read.
+            if (
+                isinstance(value, (int, float))
+                and _NUMBER_TAIL.match(self.text, end).end() == len(self.text)  # type: ignore[union-attr]
+                and self._fill()
+            ):
+                continue
+            self.pos = end
+            return value
+
+
+def iter_level(fp: IO[str]) -> Iterator[Tuple[Any, Any]]:
+    """Yield ``(key, value)`` for each top-level member of a level document.
+
+    The rows of the first :data:`GRID_KEYS` member are yielded one by one as
+    ``(ROW, row)`` instead of as a single value. Raises ``ValueError`` for
+    malformed documents.
+    """
+
+    reader = _Reader(fp)
+    reader.take("{")
+    if reader.peek() == "}":
+        return
+    streamed = False
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise ValueError("level JSON keys must be strings")
+        reader.take(":")
+        if key in GRID_KEYS and not streamed and reader.peek() == "[":
+            streamed = True
+            reader.take("[")
+            if reader.peek() == "]":
+                reader.take("]")
+            else:
+                while True:
+                    yield ROW, reader.value()
+                    if reader.take(",]") == "]":
+                        break
+        else:
+            yield key, reader.value()
+        if reader.take(",}") == "}":
+            return
+
+
+def write_level(fp: IO[str], header: Dict[str, Any], rows: Iterable[Any]) -> None:
+    """Write a level document with ``header`` members followed by ``grid``.
+
+    ``rows`` is consumed lazily, one row at a time.
+    """
+
+    fp.write("{")
+    for key, value in header.items():
+        fp.write(f"{json.dumps(key)}: {json.dumps(value)}, ")
+    fp.write('"grid": [')
+    for i, row in enumerate(rows):
+        if i:
+            fp.write(", ")
+        fp.write(json.dumps(row))
+    fp.write("]}")
@@ -0,0 +1,152 @@
+"""Server metrics in the Prometheus text exposition format.
+
+The health app serves ``GET /metrics`` (see :func:`server.net.start_server`)
+from a :class:`Metrics` collection of :class:`Histogram` timings plus
+counters and gauges read from the server state at scrape time.
+
+Recording is cheap enough to stay on at full tick rate: an observation is a
+bisection over a handful of bucket bounds and two additions, with no locks.
+Every histogram has a single writer (the thread stepping the simulation,
+or the event loop), and a scrape copies the buckets without stopping it,
+so a scrape racing an observation may see the bucket counts and the sum
+one observation apart, which Prometheus tolerates.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Default bucket bounds in seconds, 100 µs to 10 s.
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025)
+TIME_BUCKETS += (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+Labels = Dict[str, str]
+
+
+class Histogram:
+    """Cumulative histogram of observed values with fixed bucket bounds."""
+
+    def __init__(
+        self, name: str, description: str, buckets: Sequence[float] = TIME_BUCKETS
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.bounds = tuple(buckets)
+        # One slot per bound plus the overflow (``+Inf``) slot.
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record one observation of ``value``."""
+
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def render(self) -> List[str]:
+        """Return the exposition lines of the histogram."""
+
+        counts = list(self.counts)
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        total = 0
+        for bound, n in zip(self.bounds + (math.inf,), counts):
+            total += n
+            le = "+Inf" if bound == math.inf else repr(bound)
+            lines.append(f'{self.name}_bucket{{le="{le}"}} {total}')
+        lines.append(f"{self.name}_sum {self.sum!r}")
+        lines.append(f"{self.name}_count {total}")
+        return lines
+
+
+def render_family(
+    name: str, description: str, kind: str, samples: Iterable[Tuple[Labels, float]]
+) -> List[str]:
+    """Return the exposition lines of a counter or gauge family."""
+
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if labels:
+            text = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+            lines.append(f"{name}{{{text}}} {_number(value)}")
+        else:
+            lines.append(f"{name} {_number(value)}")
+    return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+@dataclass
+class Metrics:
+    """Timing histograms recorded by the tick and broadcast paths.
+
+    ``loop_lag`` is recorded by :class:`~server.trace.LoopMonitor`.
+    """
+
+    tick_solve: Histogram = field(
+        default_factory=lambda: Histogram(
+            "pszcz_tick_solve_seconds", "Time the solver took for one tick."
+        )
+    )
+    snapshot_build: Histogram = field(
+        default_factory=lambda: Histogram(
+            "pszcz_snapshot_build_seconds",
+            "Time to prepare a broadcast frame (delta diff and frame cache).",
+        )
+    )
+    encode: Histogram = field(
+        default_factory=lambda: Histogram(
+            "pszcz_snapshot_encode_seconds",
+            "Time spent encoding the messages of one broadcast frame.",
+        )
+    )
+    fanout: Histogram = field(
+        default_factory=lambda: Histogram(
+            "pszcz_broadcast_fanout_seconds",
+            "Time to queue one frame for every session, encoding excluded.",
+        )
+    )
+    save: Histogram = field(
+        default_factory=lambda: Histogram(
+            "pszcz_save_seconds", "Time to write one save file."
+        )
+    )
+
+    loop_lag: Histogram = field(
+        default_factory=lambda: Histogram(
+            "pszcz_loop_lag_seconds", "How late the event loop woke from a short sleep."
+        )
+    )
+
+    def histograms(self) -> Tuple[Histogram, ...]:
+        return (
+            self.tick_solve,
+            self.snapshot_build,
+            self.encode,
+            self.fanout,
+            self.save,
+            self.loop_lag,
+        )
+
+    def render(self, families: Iterable[List[str]] = ()) -> str:
+        """Return the exposition text of the histograms and extra ``families``."""
+
+        lines: List[str] = []
+        for histogram in self.histograms():
+            lines.extend(histogram.render())
+        for family in families:
+            lines.extend(family)
+        return "\n".join(lines) + "\n"
@@ -9,14 +9,28 @@ import logging
 import time
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, AsyncIterator, Dict, Protocol, Set
+from typing import Any, AsyncIterator, Dict, Iterator, List, Protocol, Set, Tuple
 
+import numpy as np
 import websockets  # type: ignore[import-not-found]
 from aiohttp import web
 
 from . import __version__
+from . import checkpoint
+from .delta import CellChanges, DeltaTracker
+from .editqueue import EditQueue, EditResult
+from .frames import FrameCache, Region, tile_region
 from .io import load_level, save_level
-from .state import Pixel, SimState
+from .metrics import CONTENT_TYPE, Metrics, render_family
+from .outbox import Outbox, OutboxOverflow
+from .parallel import BandedSolver
+from .profiling import add_routes as add_profiling_routes
+from .replay import Recorder
+from .state import SimState
+from .trace import LoopMonitor, SpanRecorder
+from . import wire
+from .worker import SimulationWorker
+from .tick import DEFAULT_SOLVER, SOLVERS, FixedTimestep, Solver, get_solver
 
 
 class WSProtocol(Protocol):
@@ -28,7 +42,7 @@ class WSProtocol(Protocol):
     async def recv(self) -> str:  # pragma: no cover - interface only
         ...
 
-    async def send(self, message: str) -> None:  # pragma: no cover - interface only
+    async def send(self, message: str | bytes) -> None:  # pragma: no cover - interface only
         ...
 
     async def close(self) -> None:  # pragma: no cover - interface only
@@ -44,6 +58,10 @@ PROTOCOL_VERSION = "2.0"
 PROTOCOL_MAJOR = 2
 PROTOCOL_MINOR = 0
 
+# Optional protocol features this server implements (PROTOCOL.md §8).
+# ``zstd-1`` is added per server when a compressor is configured.
+SUPPORTED_FEATURES = ("delta-1", "binary-1")
+
 
 def _now_ms() -> int:
     """Return current time in milliseconds since Unix epoch."""
@@ -59,18 +77,70 @@ class ControlParams:
     tick_hz: int = 50
 
 
+@dataclass
+class ClientSession:
+    """Per-connection options negotiated in ``hello``/``welcome``.
+
+    ``outbox`` buffers everything sent after ``welcome``; it is drained by
+    the connection's own writer task.
+    """
+
+    features: Set[str] = field(default_factory=set)
+    needs_keyframe: bool = True
+    outbox: Outbox = field(default_factory=Outbox)
+    viewport: tuple[int, int, int, int] | None = None
+    interval: float = 0.0
+    next_due: float = 0.0
+
+
 @dataclass
 class ServerState:
-    """In-memory state shared across connections."""
+    """In-memory state shared across connections.
+
+    ``clients`` holds every open connection while ``sessions`` only holds
+    those that completed the handshake and therefore receive snapshots.
+    """
 
     clients: Set[WSProtocol] = field(default_factory=set)
+    sessions: Dict[WSProtocol, ClientSession] = field(default_factory=dict)
     sent_counts: Dict[WSProtocol, int] = field(default_factory=dict)
     recv_counts: Dict[WSProtocol, int] = field(default_factory=dict)
+    sent_bytes: Dict[WSProtocol, int] = field(default_factory=dict)
+    recv_bytes: Dict[WSProtocol, int] = field(default_factory=dict)
+    queue_depths: Dict[WSProtocol, int] = field(default_factory=dict)
+    drop_counts: Dict[WSProtocol, int] = field(default_factory=dict)
     seq: itertools.count = field(default_factory=lambda: itertools.count(1))
     tick: int = 0
     control: ControlParams = field(default_factory=ControlParams)
     sim: SimState = field(default_factory=SimState)
+    cm_per_pixel: float = 1.0
     snapshot_hz: float = 20.0
+    solver: Solver = field(default_factory=lambda: get_solver(DEFAULT_SOLVER))
+    clock: FixedTimestep = field(default_factory=FixedTimestep)
+    solve_ms: float = 0.0
+    tick_lag_ms: float = 0.0
+    frame: int = 0
+    keyframe_every: int = 100
+    deltas: DeltaTracker = field(default_factory=DeltaTracker)
+    compressor: wire.Compressor | None = None
+    worker: SimulationWorker | None = None
+    save_gzip: bool = False
+    pending_saves: List[Tuple[WSProtocol, str]] = field(default_factory=list)
+    saver: asyncio.Task[None] | None = None
+    checkpoints: checkpoint.Checkpointer | None = None
+    checkpoint_every: float = 10.0
+    recorder: Recorder | None = None
+    edits: EditQueue = field(default_factory=EditQueue)
+    metrics: Metrics = field(default_factory=Metrics)
+    loop: LoopMonitor = field(default_factory=LoopMonitor)
+    spans: SpanRecorder | None = None
+
+    def features(self) -> tuple[str, ...]:
+        """Return the feature flags this server can enable."""
+
+        if self.compressor is None:
+            return SUPPORTED_FEATURES
+        return SUPPORTED_FEATURES + ("zstd-1",)
 
 
 async def _handle_client(ws: WSProtocol, state: ServerState) -> None:
@@ -79,10 +149,13 @@ async def _handle_client(ws: WSProtocol, state: ServerState) -> None:
     state.clients.add(ws)
     state.sent_counts[ws] = 0
     state.recv_counts[ws] = 0
+    state.sent_bytes[ws] = 0
+    state.recv_bytes[ws] = 0
     logger.info("client connected %s", ws.remote_address)
+    writer: asyncio.Task[None] | None = None
     try:
         raw = await ws.recv()
-        state.recv_counts[ws] += 1
+        _count_recv(state, ws, raw)
         try:
             msg = json.loads(raw)
         except json.JSONDecodeError:
@@ -104,6 +177,12 @@ async def _handle_client(ws: WSProtocol, state: ServerState) -> None:
             await ws.close()
             return
 
+        requested = msg.get("features")
+        if not isinstance(requested, list):
+            requested = []
+        session = ClientSession(
+            features={f for f in state.features() if f in requested}
+        )
         welcome = {
             "t": "welcome",
             "seq": str(next(state.seq)),
@@ -112,12 +191,20 @@ async def _handle_client(ws: WSProtocol, state: ServerState) -> None:
             "schema_rev": "2.0",
             "tick_hz": state.control.tick_hz,
             "server_version": "0.2.0",
+            "features": sorted(session.features),
         }
-        await ws.send(json.dumps(welcome))
-        state.sent_counts[ws] += 1
+        if "zstd-1" in session.features and state.compressor is not None:
+            welcome.update(state.compressor.welcome_fields())
+        message = json.dumps(welcome)
+        await ws.send(message)
+        _count_sent(state, ws, message)
+        state.queue_depths[ws] = 0
+        state.drop_counts[ws] = 0
+        state.sessions[ws] = session
+        writer = asyncio.create_task(_write_loop(ws, state, session.outbox))
 
         async for raw in ws:
-            state.recv_counts[ws] += 1
+            _count_recv(state, ws, raw)
             try:
                 data = json.loads(raw)
             except json.JSONDecodeError:  # ignore malformed messages
@@ -125,22 +212,83 @@ async def _handle_client(ws: WSProtocol, state: ServerState) -> None:
             msg_type = data.get("t")
             if msg_type == "control":
                 _apply_control(data, state.control)
+                if state.recorder is not None:
+                    changes = {k: data[k] for k in ("pause", "tick_hz") if k in data}
+                    state.recorder.control(state.tick, changes)
             elif msg_type == "edit_grid":
                 await _apply_edit_grid(data, ws, state)
             elif msg_type == "save":
-                asyncio.create_task(_write_save(state, data.get("note", "")))
+                _request_save(state, ws, str(data.get("note", "")))
+            elif msg_type == "resync":
+                session.needs_keyframe = True
+            elif msg_type == "subscribe":
+                if not _apply_subscribe(data, session):
+                    await _send_error(ws, state, "bad_request", "Malformed subscribe")
             # Unknown message types are ignored.
     except websockets.ConnectionClosed:  # pragma: no cover - connection closed
         pass
+    except OutboxOverflow:
+        logger.warning("client %s stopped reading; closing", ws.remote_address)
+        await ws.close()
     finally:
-        state.clients.discard(ws)
-        sent = state.sent_counts.pop(ws, 0)
-        recv = state.recv_counts.pop(ws, 0)
+        if writer is not None:
+            writer.cancel()
+            try:
+                await writer
+            except asyncio.CancelledError:
+                pass
+            except Exception:  # cleanup below must run regardless
+                logger.exception("writer for %s failed", ws.remote_address)
+        dropped = state.drop_counts.get(ws, 0)
+        sent, recv = _forget_client(state, ws)
         logger.info(
-            "client disconnected %s sent=%d recv=%d", ws.remote_address, sent, recv
+            "client disconnected %s sent=%d recv=%d dropped=%d",
+            ws.remote_address,
+            sent,
+            recv,
+            dropped,
         )
 
 
+def _forget_client(state: ServerState, ws: WSProtocol) -> tuple[int, int]:
+    """Drop all per-connection state and return its ``(sent, recv)`` counts."""
+
+    state.clients.discard(ws)
+    state.sessions.pop(ws, None)
+    state.queue_depths.pop(ws, None)
+    state.drop_counts.pop(ws, None)
+    state.sent_bytes.pop(ws, None)
+    state.recv_bytes.pop(ws, None)
+    return state.sent_counts.pop(ws, 0), state.recv_counts.pop(ws, 0)
+
+
+def _count_sent(state: ServerState, ws: WSProtocol, message: str | bytes) -> None:
+    state.sent_counts[ws] = state.sent_counts.get(ws, 0) + 1
+    state.sent_bytes[ws] = state.sent_bytes.get(ws, 0) + len(message)
+
+
+def _count_recv(state: ServerState, ws: WSProtocol, message: str | bytes) -> None:
+    state.recv_counts[ws] = state.recv_counts.get(ws, 0) + 1
+    state.recv_bytes[ws] = state.recv_bytes.get(ws, 0) + len(message)
+
+
+async def _write_loop(ws: WSProtocol, state: ServerState, outbox: Outbox) -> None:
+    """Write queued messages to ``ws`` until the connection closes."""
+
+    while True:
+        message = await outbox.get()
+        state.queue_depths[ws] = len(outbox)
+        start = time.perf_counter()
+        try:
+            await ws.send(message)
+        except websockets.ConnectionClosed:
+            return
+        if state.spans is not None:
+            track = "send " + _client_label(ws)
+            state.spans.add("send", start, time.perf_counter(), track, bytes=len(message))
+        _count_sent(state, ws, message)
+
+
 def _apply_control(msg: Dict[str, Any], control: ControlParams) -> None:
     """Update control parameters from a control message."""
 
@@ -153,60 +301,509 @@ def _apply_control(msg: Dict[str, Any], control: ControlParams) -> None:
             pass
 
 
-async def _write_save(state: ServerState, note: str) -> None:
-    """Write a full snapshot to ``save-<ts>.json`` asynchronously."""
+def _apply_subscribe(msg: Dict[str, Any], session: ClientSession) -> bool:
+    """Update a session's viewport and snapshot rate from a subscribe message.
+
+    Returns ``False`` and leaves the session untouched if the message is
+    malformed.
+    """
+
+    viewport = msg.get("viewport")
+    window: tuple[int, int, int, int] | None = None
+    if viewport is not None:
+        if not isinstance(viewport, dict):
+            return False
+        window = tuple(viewport.get(k) for k in ("r", "c", "rows", "cols"))  # type: ignore[assignment]
+        if not all(isinstance(v, int) and v >= 0 for v in window) or not (
+            window[2] and window[3]
+        ):
+            return False
+    hz = msg.get("snapshot_hz", 0)
+    if not isinstance(hz, (int, float)) or hz < 0:
+        return False
+    session.viewport = window
+    session.interval = 1.0 / hz if hz else 0.0
+    session.next_due = 0.0
+    session.needs_keyframe = True
+    return True
+
+
+def _request_save(state: ServerState, ws: WSProtocol, note: str) -> None:
+    """Queue a save for ``ws``, answered with ``save_done`` once written.
+
+    At most one save is written at a time. Requests that arrive while one is
+    in progress are coalesced into a single save that starts when it ends.
+    """
+
+    state.pending_saves.append((ws, note))
+    if state.saver is None or state.saver.done():
+        state.saver = asyncio.create_task(_save_loop(state))
+
+
+async def _save_loop(state: ServerState) -> None:
+    """Write saves until no requests are pending."""
+
+    while state.pending_saves:
+        batch, state.pending_saves = state.pending_saves, []
+        notes = list(dict.fromkeys(note for _, note in batch if note))
+        path: Path | None = None
+        error = ""
+        start = time.perf_counter()
+        try:
+            path = await _write_save(state, "; ".join(notes))
+            state.metrics.save.observe(time.perf_counter() - start)
+        except Exception as exc:
+            logger.exception("save failed")
+            error = str(exc) or type(exc).__name__
+        for ws, _ in batch:
+            done: Dict[str, Any] = {
+                "t": "save_done",
+                "seq": str(next(state.seq)),
+                "ts": _now_ms(),
+                "ok": path is not None,
+            }
+            if path is not None:
+                done["path"] = str(path)
+            else:
+                done["message"] = error
+            _queue_message(state, ws, done)
+
+
+async def _write_save(state: ServerState, note: str) -> Path:
+    """Write a full snapshot to ``save-<ts>.json`` and return its path.
+
+    The grid is captured with :meth:`SimState.freeze`: taking the snapshot
+    copies nothing, and while the file is written on a thread the simulation
+    keeps stepping into fresh planes instead of overwriting the captured
+    ones. The file is gzip-compressed (``.json.gz``) when
+    ``state.save_gzip`` is set.
+    """
 
     meta = {"note": note} if note else None
-    path = Path(f"save-{_now_ms()}.json")
-    await asyncio.to_thread(save_level, path, state.sim, meta=meta)
+    suffix = ".json.gz" if state.save_gzip else ".json"
+    path = Path(f"save-{_now_ms()}{suffix}")
+    if state.worker is not None:
+        # The worker keeps stepping its grid; save a completed frame instead.
+        with state.worker.frame() as frame:
+            sim = frame.sim.freeze()
+    else:
+        sim = state.sim.freeze()
+    await asyncio.to_thread(
+        save_level, path, sim, cm_per_pixel=state.cm_per_pixel, meta=meta
+    )
     logger.info("wrote %s", path)
+    return path
 
 
 async def _apply_edit_grid(msg: Dict[str, Any], ws: WSProtocol, state: ServerState) -> None:
+    """Queue an ``edit_grid`` batch for the next tick.
+
+    A failing batch is answered with ``error`` once the tick has tried it;
+    one that would take the client over its limit of pending operations is
+    refused right away with ``rate_limited``.
+    """
+
     edits = msg.get("ops")
     if not isinstance(edits, list):
         await _send_error(ws, state, "bad_request", "Malformed edits")
         return
-    err = state.sim.apply_edits(edits)
-    if err:
-        await _send_error(ws, state, err["code"], "")
+    loop = asyncio.get_running_loop()
+
+    def done(err: EditResult) -> None:
+        # Called by whoever drains the queue, possibly the worker thread.
+        if err:
+            loop.call_soon_threadsafe(_edit_failed, state, ws, err["code"])
+
+    if not state.edits.put(ws, edits, done):
+        await _send_error(ws, state, "rate_limited", "Too many pending edits")
+
+
+def _edit_failed(state: ServerState, ws: WSProtocol, code: str) -> None:
+    try:
+        _queue_message(state, ws, _error(state, code, ""))
+    except OutboxOverflow:
+        logger.warning("client %s stopped reading; closing", ws.remote_address)
+        asyncio.ensure_future(ws.close())
+
+
+def _maybe_compress(state: ServerState, ws: WSProtocol, message: str) -> str | bytes:
+    """Compress ``message`` for sessions that negotiated ``zstd-1``."""
+
+    session = state.sessions.get(ws)
+    if session is None or state.compressor is None or "zstd-1" not in session.features:
+        return message
+    return state.compressor.compress(message)
+
+
+def _queue_message(state: ServerState, ws: WSProtocol, message: Dict[str, Any]) -> bool:
+    """Queue ``message`` in the outbox of ``ws``'s session.
+
+    Returns ``False`` if ``ws`` has no session (handshake not done or
+    connection gone).
+    """
+
+    session = state.sessions.get(ws)
+    if session is None:
+        return False
+    session.outbox.put(_maybe_compress(state, ws, json.dumps(message)))
+    state.queue_depths[ws] = len(session.outbox)
+    return True
 
 
 async def _send_error(ws: WSProtocol, state: ServerState, code: str, message: str) -> None:
-    """Send an error message to a client."""
+    """Send an error message to a client.
 
-    error = {
+    Once the handshake is done the error is queued behind earlier messages
+    in the session's outbox; errors are never dropped.
+    """
+
+    error = _error(state, code, message)
+    if _queue_message(state, ws, error):
+        return
+    message = json.dumps(error)
+    await ws.send(message)
+    _count_sent(state, ws, message)
+
+
+def _error(state: ServerState, code: str, message: str) -> Dict[str, Any]:
+    return {
         "t": "error",
         "seq": str(next(state.seq)),
         "ts": _now_ms(),
         "code": code,
         "message": message,
     }
-    await ws.send(json.dumps(error))
-    state.sent_counts[ws] = state.sent_counts.get(ws, 0) + 1
 
 
-async def _broadcast_snapshots(state: ServerState) -> None:
-    """Broadcast snapshots of the current simulation state."""
+async def _tick_loop(state: ServerState) -> None:
+    """Step the simulation at ``control.tick_hz`` on a fixed timestep.
 
+    Ticks are scheduled against :func:`time.monotonic` through
+    :class:`~server.tick.FixedTimestep`, so time spent solving or waiting on
+    other tasks is made up by running several ticks back to back (up to the
+    clock's catch-up cap) rather than drifting. Queued edits are applied at
+    the start of each tick, and while paused as they arrive. If the solver
+    raises, the error is logged and the simulation pauses; a ``control``
+    message resumes it.
+    """
+
+    clock = state.clock
     while True:
-        snap = state.sim.snapshot()
-        payload = {
-            "t": "snapshot",
-            "seq": str(next(state.seq)),
-            "ts": _now_ms(),
-            "grid": {"cm_per_pixel": 1.0, "cells": snap["grid"]},
-        }
-        message = json.dumps(payload)
-        for ws in list(state.clients):
+        hz = state.control.tick_hz
+        now = time.monotonic()
+        if state.control.pause or hz <= 0:
+            clock.reset(now)
+            state.edits.drain(state.sim, state.recorder, state.tick)
+            await asyncio.sleep(1.0 / hz if hz > 0 else 0.1)
+            continue
+        dt = 1.0 / hz
+        for _ in range(clock.advance(now, dt)):
+            drain = time.perf_counter()
+            state.edits.drain(state.sim, state.recorder, state.tick)
+            start = time.perf_counter()
             try:
-                await ws.send(message)
-                state.sent_counts[ws] = state.sent_counts.get(ws, 0) + 1
-            except websockets.ConnectionClosed:
-                state.clients.discard(ws)
-                state.sent_counts.pop(ws, None)
-                state.recv_counts.pop(ws, None)
-        await asyncio.sleep(1.0 / state.snapshot_hz if state.snapshot_hz > 0 else 0)
+                state.solver(state.sim)
+            except Exception:
+                logger.exception("solver failed at tick %d; pausing", state.tick)
+                state.control.pause = True
+                break
+            end = time.perf_counter()
+            solve = end - start
+            state.metrics.tick_solve.observe(solve)
+            state.solve_ms = solve * 1000.0
+            state.tick += 1
+            if state.spans is not None:
+                state.spans.add("edit_drain", drain, start)
+                state.spans.add("solve", start, end)
+                state.spans.tick(drain, end, state.tick)
+            if state.recorder is not None:
+                state.recorder.ticked(state.sim, state.tick)
+        state.tick_lag_ms = clock.lag() * 1000.0
+        await asyncio.sleep(max(0.0, clock.until_next(dt) - (time.monotonic() - now)))
+
+
+async def _checkpoint_loop(state: ServerState) -> None:
+    """Write a checkpoint every ``checkpoint_every`` seconds."""
+
+    while True:
+        await asyncio.sleep(state.checkpoint_every)
+        await _write_checkpoint(state)
+
+
+async def _write_checkpoint(state: ServerState) -> None:
+    """Capture the rows changed since the last checkpoint and write them.
+
+    Capturing copies only those rows (or freezes the grid when compacting)
+    on the event loop; the file I/O runs on a thread. Failures are logged.
+    """
+
+    checkpoints = state.checkpoints
+    if checkpoints is None:
+        return
+    if state.worker is not None:
+        with state.worker.frame() as frame:
+            pending = checkpoints.capture(frame.sim, frame.tick)
+    else:
+        pending = checkpoints.capture(state.sim, state.tick)
+    try:
+        await asyncio.to_thread(checkpoints.write, pending)
+    except Exception:
+        logger.exception("checkpoint failed")
+
+
+def _render_metrics(state: ServerState) -> str:
+    """Return the ``/metrics`` exposition text.
+
+    Besides the timing histograms it reports per-client traffic, edit
+    operations by outcome and the number of cells holding water in the grid
+    being broadcast.
+    """
+
+    def per_client(counts: Dict[WSProtocol, int]) -> List[Tuple[Dict[str, str], float]]:
+        return [({"client": _client_label(ws)}, n) for ws, n in list(counts.items())]
+
+    def single(value: float) -> List[Tuple[Dict[str, str], float]]:
+        return [({}, value)]
+
+    edits = state.edits
+    outcomes: List[Tuple[Dict[str, str], float]] = [({"result": "applied"}, edits.applied_ops)]
+    for code, n in list(edits.rejected_ops.items()):
+        outcomes.append(({"result": "rejected", "code": code}, n))
+    outcomes.append(({"result": "rejected", "code": "rate_limited"}, edits.refused_ops))
+    with _reading(state) as sim:
+        active = int(np.count_nonzero(sim.depths))
+        cells = sim.depths.size
+    families = [
+        (
+            "client_sent_bytes_total",
+            "Bytes sent to each client.",
+            "counter",
+            per_client(state.sent_bytes),
+        ),
+        (
+            "client_sent_messages_total",
+            "Messages sent to each client.",
+            "counter",
+            per_client(state.sent_counts),
+        ),
+        (
+            "client_received_bytes_total",
+            "Bytes received from each client.",
+            "counter",
+            per_client(state.recv_bytes),
+        ),
+        (
+            "client_received_messages_total",
+            "Messages received from each client.",
+            "counter",
+            per_client(state.recv_counts),
+        ),
+        ("edit_ops_total", "Edit operations by outcome and error code.", "counter", outcomes),
+        ("edit_queue_batches", "Edit batches waiting for a tick.", "gauge", single(len(edits))),
+        ("active_cells", "Cells holding water.", "gauge", single(active)),
+        ("cells", "Cells in the grid.", "gauge", single(cells)),
+        ("ticks_total", "Ticks stepped so far.", "counter", single(state.tick)),
+        (
+            "ticks_dropped_total",
+            "Ticks skipped to catch up after falling behind.",
+            "counter",
+            single(state.clock.dropped),
+        ),
+        ("clients", "Open connections.", "gauge", single(len(state.clients))),
+    ]
+    return state.metrics.render(
+        render_family("pszcz_" + name, description, kind, samples)
+        for name, description, kind, samples in families
+    )
+
+
+def _client_label(ws: WSProtocol) -> str:
+    address = getattr(ws, "remote_address", None)
+    if isinstance(address, tuple) and len(address) >= 2:
+        return f"{address[0]}:{address[1]}"
+    return str(address)
+
+
+def _snapshot_meta(state: ServerState, sim: SimState) -> Dict[str, Any]:
+    return {
+        "solve_ms": round(state.solve_ms, 3),
+        "tick": state.tick,
+        "tick_lag_ms": round(state.tick_lag_ms, 3),
+        "ticks_dropped": state.clock.dropped,
+        **sim.stats,
+    }
+
+
+@contextlib.contextmanager
+def _reading(state: ServerState) -> Iterator[SimState]:
+    """Yield the grid to send: the live grid or the worker's latest frame.
+
+    With a simulation worker the tick counters are taken from the same frame
+    so that snapshot ``meta`` matches the grid it accompanies.
+    """
+
+    if state.worker is None:
+        yield state.sim
+        return
+    with state.worker.frame() as frame:
+        state.tick = frame.tick
+        state.solve_ms = frame.solve_ms
+        state.tick_lag_ms = frame.tick_lag_ms
+        yield frame.sim
+
+
+def _broadcast_frame(state: ServerState) -> None:
+    """Queue one frame for every session; see :func:`_queue_frame`."""
+
+    with _reading(state) as sim:
+        _queue_frame(state, sim)
+
+
+def _queue_frame(state: ServerState, sim: SimState) -> None:
+    """Queue one frame for every session as a full snapshot or a delta.
+
+    Sessions that negotiated ``delta-1`` get only the cells changed since the
+    previous frame, except on every ``keyframe_every``-th frame and after
+    joining, subscribing or asking for a ``resync``, when they get a full
+    snapshot. Sessions that negotiated ``binary-1`` get binary frames (see
+    :mod:`server.wire`) and those that negotiated ``zstd-1`` get them
+    compressed. Sessions with a viewport only get that window. Encoding
+    goes through a :class:`~server.frames.FrameCache` so each variant is
+    built at most once per frame and the same bytes are handed to every
+    session that wants it.
+
+    With span tracing on (see :mod:`server.trace`), the frame's phases are
+    recorded; ``encode`` spans are only recorded for messages the cache had
+    to build.
+
+    Frames are only queued (see :class:`~server.outbox.Outbox`); a session
+    whose previous frame is still unsent has it replaced and, because the
+    dropped frame breaks its delta chain, receives a full snapshot. Sessions
+    with a lower snapshot rate skip frames and likewise resume with a full
+    snapshot.
+    """
+
+    start = time.perf_counter()
+    state.frame += 1
+    changes: CellChanges | None = None
+    if any("delta-1" in s.features for s in state.sessions.values()):
+        changes = state.deltas.diff(sim)
+    else:
+        state.deltas.reset()
+    keyframe = state.keyframe_every > 0 and state.frame % state.keyframe_every == 0
+    cache = FrameCache(
+        sim=sim,
+        frame=state.frame,
+        tick=state.tick,
+        seq=state.seq,
+        cm_per_pixel=state.cm_per_pixel,
+        meta=_snapshot_meta(state, sim),
+        changes=changes,
+        compressor=state.compressor,
+    )
+    built = time.perf_counter()
+    encoding = 0.0
+    spans = state.spans
+
+    now = time.monotonic()
+    for ws, session in list(state.sessions.items()):
+        region: Region | None = None
+        if session.viewport is not None:
+            region = tile_region(*session.viewport, sim.shape)
+            if region is None:  # viewport lies outside the grid
+                session.needs_keyframe = True
+                continue
+        if session.interval:
+            if now < session.next_due:
+                session.needs_keyframe = True
+                continue
+            session.next_due = max(session.next_due + session.interval, now)
+        outbox = session.outbox
+        if outbox.has_frame():
+            session.needs_keyframe = True
+        use_delta = (
+            changes is not None
+            and not keyframe
+            and not session.needs_keyframe
+            and "delta-1" in session.features
+        )
+        encoded = cache.encoded_messages
+        encode_start = time.perf_counter()
+        message = cache.message(
+            region,
+            use_delta,
+            "binary-1" in session.features,
+            state.compressor is not None and "zstd-1" in session.features,
+        )
+        encode_end = time.perf_counter()
+        encoding += encode_end - encode_start
+        if spans is not None and cache.encoded_messages != encoded:
+            spans.add("encode", encode_start, encode_end, bytes=len(message))
+        outbox.put_frame(message)
+        session.needs_keyframe = False
+        state.queue_depths[ws] = len(outbox)
+        state.drop_counts[ws] = outbox.dropped
+    end = time.perf_counter()
+    state.metrics.snapshot_build.observe(built - start)
+    state.metrics.encode.observe(encoding)
+    state.metrics.fanout.observe(end - built - encoding)
+    if spans is not None:
+        spans.add("snapshot_build", start, built)
+        spans.add("fanout", built, end)
+        spans.add("broadcast", start, end, frame=state.frame, tick=state.tick)
+
+
+async def _broadcast_snapshots(state: ServerState) -> None:
+    """Broadcast snapshots of the current simulation state at ``snapshot_hz``."""
+
+    next_due = time.monotonic()
+    while True:
+        _broadcast_frame(state)
+        # Keep an absolute schedule so send time does not stretch the period.
+        period = 1.0 / state.snapshot_hz if state.snapshot_hz > 0 else 0.0
+        now = time.monotonic()
+        next_due = max(next_due + period, now)
+        await asyncio.sleep(next_due - now)
+
+
+async def _run_simulation(state: ServerState) -> None:
+    """Run the tick loop and the snapshot broadcaster until cancelled.
+
+    If either task fails the other is cancelled and the error propagates, so
+    a stopped simulation never keeps broadcasting a frozen grid. With
+    checkpoints enabled they are written periodically and once more when
+    the simulation stops. The event-loop lag monitor runs alongside.
+    """
+
+    tasks = [
+        asyncio.create_task(_broadcast_snapshots(state)),
+        asyncio.create_task(state.loop.run()),
+    ]
+    if state.worker is None:
+        tasks.append(asyncio.create_task(_tick_loop(state)))
+    else:
+        state.worker.start()
+    if state.checkpoints is not None:
+        tasks.append(asyncio.create_task(_checkpoint_loop(state)))
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    except Exception:
+        logger.exception("simulation stopped")
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if state.worker is not None:
+            await asyncio.to_thread(state.worker.stop)
+            state.tick = state.worker.tick
+        await _write_checkpoint(state)
+        if state.recorder is not None:
+            await asyncio.to_thread(state.recorder.close, state.tick)
+        if isinstance(state.solver, BandedSolver):
+            state.solver.close()
 
 
 async def start_server(
@@ -216,19 +813,107 @@ async def start_server(
     snapshot_hz: float = 20.0,
     level_path: str | Path | None = None,
     health_port: int = 7778,
+    solver: str = DEFAULT_SOLVER,
+    max_catchup: int = 5,
+    keyframe_every: int = 100,
+    zstd_level: int | None = 3,
+    zstd_dict: str | Path | None = None,
+    workers: int = 1,
+    sim_thread: bool = False,
+    save_gzip: bool = False,
+    checkpoint_dir: str | Path | None = None,
+    checkpoint_every: float = 10.0,
+    resume: bool = False,
+    record_dir: str | Path | None = None,
+    record_keyframe_every: int = 1000,
+    edit_budget: int = 10000,
+    edit_client_limit: int = 50000,
+    profiling: bool = False,
+    trace_spans: int = 0,
+    trace_budget_ms: float | None = None,
+    trace_dir: str | Path | None = None,
 ):
-    """Start the WebSocket and health servers plus snapshot broadcaster."""
+    """Start the WebSocket and health servers plus the simulation task.
+
+    With ``workers`` above 1 the grid is stepped in that many horizontal
+    bands by worker processes (see :class:`~server.parallel.BandedSolver`)
+    instead of by ``solver``. With ``sim_thread`` the simulation is stepped
+    on a :class:`~server.worker.SimulationWorker` thread instead of the event
+    loop. With ``save_gzip`` saves are written gzip-compressed.
+
+    With ``checkpoint_dir`` the grid is checkpointed there every
+    ``checkpoint_every`` seconds (see :mod:`server.checkpoint`); with
+    ``resume`` it is rebuilt from that directory instead of loaded from
+    ``level_path`` if a checkpoint exists. With ``record_dir`` the session
+    is recorded there for replay, with a keyframe every
+    ``record_keyframe_every`` ticks (see :mod:`server.replay`).
+
+    Edits are applied at the start of a tick, at most ``edit_budget``
+    operations per tick, and each client may have at most
+    ``edit_client_limit`` operations waiting (see :mod:`server.editqueue`).
+    With ``profiling`` the health app also serves the ``/debug`` profiling
+    endpoints of :mod:`server.profiling`.
+
+    With ``trace_spans`` above 0 the latest that many tick and broadcast
+    spans are kept and served as a Chrome trace at ``/debug/trace`` (see
+    :mod:`server.trace`); with ``trace_dir`` a trace is also written there
+    whenever a tick takes longer than ``trace_budget_ms`` (by default one
+    tick period) or the event loop stalls.
+
+    Returns ``(server, simulation, runner)`` where ``simulation`` is the task
+    running both the tick loop and the snapshot broadcaster.
+    """
 
     state = ServerState()
     state.control.tick_hz = int(tick_hz)
     state.snapshot_hz = snapshot_hz
-    if level_path is not None:
+    state.solver = BandedSolver(workers) if workers > 1 else get_solver(solver)
+    state.clock.max_catchup = max_catchup
+    state.keyframe_every = keyframe_every
+    state.save_gzip = save_gzip
+    state.edits = EditQueue(edit_budget, edit_client_limit)
+    if trace_spans > 0:
+        budget = trace_budget_ms if trace_budget_ms is not None else 1000.0 / tick_hz
+        state.spans = SpanRecorder(trace_spans, budget / 1000.0, trace_dir)
+    state.loop = LoopMonitor(state.metrics.loop_lag, state.spans)
+    if zstd_level is not None and wire.ZSTD_AVAILABLE:
+        state.compressor = wire.Compressor(zstd_level, zstd_dict)
+    elif zstd_level is not None:
+        logger.warning("zstandard is not installed; not offering zstd-1")
+    resumed = False
+    if resume:
+        if checkpoint_dir is None:
+            raise ValueError("resume needs a checkpoint directory")
+        try:
+            state.cm_per_pixel, state.tick = checkpoint.resume(checkpoint_dir, state.sim)
+            resumed = True
+        except FileNotFoundError:
+            logger.warning("no checkpoint in %s; loading the level", checkpoint_dir)
+    if level_path is not None and not resumed:
         try:
-            load_level(level_path, state.sim)
+            state.cm_per_pixel = load_level(level_path, state.sim)
         except FileNotFoundError:
             logger.warning("level file %s not found; starting empty", level_path)
-    if not state.sim.grid:
-        state.sim.grid = [[Pixel("space", 0.0)]]
+    if state.sim.materials.size == 0:
+        state.sim.clear(1, 1)
+    if checkpoint_dir is not None:
+        state.checkpoints = checkpoint.Checkpointer(checkpoint_dir, state.cm_per_pixel)
+        state.checkpoint_every = checkpoint_every
+    if record_dir is not None:
+        state.recorder = Recorder(record_dir, state.cm_per_pixel, record_keyframe_every)
+        state.recorder.start(state.sim, state.tick)
+    if sim_thread:
+        state.worker = SimulationWorker(
+            state.sim,
+            state.solver,
+            state.control,
+            state.clock,
+            state.recorder,
+            state.edits,
+            state.metrics.tick_solve,
+            state.spans,
+        )
+        state.worker.tick = state.tick
 
     async def handler(ws: Any) -> None:
         path = getattr(ws, "path", None)
@@ -249,18 +934,34 @@ async def start_server(
                 "version": __version__,
                 "tick_hz": state.control.tick_hz,
                 "clients": len(state.clients),
+                "loop_lag_ms": round(state.loop.lag * 1000.0, 3),
             }
         )
 
+    async def _metrics(_: web.Request) -> web.Response:
+        return web.Response(
+            text=_render_metrics(state), headers={"Content-Type": CONTENT_TYPE}
+        )
+
+    async def _trace(_: web.Request) -> web.Response:
+        assert state.spans is not None
+        trace = await asyncio.to_thread(state.spans.trace)
+        return web.json_response(trace)
+
     app.router.add_get("/health", _health)
+    app.router.add_get("/metrics", _metrics)
+    if state.spans is not None:
+        app.router.add_get("/debug/trace", _trace)
+    if profiling:
+        add_profiling_routes(app, state.worker)
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, host, health_port)
     await site.start()
 
     server = await websockets.serve(handler, host, port)  # type: ignore[arg-type]
-    broadcaster = asyncio.create_task(_broadcast_snapshots(state))
-    return server, broadcaster, runner
+    simulation = asyncio.create_task(_run_simulation(state))
+    return server, simulation, runner
 
 
 def main() -> None:
@@ -272,24 +973,142 @@ def main() -> None:
     parser.add_argument("--health-port", type=int, default=7778)
     parser.add_argument("--level", default="levels/level.sample.v1.json")
     parser.add_argument("--tick-hz", type=int, default=50)
+    parser.add_argument("--snapshot-hz", type=float, default=20.0)
+    parser.add_argument(
+        "--max-catchup",
+        type=int,
+        default=5,
+        help="most ticks run back to back when the server falls behind",
+    )
+    parser.add_argument(
+        "--keyframe-every",
+        type=int,
+        default=100,
+        help="send a full snapshot to delta-1 clients every N frames",
+    )
+    parser.add_argument(
+        "--zstd-level",
+        type=int,
+        default=3,
+        help="zstd level for zstd-1 clients (needs the zstandard package)",
+    )
+    parser.add_argument("--zstd-dict", help="zstd dictionary file shared with clients")
+    parser.add_argument(
+        "--no-zstd", action="store_true", help="do not offer zstd-1 compression"
+    )
+    parser.add_argument(
+        "--solver",
+        choices=sorted(SOLVERS),
+        default=DEFAULT_SOLVER,
+        help="water simulation kernel",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="step the grid in this many bands on worker processes (overrides --solver)",
+    )
+    parser.add_argument(
+        "--sim-thread",
+        action="store_true",
+        help="run the simulation on its own thread instead of the event loop",
+    )
+    parser.add_argument(
+        "--save-gzip", action="store_true", help="write saves as gzip-compressed JSON"
+    )
+    parser.add_argument("--checkpoint-dir", help="write periodic checkpoints to this directory")
+    parser.add_argument(
+        "--checkpoint-every",
+        type=float,
+        default=10.0,
+        help="seconds between checkpoints",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="rebuild the grid from --checkpoint-dir instead of loading --level",
+    )
+    parser.add_argument("--record", help="record the session to this directory for pszcz-replay")
+    parser.add_argument(
+        "--record-keyframe-every",
+        type=int,
+        default=1000,
+        help="ticks between keyframes in the recording",
+    )
+    parser.add_argument(
+        "--edit-budget",
+        type=int,
+        default=10000,
+        help="most edit operations applied per tick; the rest wait for later ticks",
+    )
+    parser.add_argument(
+        "--edit-flood-limit",
+        type=int,
+        default=50000,
+        help="most edit operations one client may have waiting",
+    )
+    parser.add_argument(
+        "--profiling",
+        action="store_true",
+        help="serve /debug/profile and /debug/tracemalloc on the health port",
+    )
+    parser.add_argument(
+        "--trace-spans",
+        type=int,
+        default=0,
+        help="keep the latest N tick and broadcast spans for /debug/trace (0: off)",
+    )
+    parser.add_argument(
+        "--trace-budget-ms",
+        type=float,
+        help="tick duration that triggers a trace dump (default: one tick period)",
+    )
+    parser.add_argument(
+        "--trace-dir", help="write a trace here when a tick runs over budget or the loop stalls"
+    )
     args = parser.parse_args()
+    if args.resume and args.checkpoint_dir is None:
+        parser.error("--resume needs --checkpoint-dir")
+    if args.trace_dir is not None and args.trace_spans <= 0:
+        parser.error("--trace-dir needs --trace-spans")
 
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
     async def runner() -> None:
-        server, broadcaster, health = await start_server(
+        server, simulation, health = await start_server(
             host=args.host,
             port=args.port,
             tick_hz=args.tick_hz,
+            snapshot_hz=args.snapshot_hz,
             level_path=args.level,
             health_port=args.health_port,
+            solver=args.solver,
+            workers=args.workers,
+            sim_thread=args.sim_thread,
+            save_gzip=args.save_gzip,
+            checkpoint_dir=args.checkpoint_dir,
+            checkpoint_every=args.checkpoint_every,
+            resume=args.resume,
+            record_dir=args.record,
+            record_keyframe_every=args.record_keyframe_every,
+            edit_budget=args.edit_budget,
+            edit_client_limit=args.edit_flood_limit,
+            profiling=args.profiling,
+            trace_spans=args.trace_spans,
+            trace_budget_ms=args.trace_budget_ms,
+            trace_dir=args.trace_dir,
+            max_catchup=args.max_catchup,
+            keyframe_every=args.keyframe_every,
+            zstd_level=None if args.no_zstd else args.zstd_level,
+            zstd_dict=args.zstd_dict,
         )
         try:
             await server.wait_closed()
         finally:
-            broadcaster.cancel()
-            with contextlib.suppress(asyncio.CancelledError):
-                await broadcaster
+            simulation.cancel()
+            # A failed simulation has already been logged.
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await simulation
             await health.cleanup()
 
     asyncio.run(runner())
@@ -0,0 +1,75 @@
+"""Per-connection outbound message queue.
+
+Each connection owns an :class:`Outbox` drained by its own writer task, so the
+broadcaster only enqueues and never waits on a slow socket. Snapshot frames
+follow a latest-wins policy: a connection holds at most one pending frame and
+a newer frame replaces an unsent older one. Other messages (errors, replies)
+are kept in order and never dropped.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import Deque, Optional
+
+Message = str | bytes
+
+
+class OutboxOverflow(Exception):
+    """Raised when a connection stops draining its non-droppable messages."""
+
+
+class Outbox:
+    """Bounded queue of messages waiting to be written to one connection."""
+
+    def __init__(self, limit: int = 256) -> None:
+        self.limit = limit
+        self._messages: Deque[Message] = deque()
+        self._frame: Optional[Message] = None
+        self._ready = asyncio.Event()
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._messages) + (self._frame is not None)
+
+    def put(self, message: Message) -> None:
+        """Queue a message that must be delivered.
+
+        Raises :class:`OutboxOverflow` once ``limit`` messages are waiting.
+        """
+
+        if len(self._messages) >= self.limit:
+            raise OutboxOverflow
+        self._messages.append(message)
+        self._ready.set()
+
+    def has_frame(self) -> bool:
+        """Return whether an unsent snapshot frame is waiting."""
+
+        return self._frame is not None
+
+    def put_frame(self, message: Message) -> bool:
+        """Queue a snapshot frame, replacing any unsent one.
+
+        Returns ``False`` when an older frame was dropped.
+        """
+
+        replaced = self._frame is not None
+        if replaced:
+            self.dropped += 1
+        self._frame = message
+        self._ready.set()
+        return not replaced
+
+    async def get(self) -> Message:
+        """Wait for and return the next message; frames go after the rest."""
+
+        while True:
+            if self._messages:
+                return self._messages.popleft()
+            if self._frame is not None:
+                frame, self._frame = self._frame, None
+                return frame
+            self._ready.clear()
+            await self._ready.wait()
@@ -0,0 +1,267 @@
+"""Multi-process solver stepping horizontal bands of the grid in parallel.
+
+:class:`BandedSolver` moves the grid planes into
+:mod:`multiprocessing.shared_memory` buffers and lets one worker process step
+each horizontal band with the ``numpy`` kernel. Depths are double-buffered:
+every worker reads its band plus a one-row halo above (inflow) and below
+(passability) from the current plane and writes only its own rows to the
+other plane, so bands never see each other's half-finished rows and the
+result is bit-identical to :func:`~server.tick.flow_step_vectorized`.
+A buffer still held by a frozen copy of the state (see
+:meth:`~server.state.SimState.freeze`) is swapped for a fresh one instead of
+being overwritten.
+
+Run ``python -m server.parallel`` for a scaling benchmark.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import multiprocessing as mp
+import time
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+from .state import DEPTH_DTYPE, MATERIAL_DTYPE, SimState
+from .tick import _advance, _build_masks, flow_step_vectorized
+
+
+def _planes(
+    shms: List[SharedMemory], shape: Tuple[int, int]
+) -> Tuple[np.ndarray, List[np.ndarray], np.ndarray]:
+    materials = np.ndarray(shape, dtype=MATERIAL_DTYPE, buffer=shms[0].buf)
+    depths = [
+        np.ndarray(shape, dtype=DEPTH_DTYPE, buffer=shms[1].buf),
+        np.ndarray(shape, dtype=DEPTH_DTYPE, buffer=shms[2].buf),
+    ]
+    changed = np.ndarray(shape[0], dtype=bool, buffer=shms[3].buf)
+    return materials, depths, changed
+
+
+def _worker(
+    conn: Connection, names: List[str], shape: Tuple[int, int], r0: int, r1: int
+) -> None:
+    """Step rows ``r0:r1`` whenever the parent asks, until told to stop.
+
+    Each request is ``(src, terrain_changed, names)``: the depth buffer to
+    read (the other one is written), whether the materials changed and, if
+    the parent replaced any buffer, the new buffer names. The reply is
+    ``None`` on success or the error text.
+    """
+
+    shms = [SharedMemory(name=name) for name in names]
+    materials, depths, changed = _planes(shms, shape)
+    top, end = max(r0 - 1, 0), min(r1 + 1, shape[0])
+    masks = None
+    try:
+        while True:
+            request = conn.recv()
+            if request is None:
+                return
+            src, terrain_changed, renamed = request
+            if renamed is not None:
+                del materials, depths, changed
+                for shm in shms:
+                    shm.close()
+                shms = [SharedMemory(name=name) for name in renamed]
+                materials, depths, changed = _planes(shms, shape)
+            try:
+                if terrain_changed or masks is None:
+                    masks = _build_masks(materials[top:end].copy())
+                new = _advance(depths[src][top:end], masks)[r0 - top : r1 - top]
+                changed[r0:r1] = (new != depths[src][r0:r1]).any(axis=1)
+                depths[1 - src][r0:r1] = new
+                conn.send(None)
+            except Exception as exc:  # reported to and raised by the parent
+                conn.send(repr(exc))
+    finally:
+        del materials, depths, changed, masks
+        for shm in shms:
+            shm.close()
+
+
+class BandedSolver:
+    """Solver that steps ``workers`` horizontal bands in worker processes.
+
+    Instances are callable like the functions in
+    :data:`~server.tick.SOLVERS`. On the first step, and whenever the grid
+    shape or planes are replaced, the state's planes are moved into shared
+    memory so steps need no copying: workers write the new depths into a
+    second buffer, which then becomes :attr:`SimState.depths`. Call
+    :meth:`close` to stop the workers; the state gets private copies of its
+    planes back.
+    """
+
+    def __init__(self, workers: int) -> None:
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.workers = workers
+        self._state: Optional[SimState] = None
+        self._shms: List[SharedMemory] = []
+        self._procs: List[Any] = []
+        self._conns: List[Connection] = []
+        self._materials: Optional[np.ndarray] = None
+        self._depths: List[np.ndarray] = []
+        self._changed: Optional[np.ndarray] = None
+        self._terrain: Any = None
+        self._retired: List[SharedMemory] = []
+
+    def _start(self, state: SimState) -> None:
+        self.close()
+        rows, cols = state.shape
+        sizes = (rows * cols, 4 * rows * cols, 4 * rows * cols, rows)
+        self._shms = [SharedMemory(create=True, size=size) for size in sizes]
+        self._materials, self._depths, self._changed = _planes(self._shms, state.shape)
+        self._materials[...] = state.materials
+        self._depths[0][...] = state.depths
+        state.set_planes(self._materials, self._depths[0])
+        self._state = state
+        self._terrain = None
+
+        names = [shm.name for shm in self._shms]
+        bounds = np.linspace(0, rows, min(self.workers, rows) + 1).astype(int).tolist()
+        ctx = mp.get_context("spawn")
+        for r0, r1 in zip(bounds, bounds[1:]):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(
+                target=_worker, args=(child, names, state.shape, r0, r1), daemon=True
+            )
+            proc.start()
+            child.close()
+            self._procs.append(proc)
+            self._conns.append(parent)
+
+    def _renew(self, index: int) -> np.ndarray:
+        """Replace buffer ``index`` (0 materials, 1-2 depths) with a fresh one.
+
+        The old buffer stays mapped for whoever still holds views of it.
+        """
+
+        old = self._shms[index]
+        shm = self._shms[index] = SharedMemory(create=True, size=old.size)
+        old.unlink()
+        self._retired.append(old)
+        assert self._state is not None
+        if index == 0:
+            plane = self._materials = np.ndarray(
+                self._state.shape, dtype=MATERIAL_DTYPE, buffer=shm.buf
+            )
+        else:
+            plane = self._depths[index - 1] = np.ndarray(
+                self._state.shape, dtype=DEPTH_DTYPE, buffer=shm.buf
+            )
+        return plane
+
+    def __call__(self, state: SimState) -> None:
+        if state.depths.size == 0:
+            return
+        if state is not self._state or state.shape != self._state_shape():
+            self._start(state)
+        renewed = False
+        if state.materials is not self._materials:
+            # Replaced by set_planes or copied away from a frozen copy.
+            assert self._materials is not None
+            if state.shared(self._materials):
+                self._renew(0)
+                renewed = True
+            self._materials[...] = state.materials
+            state.materials = self._materials
+        if not any(state.depths is d for d in self._depths):
+            if state.shared(self._depths[0]):
+                self._renew(1)
+                renewed = True
+            self._depths[0][...] = state.depths
+            state.depths = self._depths[0]
+        src = 0 if state.depths is self._depths[0] else 1
+        if state.shared(self._depths[1 - src]):
+            self._renew(2 - src)
+            renewed = True
+        names = [shm.name for shm in self._shms] if renewed else None
+        # A fresh token per terrain version tells the workers to rebuild masks.
+        terrain = state.cached("banded_solver", object)
+        terrain_changed = terrain is not self._terrain
+        self._terrain = terrain
+        for conn in self._conns:
+            conn.send((src, terrain_changed, names))
+        errors = [conn.recv() for conn in self._conns]
+        failed = [error for error in errors if error is not None]
+        if failed:
+            self._terrain = None
+            raise RuntimeError(f"banded solver worker failed: {failed[0]}")
+        state.depths = self._depths[1 - src]
+        assert self._changed is not None
+        if self._changed.any():
+            state.mark_rows(self._changed.copy())
+
+    def _state_shape(self) -> Tuple[int, int]:
+        return self._materials.shape if self._materials is not None else (0, 0)
+
+    def close(self) -> None:
+        """Stop the workers, hand the state private planes and free the buffers."""
+
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            conn.close()
+        for proc in self._procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        if self._state is not None:
+            self._state.materials = self._state.materials.copy()
+            self._state.depths = self._state.depths.copy()
+        self._state = None
+        self._materials, self._depths, self._changed = None, [], None
+        for shm in self._shms:
+            shm.unlink()
+        for shm in self._shms + self._retired:
+            # Frozen copies may still map the buffer; it is freed with them.
+            with contextlib.suppress(BufferError):
+                shm.close()
+        self._procs, self._conns, self._shms, self._retired = [], [], [], []
+
+    def __enter__(self) -> "BandedSolver":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def main() -> None:
+    """Print serial and banded step times for growing worker counts."""
+
+    parser = argparse.ArgumentParser(description="Banded solver scaling benchmark")
+    parser.add_argument("--rows", type=int, default=4096)
+    parser.add_argument("--cols", type=int, default=4096)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    materials = rng.integers(0, 4, (args.rows, args.cols)).astype(MATERIAL_DTYPE)
+    depths = rng.random((args.rows, args.cols), dtype=DEPTH_DTYPE)
+
+    def timed(solver: Any) -> float:
+        sim = SimState(materials.copy(), depths.copy())
+        solver(sim)  # warm up: masks, worker start-up
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            solver(sim)
+        return (time.perf_counter() - start) / args.steps * 1000.0
+
+    serial = timed(flow_step_vectorized)
+    print(f"{args.rows}x{args.cols} serial: {serial:.2f} ms/step")
+    for workers in args.workers:
+        with BandedSolver(workers) as solver:
+            ms = timed(solver)
+        print(f"workers={workers}: {ms:.2f} ms/step speedup={serial / ms:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""On-demand profiling of a running server.
+
+:class:`Profiler` runs one profiling session at a time for the admin
+endpoints that :func:`server.net.start_server` adds to the health app with
+``profiling=True``:
+
+``GET /debug/profile?seconds=N``
+    Runs :mod:`cProfile` on the event loop thread, and on the simulation
+    worker thread if there is one, for ``N`` seconds and returns the merged
+    statistics as text (``sort`` and ``limit`` as for :mod:`pstats`) or, with
+    ``format=pstats``, as a file for ``pstats.Stats``/snakeviz. That covers
+    the tick (:mod:`server.tick`), :meth:`~server.state.SimState.snapshot`
+    and the broadcaster (``server.net._broadcast_snapshots``).
+``GET /debug/profile?seconds=N&mode=sample``
+    Samples the stacks of every thread every ``interval`` seconds instead
+    and returns them in the collapsed format of flame graph tools
+    (``thread;outer;...;inner count``). Sampling costs the profiled threads
+    almost nothing, so it is the one to use on a struggling server.
+``GET /debug/tracemalloc?seconds=N&top=K``
+    Traces allocations for ``N`` seconds (if tracing is not already on) and
+    returns the ``K`` largest allocation sites.
+
+Nothing is installed until a session starts: with no session running the
+only cost is one attribute check per worker loop iteration. Worker
+processes of :class:`~server.parallel.BandedSolver` are not covered.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import collections
+import contextlib
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import Any, Counter, Dict, Iterator, List, Optional
+
+from aiohttp import web
+
+# Longest session the endpoints accept, in seconds.
+MAX_SECONDS = 300.0
+
+# Seconds to wait for the worker thread to switch profilers.
+_SWITCH_TIMEOUT = 2.0
+
+_SORT_KEYS = frozenset(pstats.Stats.sort_arg_dict_default)  # type: ignore[attr-defined]
+_TRACE_GROUPS = ("lineno", "filename", "traceback")
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profiling session is already running."""
+
+
+class Profiler:
+    """Run profiling sessions, one at a time, in a running server.
+
+    ``worker`` is the server's :class:`~server.worker.SimulationWorker`, if
+    the simulation runs on its own thread.
+    """
+
+    def __init__(self, worker: Any = None) -> None:
+        self.worker = worker
+        self._busy = False
+
+    async def cprofile(self, seconds: float) -> pstats.Stats:
+        """Profile the event loop and worker threads for ``seconds``."""
+
+        with self._session():
+            loop_profiler = cProfile.Profile()
+            worker_profiler = cProfile.Profile() if self.worker is not None else None
+            if worker_profiler is not None:
+                await self._switch_worker(worker_profiler)
+            loop_profiler.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                loop_profiler.disable()
+                if worker_profiler is not None:
+                    await self._switch_worker(None)
+            stats = pstats.Stats(loop_profiler)
+            if worker_profiler is not None and worker_profiler.getstats():
+                stats.add(worker_profiler)
+            return stats
+
+    async def sample(self, seconds: float, interval: float = 0.005) -> Counter[str]:
+        """Sample every thread's stack for ``seconds``; return collapsed stacks."""
+
+        with self._session():
+            sampler = _Sampler(interval)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                await asyncio.to_thread(sampler.stop)
+            return sampler.stacks
+
+    async def tracemalloc_top(
+        self, seconds: float, top: int = 20, group: str = "lineno"
+    ) -> List[str]:
+        """Return the ``top`` allocation sites traced over ``seconds``."""
+
+        with self._session():
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            try:
+                await asyncio.sleep(seconds)
+                snapshot = tracemalloc.take_snapshot()
+            finally:
+                if started:
+                    tracemalloc.stop()
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        return [str(stat) for stat in snapshot.statistics(group)[:top]]
+
+    async def _switch_worker(self, profiler: Optional[cProfile.Profile]) -> None:
+        switched = self.worker.profile(profiler)
+        await asyncio.to_thread(switched.wait, _SWITCH_TIMEOUT)
+
+    @contextlib.contextmanager
+    def _session(self) -> Iterator[None]:
+        if self._busy:
+            raise ProfilerBusy
+        self._busy = True
+        try:
+            yield
+        finally:
+            self._busy = False
+
+
+class _Sampler:
+    """Thread collecting the stacks of every other thread at an interval."""
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.stacks: Counter[str] = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        names: Dict[int, str] = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    name = names[ident] = _thread_name(ident)
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    file = os.path.basename(code.co_filename)
+                    frames.append(f"{code.co_name} ({file}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(name)
+                self.stacks[";".join(reversed(frames))] += 1
+
+
+def _thread_name(ident: int) -> str:
+    for thread in threading.enumerate():
+        if thread.ident == ident:
+            return thread.name
+    return f"thread-{ident}"
+
+
+def stats_text(stats: pstats.Stats, sort: str = "cumulative", limit: int = 50) -> str:
+    """Return ``stats`` printed as :mod:`pstats` does, ``limit`` rows."""
+
+    out = io.StringIO()
+    stats.stream = out  # type: ignore[attr-defined]
+    stats.sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def stats_file(stats: pstats.Stats) -> bytes:
+    """Return ``stats`` in the file format :meth:`pstats.Stats.dump_stats` writes."""
+
+    return marshal.dumps(stats.stats)  # type: ignore[attr-defined]
+
+
+def collapsed(stacks: Counter[str]) -> str:
+    """Return ``stacks`` as collapsed-stack lines, most frequent first."""
+
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def _number(query: Any, name: str, default: float, low: float, high: float) -> float:
+    value = float(query.get(name, default))
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low:g} and {high:g}")
+    return value
+
+
+def add_routes(app: web.Application, worker: Any = None) -> Profiler:
+    """Add the ``/debug`` endpoints to ``app`` and return their :class:`Profiler`."""
+
+    profiler = Profiler(worker)
+
+    async def profile(request: web.Request) -> web.StreamResponse:
+        query = request.query
+        seconds = _number(query, "seconds", 10.0, 0.0, MAX_SECONDS)
+        if query.get("mode", "cprofile") == "sample":
+            interval = _number(query, "interval", 0.005, 0.0005, 1.0)
+            return web.Response(text=collapsed(await profiler.sample(seconds, interval)))
+        if query.get("mode", "cprofile") != "cprofile":
+            raise ValueError("mode must be cprofile or sample")
+        sort = query.get("sort", "cumulative")
+        if sort not in _SORT_KEYS:
+            raise ValueError(f"unknown sort key {sort!r}")
+        limit = int(_number(query, "limit", 50, 1, 10000))
+        stats = await profiler.cprofile(seconds)
+        if query.get("format") == "pstats":
+            return web.Response(body=stats_file(stats), content_type="application/octet-stream")
+        return web.Response(text=stats_text(stats, sort, limit))
+
+    async def allocations(request: web.Request) -> web.StreamResponse:
+        query = request.query
+        seconds = _number(query, "seconds", 10.0, 0.0, MAX_SECONDS)
+        top = int(_number(query, "top", 20, 1, 10000))
+        group = query.get("group", "lineno")
+        if group not in _TRACE_GROUPS:
+            raise ValueError(f"group must be one of {', '.join(_TRACE_GROUPS)}")
+        lines = await profiler.tracemalloc_top(seconds, top, group)
+        return web.Response(text="".join(line + "\n" for line in lines))
+
+    def guarded(handler: Any) -> Any:
+        async def run(request: web.Request) -> web.StreamResponse:
+            try:
+                return await handler(request)
+            except ValueError as exc:
+                return web.json_response({"ok": False, "message": str(exc)}, status=400)
+            except ProfilerBusy:
+                message = "a profiling session is already running"
+                return web.json_response({"ok": False, "message": message}, status=409)
+
+        return run
+
+    app.router.add_get("/debug/profile", guarded(profile))
+    app.router.add_get("/debug/tracemalloc", guarded(allocations))
+    return profiler
+
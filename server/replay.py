@@ -0,0 +1,303 @@
+"""Session recording and deterministic replay.
+
+A :class:`Recorder` writes everything that changes the grid other than the
+solver itself to a recording directory:
+
+``events.jsonl``
+    One JSON object per line, each with the ``tick`` it happened at: a
+    ``header`` first, then every ``edit_grid`` batch handed to
+    :meth:`~server.state.SimState.apply_edits` (``ops``), every ``control``
+    change and finally ``end``.
+``keyframe-<tick>.pszl``
+    The grid right after tick ``<tick>`` was stepped, before the edits
+    applied at that tick, in the binary level format of :mod:`server.io`.
+``keyframes.jsonl``
+    The keyframe index: ``tick``, ``file`` and the byte ``offset`` in
+    ``events.jsonl`` of the first event recorded after the keyframe.
+
+Edits are applied between ticks, so stepping a keyframe with any solver
+from :data:`~server.tick.SOLVERS` and applying the recorded batches at their
+ticks reproduces the recorded grids exactly. :class:`Replay` does that,
+seeking through the keyframe index, and can check the result against every
+recorded keyframe. ``pszcz-replay`` (``python -m server.replay``) is the
+command-line front end.
+"""
+
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import logging
+import queue
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .io import load_level, save_level
+from .state import SimState
+from .tick import DEFAULT_SOLVER, SOLVERS, Solver, get_solver
+
+logger = logging.getLogger(__name__)
+
+RECORDING_VERSION = 1
+EVENTS_NAME = "events.jsonl"
+KEYFRAMES_NAME = "keyframes.jsonl"
+
+# Bytes at the end of the event log searched for the ``end`` event.
+_TAIL_BYTES = 1 << 16
+
+
+class Recorder:
+    """Append a session's edits, control changes and keyframes to ``directory``.
+
+    Calls only enqueue work; a background thread does the writing, so
+    recording never waits on the disk. Keyframes are taken with
+    :meth:`SimState.freeze` and therefore copy nothing up front. Call the
+    recording methods from whichever thread steps the grid, in the order
+    things happen to it.
+    """
+
+    def __init__(
+        self, directory: str | Path, cm_per_pixel: float = 1.0, keyframe_every: int = 1000
+    ) -> None:
+        self.directory = Path(directory)
+        self.cm_per_pixel = cm_per_pixel
+        self.keyframe_every = keyframe_every
+        self._queue: "queue.Queue[Optional[Callable[[], None]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._events: Any = None
+        self._index: Any = None
+
+    def start(self, sim: SimState, tick: int) -> None:
+        """Create the recording and take the first keyframe of ``sim``."""
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._events = open(self.directory / EVENTS_NAME, "w", encoding="utf-8")
+        self._index = open(self.directory / KEYFRAMES_NAME, "w", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+        header = {
+            "t": "header",
+            "tick": tick,
+            "version": RECORDING_VERSION,
+            "cm_per_pixel": self.cm_per_pixel,
+        }
+        self._line(json.dumps(header))
+        self.keyframe(sim, tick)
+
+    def edits(self, tick: int, ops: List[Dict[str, Any]]) -> None:
+        """Record an ``edit_grid`` batch about to be applied after ``tick``."""
+
+        self._line(json.dumps({"t": "edit_grid", "tick": tick, "ops": ops}))
+
+    def control(self, tick: int, changes: Dict[str, Any]) -> None:
+        """Record a ``control`` change; replay does not need it."""
+
+        self._line(json.dumps({"t": "control", "tick": tick, **changes}))
+
+    def ticked(self, sim: SimState, tick: int) -> None:
+        """Note that ``sim`` was stepped to ``tick``; takes due keyframes."""
+
+        if self.keyframe_every > 0 and tick % self.keyframe_every == 0:
+            self.keyframe(sim, tick)
+
+    def keyframe(self, sim: SimState, tick: int) -> None:
+        """Record the grid as it is at ``tick``."""
+
+        frozen = sim.freeze()
+        name = f"keyframe-{tick}.pszl"
+
+        def write() -> None:
+            save_level(self.directory / name, frozen, cm_per_pixel=self.cm_per_pixel)
+            entry = {"tick": tick, "file": name, "offset": self._events.tell()}
+            self._index.write(json.dumps(entry) + "\n")
+            self._index.flush()
+
+        self._queue.put(write)
+
+    def close(self, tick: int) -> None:
+        """Record the end of the session at ``tick`` and finish writing."""
+
+        if self._thread is None:
+            return
+        self._line(json.dumps({"t": "end", "tick": tick}))
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._events.close()
+        self._index.close()
+
+    def _line(self, line: str) -> None:
+        def write() -> None:
+            self._events.write(line + "\n")
+            self._events.flush()
+
+        self._queue.put(write)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                item()
+            except Exception:
+                logger.exception("recording to %s failed", self.directory)
+
+
+class Replay:
+    """Re-run a recording in ``directory`` with ``solver``.
+
+    ``first`` is the tick of the first keyframe, ``end`` the tick the
+    session ended at (``None`` if it did not end cleanly) and
+    ``cm_per_pixel`` the grid's scale.
+    """
+
+    def __init__(self, directory: str | Path, solver: Solver | None = None) -> None:
+        self.directory = Path(directory)
+        self.solver = solver if solver is not None else get_solver(DEFAULT_SOLVER)
+        self.keyframes: List[Tuple[int, str, int]] = []
+        with open(self.directory / KEYFRAMES_NAME, encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                self.keyframes.append((entry["tick"], entry["file"], entry["offset"]))
+        if not self.keyframes:
+            raise ValueError(f"{self.directory}: recording has no keyframes")
+        self.keyframes.sort()
+        self.first = self.keyframes[0][0]
+        header = next(self._events(0), {})
+        if header.get("t") != "header" or header.get("version") != RECORDING_VERSION:
+            raise ValueError(f"{self.directory}: not a version {RECORDING_VERSION} recording")
+        self.cm_per_pixel = float(header.get("cm_per_pixel", 1.0))
+        self.end: Optional[int] = None
+        # Only the tail of the event log can hold ``end``.
+        events = self.directory / EVENTS_NAME
+        tail = max(events.stat().st_size - _TAIL_BYTES, 0)
+        for event in self._events(tail, partial=True):
+            if event["t"] == "end":
+                self.end = event["tick"]
+
+    def last(self) -> int:
+        """Return the last recorded tick (``end``, else the last event)."""
+
+        if self.end is not None:
+            return self.end
+        last = self.keyframes[-1][0]
+        for event in self._events(self.keyframes[-1][2]):
+            last = max(last, event["tick"])
+        return last
+
+    def seek(self, tick: int) -> SimState:
+        """Return the grid right after tick ``tick`` was stepped.
+
+        Starts from the nearest keyframe at or before ``tick``.
+        """
+
+        if tick < self.first:
+            raise ValueError(f"tick {tick} is before the first keyframe ({self.first})")
+        i = bisect.bisect_right([k[0] for k in self.keyframes], tick) - 1
+        start, _name, offset = self.keyframes[i]
+        sim = self._load(i)
+        self._play(sim, start, offset, tick)
+        return sim
+
+    def verify(self) -> List[int]:
+        """Replay from the first keyframe and return ticks whose keyframe differs."""
+
+        sim = self._load(0)
+        ticks = {k[0]: i for i, k in enumerate(self.keyframes)}
+        mismatches: List[int] = []
+
+        def check(tick: int, sim: SimState) -> None:
+            i = ticks.get(tick)
+            if i is not None and sim != self._load(i):
+                mismatches.append(tick)
+
+        self._play(sim, self.first, self.keyframes[0][2], self.last(), check)
+        return mismatches
+
+    def _load(self, i: int) -> SimState:
+        sim = SimState()
+        load_level(self.directory / self.keyframes[i][1], sim)
+        # Keyframes are memory-mapped copy-on-write; step private planes.
+        sim.set_planes(sim.materials.copy(), sim.depths.copy())
+        return sim
+
+    def _events(self, offset: int, partial: bool = False) -> Iterator[Dict[str, Any]]:
+        """Yield the events from byte ``offset`` on.
+
+        With ``partial`` the offset may fall inside a line, which is skipped.
+        """
+
+        with open(self.directory / EVENTS_NAME, "rb") as f:
+            f.seek(offset)
+            if partial and offset:
+                f.readline()
+            for line in f:
+                if line.endswith(b"\n"):  # a torn last line is ignored
+                    yield json.loads(line)
+
+    def _play(
+        self,
+        sim: SimState,
+        tick: int,
+        offset: int,
+        until: int,
+        check: Optional[Callable[[int, SimState], None]] = None,
+    ) -> None:
+        def step_to(target: int) -> int:
+            nonlocal tick
+            while tick < target:
+                self.solver(sim)
+                tick += 1
+                if check is not None:
+                    check(tick, sim)
+            return tick
+
+        for event in self._events(offset):
+            if event["tick"] >= until:
+                break
+            step_to(event["tick"])
+            if event["t"] == "edit_grid":
+                sim.apply_edits(event["ops"])
+        step_to(until)
+
+
+def main() -> None:
+    """Replay a recording to a tick, optionally verifying or saving the grid."""
+
+    parser = argparse.ArgumentParser(description="Replay a recorded simulator session")
+    parser.add_argument("recording", help="directory written by pszcz-server --record")
+    parser.add_argument("--tick", type=int, help="tick to seek to (default: the end)")
+    parser.add_argument(
+        "--solver",
+        choices=sorted(SOLVERS),
+        default=DEFAULT_SOLVER,
+        help="water simulation kernel to replay with",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="replay the whole recording and compare every keyframe",
+    )
+    parser.add_argument("--out", help="save the grid at --tick to this level file")
+    args = parser.parse_args()
+
+    replay = Replay(args.recording, get_solver(args.solver))
+    if args.verify:
+        mismatches = replay.verify()
+        if mismatches:
+            print(f"keyframes differ at ticks {mismatches}")
+            sys.exit(1)
+        print(f"{len(replay.keyframes)} keyframes match up to tick {replay.last()}")
+    tick = args.tick if args.tick is not None else replay.last()
+    sim = replay.seek(tick)
+    print(f"tick {tick}: {sim.rows}x{sim.cols} grid, water {float(sim.depths.sum()):.3f}")
+    if args.out:
+        save_level(args.out, sim, cm_per_pixel=replay.cm_per_pixel)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,26 @@
 
 The simulator maintains a rectangular pixel grid. Each cell stores a terrain
 ``material`` and water ``depth`` in the ``0.0–1.0`` range.
+
+The grid is stored as a structure of arrays: a ``uint8`` plane of material
+codes and a ``float32`` plane of water depths. :class:`Pixel` objects are only
+materialised on demand for compatibility with code that walks ``grid``.
 """
 
 from __future__ import annotations
 
+import base64
+import binascii
+import weakref
 from dataclasses import dataclass, field
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+
+try:  # optional dependency
+    from scipy import ndimage
+except ImportError:  # pragma: no cover - depends on the environment
+    ndimage = None  # type: ignore[assignment]
 
 
 # Supported materials for a :class:`Pixel`.
@@ -17,11 +31,39 @@ VALID_MATERIALS = {"stone", "space", "spring", "sink"}
 SOLID_MATERIALS = {"stone"}
 PASSABLE_MATERIALS = {"space", "spring", "sink"}
 
+# Codes used in the ``materials`` plane. ``space`` is ``0`` so that a freshly
+# zeroed plane is an empty world.
+CODE_MATERIALS: Tuple[str, ...] = ("space", "stone", "spring", "sink")
+MATERIAL_CODES: Dict[str, int] = {name: code for code, name in enumerate(CODE_MATERIALS)}
 
-@dataclass
+SPACE = MATERIAL_CODES["space"]
+STONE = MATERIAL_CODES["stone"]
+SPRING = MATERIAL_CODES["spring"]
+SINK = MATERIAL_CODES["sink"]
+
+# Lookup tables indexed by material code.
+SOLID_LUT = np.array([name in SOLID_MATERIALS for name in CODE_MATERIALS], dtype=bool)
+PASSABLE_LUT = np.array(
+    [name in PASSABLE_MATERIALS for name in CODE_MATERIALS], dtype=bool
+)
+
+_T = TypeVar("_T")
+
+MATERIAL_DTYPE = np.uint8
+DEPTH_DTYPE = np.float32
+
+# Edge length of the square chunks whose activity is tracked in
+# :attr:`SimState.awake`.
+CHUNK = 32
+
+
+@dataclass(frozen=True)
 class Pixel:
     """Single cell in the simulation grid.
 
+    Pixels are read-only views of one cell; edit the grid through
+    :meth:`SimState.apply_edits` or the ``materials``/``depths`` planes.
+
     Attributes
     ----------
     material:
@@ -34,63 +76,504 @@ class Pixel:
     depth: float = 0.0
 
 
+def depth_values(depths: np.ndarray) -> List[Any]:
+    """Return ``depths`` as (nested) Python floats for JSON output.
+
+    Each value is the float with the shortest decimal form that rounds to the
+    stored ``float32``, so a depth written as ``0.3`` reads back as ``0.3``
+    rather than ``0.30000001192092896``.
+    """
+
+    values, inverse = np.unique(depths, return_inverse=True)
+    shortest = np.array([float(str(v)) for v in values], dtype=np.float64)
+    return shortest[inverse].reshape(depths.shape).tolist()
+
+
+def _empty_materials() -> np.ndarray:
+    return np.zeros((0, 0), dtype=MATERIAL_DTYPE)
+
+
+def _empty_depths() -> np.ndarray:
+    return np.zeros((0, 0), dtype=DEPTH_DTYPE)
+
+
 @dataclass
 class SimState:
-    """Simulation state consisting only of the pixel grid."""
+    """Simulation state consisting only of the pixel grid.
+
+    Attributes
+    ----------
+    materials:
+        ``(rows, cols)`` ``uint8`` array of codes from :data:`MATERIAL_CODES`.
+    depths:
+        ``(rows, cols)`` ``float32`` array of water depths.
+    terrain_version:
+        Counter bumped whenever materials change. Solvers key derived data
+        such as masks on it; call :meth:`touch_terrain` after writing to
+        ``materials`` directly.
+    cache:
+        Scratch space for solvers, keyed by solver-chosen names.
+    version:
+        Counter bumped by every :meth:`mark_rows` call.
+    row_version:
+        ``int64`` array holding, per row, the :attr:`version` at which that
+        row last changed. Consumers remember the version they last saw and
+        select rows with a larger stamp to find what changed since.
+    awake:
+        ``bool`` array with one flag per :data:`CHUNK` x :data:`CHUNK`
+        chunk. Solvers that skip settled chunks step only awake ones;
+        :meth:`apply_edits` wakes the chunks around each edited cell and
+        :meth:`set_planes` wakes everything.
+    stats:
+        Figures reported by the last solver step (e.g. active chunks),
+        included in snapshot ``meta``.
+
+    :meth:`freeze` takes a point-in-time copy that shares the planes. Code
+    that writes a plane in place must first get it from :meth:`writable`
+    (or check :meth:`shared`), which copies it while a frozen copy still
+    holds it.
+    """
+
+    materials: np.ndarray = field(default_factory=_empty_materials, compare=False)
+    depths: np.ndarray = field(default_factory=_empty_depths, compare=False)
+    terrain_version: int = field(default=0, compare=False)
+    version: int = field(default=0, compare=False)
+    row_version: np.ndarray = field(
+        default_factory=lambda: np.zeros(0, dtype=np.int64), repr=False, compare=False
+    )
+    cache: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
+    awake: np.ndarray = field(
+        default_factory=lambda: np.zeros((0, 0), dtype=bool), repr=False, compare=False
+    )
+    stats: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
+    _frozen: List[Tuple["weakref.ref[np.ndarray]", np.ndarray]] = field(
+        default_factory=list, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self) -> None:
+        self.set_planes(self.materials, self.depths)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, SimState):
+            return NotImplemented
+        return np.array_equal(self.materials, other.materials) and np.array_equal(
+            self.depths, other.depths
+        )
+
+    @classmethod
+    def empty(cls, rows: int, cols: int) -> "SimState":
+        """Return a ``rows`` x ``cols`` grid of dry ``space`` cells."""
+
+        return cls(
+            np.zeros((rows, cols), dtype=MATERIAL_DTYPE),
+            np.zeros((rows, cols), dtype=DEPTH_DTYPE),
+        )
+
+    @property
+    def rows(self) -> int:
+        return int(self.materials.shape[0])
+
+    @property
+    def cols(self) -> int:
+        return int(self.materials.shape[1])
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.rows, self.cols
+
+    def set_planes(self, materials: np.ndarray, depths: np.ndarray) -> None:
+        """Replace the grid with the given material and depth planes.
+
+        Arrays that already have the storage dtype are adopted without a copy
+        so that callers can hand in memory-mapped or shared buffers.
+        """
+
+        materials = np.asarray(materials, dtype=MATERIAL_DTYPE)
+        depths = np.asarray(depths, dtype=DEPTH_DTYPE)
+        if materials.ndim != 2 or materials.shape != depths.shape:
+            raise ValueError("material and depth planes must be 2-D and equal in shape")
+        self.materials = materials
+        self.depths = depths
+        self.row_version = np.zeros(materials.shape[0], dtype=np.int64)
+        rows, cols = materials.shape
+        self.awake = np.ones((-(-rows // CHUNK), -(-cols // CHUNK)), dtype=bool)
+        self.mark_rows(slice(None))
+        self.touch_terrain()
+
+    def freeze(self) -> "SimState":
+        """Return a read-only copy of the grid as it is now, without copying.
+
+        The copy's planes are views of this state's planes. While the copy
+        is alive, :meth:`writable` copies a plane before it may be written
+        in place, so the copy never changes.
+        """
+
+        views = []
+        for plane in (self.materials, self.depths):
+            view = plane.view(np.ndarray)
+            view.flags.writeable = False
+            self._frozen.append((weakref.ref(view), plane))
+            views.append(view)
+        frozen = SimState(*views)
+        frozen.version = self.version
+        frozen.terrain_version = self.terrain_version
+        frozen.row_version = self.row_version.copy()
+        return frozen
+
+    def shared(self, plane: np.ndarray) -> bool:
+        """Return whether a live :meth:`freeze` copy still holds ``plane``."""
+
+        self._frozen = [(ref, p) for ref, p in self._frozen if ref() is not None]
+        return any(p is plane for _, p in self._frozen)
+
+    def writable(self, name: str) -> np.ndarray:
+        """Return the ``materials`` or ``depths`` plane, safe to write in place.
+
+        A plane still held by a frozen copy is replaced by a private copy
+        first.
+        """
+
+        plane: np.ndarray = getattr(self, name)
+        if self.shared(plane):
+            plane = plane.copy()
+            setattr(self, name, plane)
+        return plane
+
+    def mark_rows(self, rows: Any) -> None:
+        """Record that ``rows`` (an index, slice or boolean mask) changed."""
+
+        self.version += 1
+        self.row_version[rows] = self.version
 
-    grid: List[List[Pixel]] = field(default_factory=list)
+    def wake(self, r: int, c: int) -> None:
+        """Wake the chunk holding cell ``(r, c)`` and its four neighbours."""
+
+        cr, cc = r // CHUNK, c // CHUNK
+        self.awake[max(cr - 1, 0) : cr + 2, cc] = True
+        self.awake[cr, max(cc - 1, 0) : cc + 2] = True
+
+    def touch_terrain(self) -> None:
+        """Record that the ``materials`` plane changed."""
+
+        self.terrain_version += 1
+
+    def cached(self, key: str, build: Callable[[], _T]) -> _T:
+        """Return ``build()`` memoised for the current terrain version."""
+
+        entry = self.cache.get(key)
+        if entry is None or entry[0] != self.terrain_version:
+            entry = (self.terrain_version, build())
+            self.cache[key] = entry
+        return entry[1]
+
+    def clear(self, rows: int, cols: int) -> None:
+        """Replace the grid with ``rows`` x ``cols`` dry ``space`` cells."""
+
+        self.set_planes(
+            np.zeros((rows, cols), dtype=MATERIAL_DTYPE),
+            np.zeros((rows, cols), dtype=DEPTH_DTYPE),
+        )
+
+    @property
+    def grid(self) -> List[List[Pixel]]:
+        """Return the whole grid as freshly built, read-only :class:`Pixel` rows.
+
+        This copies every cell; read single cells from the ``materials`` and
+        ``depths`` planes instead.
+        """
+
+        names = CODE_MATERIALS
+        return [
+            [Pixel(names[m], d) for m, d in zip(mrow, drow)]
+            for mrow, drow in zip(self.materials.tolist(), depth_values(self.depths))
+        ]
+
+    @grid.setter
+    def grid(self, grid: Sequence[Sequence[Pixel]]) -> None:
+        rows = len(grid)
+        cols = max((len(row) for row in grid), default=0)
+        materials = np.zeros((rows, cols), dtype=MATERIAL_DTYPE)
+        depths = np.zeros((rows, cols), dtype=DEPTH_DTYPE)
+        for r, row in enumerate(grid):
+            materials[r, : len(row)] = [MATERIAL_CODES[p.material] for p in row]
+            depths[r, : len(row)] = [p.depth for p in row]
+        self.set_planes(materials, depths)
 
     def snapshot(self) -> Dict[str, Any]:
         """Return a snapshot of the current grid."""
 
+        names = CODE_MATERIALS
         return {
             "grid": [
-                [
-                    {"material": cell.material, "depth": cell.depth}
-                    for cell in row
-                ]
-                for row in self.grid
+                [{"material": names[m], "depth": d} for m, d in zip(mrow, drow)]
+                for mrow, drow in zip(self.materials.tolist(), depth_values(self.depths))
             ]
         }
 
     def apply_edits(self, edits: List[Dict[str, Any]]) -> Optional[Dict[str, str]]:
         """Apply a batch of grid edits atomically.
 
+        Every operation sets ``material`` and, if ``depth`` is given, the
+        water depth (clamped to ``0.0–1.0``) of the cells it covers.
+
         Supported operations
         --------------------
         ``set_pixel``
             ``{"op":"set_pixel","r":int,"c":int,"material":str,"depth":float?}``
+        ``fill_rect``
+            ``{"op":"fill_rect","r":int,"c":int,"rows":int,"cols":int,
+            "material":str,"depth":float?}``
+        ``line``
+            ``{"op":"line","r0":int,"c0":int,"r1":int,"c1":int,
+            "material":str,"depth":float?}``, the cells nearest to the
+            segment between both (inclusive) ends.
+        ``flood_fill``
+            ``{"op":"flood_fill","r":int,"c":int,"material":str,"depth":float?}``,
+            the 4-connected area of cells with the material of ``(r, c)`` as
+            the batch left it so far.
+        ``set_region``
+            ``{"op":"set_region","r":int,"c":int,"rows":int,"cols":int,
+            "materials":str,"depths":str?}``, where ``materials`` is the
+            base64 of ``rows * cols`` material codes (``u8``, row-major) and
+            ``depths`` that of as many little-endian ``f32`` depths.
+
+        The whole batch is validated before anything is written, so a batch
+        with an invalid operation leaves the grid unchanged. Each operation
+        is then applied with one array assignment.
 
         Returns ``None`` on success or an error ``{"code": str}`` mapping on
         failure.
         """
 
-        rows = len(self.grid)
-        cols = len(self.grid[0]) if rows else 0
-
-        for edit in edits:
-            op = edit.get("op")
-            r = edit.get("r")
-            c = edit.get("c")
-            if not isinstance(r, int) or not isinstance(c, int):
-                return {"code": "bad_request"}
-            if r < 0 or c < 0 or r >= rows or c >= cols:
-                return {"code": "index_out_of_bounds"}
-            cell = self.grid[r][c]
-
-            if op == "set_pixel":
-                material = edit.get("material")
-                if material not in VALID_MATERIALS:
-                    return {"code": "invalid_material"}
-                cell.material = material
-                depth = edit.get("depth")
-                if depth is not None:
-                    try:
-                        cell.depth = max(0.0, min(1.0, float(depth)))
-                    except (TypeError, ValueError):
-                        return {"code": "bad_request"}
-            else:
-                return {"code": "bad_request"}
+        return self.apply_batches([edits])[0]
+
+    def apply_batches(self, batches: Sequence[Any]) -> List[Optional[Dict[str, str]]]:
+        """Apply several edit batches in order, each as :meth:`apply_edits` would.
+
+        Returns each batch's result; a failing batch changes nothing and the
+        others are still applied. Consecutive ``set_pixel`` operations, also
+        across batches, are coalesced: the last write to a cell wins and the
+        whole run is written with one assignment per plane.
+        """
+
+        results: List[Optional[Dict[str, str]]] = []
+        plans: List[_Edit] = []
+        for edits in batches:
+            batch = _plan_batch(edits, self.shape)
+            if isinstance(batch, dict):
+                results.append(batch)
+                continue
+            plans.extend(batch)
+            results.append(None)
+        run: List[_Edit] = []
+        for plan in plans:
+            if plan.pixel:
+                run.append(plan)
+                continue
+            self._apply_pixels(run)
+            run = []
+            self._apply_edit(plan)
+        self._apply_pixels(run)
+        return results
+
+    def _apply_pixels(self, run: List["_Edit"]) -> None:
+        if not run:
+            return
+        r = np.fromiter((p.window[0] for p in run), np.intp, len(run))
+        c = np.fromiter((p.window[2] for p in run), np.intp, len(run))
+        last = _last_writes(r * self.cols + c)
+        codes = np.fromiter((run[i].material for i in last), MATERIAL_DTYPE, last.size)
+        self.writable("materials")[r[last], c[last]] = codes
+        wet = np.array([i for i, p in enumerate(run) if p.depth is not None], dtype=np.intp)
+        if wet.size:
+            wet = wet[_last_writes(r[wet] * self.cols + c[wet])]
+            self.writable("depths")[r[wet], c[wet]] = [run[i].depth for i in wet]
+        self.touch_terrain()
+        self.mark_rows(np.unique(r))
+        cr, cc = r // CHUNK, c // CHUNK
+        last_r, last_c = self.awake.shape[0] - 1, self.awake.shape[1] - 1
+        self.awake[cr, cc] = True
+        self.awake[np.maximum(cr - 1, 0), cc] = True
+        self.awake[np.minimum(cr + 1, last_r), cc] = True
+        self.awake[cr, np.maximum(cc - 1, 0)] = True
+        self.awake[cr, np.minimum(cc + 1, last_c)] = True
+
+    def _apply_edit(self, edit: "_Edit") -> None:
+        index: Any = edit.index
+        r0, r1, c0, c1 = edit.window
+        if index is None:  # flood fill from (r0, c0)
+            index = _flood_region(self.materials, r0, c0)
+            rows = np.flatnonzero(index.any(axis=1))
+            cols = np.flatnonzero(index.any(axis=0))
+            r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        self.writable("materials")[index] = edit.material
+        if edit.depth is not None:
+            self.writable("depths")[index] = edit.depth
+        self.touch_terrain()
+        self.mark_rows(slice(r0, r1))
+        cr0, cr1 = r0 // CHUNK, (r1 - 1) // CHUNK
+        cc0, cc1 = c0 // CHUNK, (c1 - 1) // CHUNK
+        self.awake[max(cr0 - 1, 0) : cr1 + 2, cc0 : cc1 + 1] = True
+        self.awake[cr0 : cr1 + 1, max(cc0 - 1, 0) : cc1 + 2] = True
+
+
+@dataclass
+class _Edit:
+    """A validated edit operation.
+
+    ``index`` selects the cells in the planes (``None`` for a flood fill,
+    whose cells are only known once earlier edits are applied) and
+    ``window`` is their bounding box ``(r0, r1, c0, c1)``, or the seed cell
+    of a flood fill. ``material`` and ``depth`` are scalars or arrays shaped
+    like the selection; ``depth`` is ``None`` to keep the water. ``pixel``
+    marks a ``set_pixel``, which :meth:`SimState.apply_batches` coalesces.
+    """
 
+    index: Any
+    window: Tuple[int, int, int, int]
+    material: Any
+    depth: Any = None
+    pixel: bool = False
+
+
+def _ints(edit: Dict[str, Any], *names: str) -> Optional[List[int]]:
+    values = [edit.get(name) for name in names]
+    if not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return None
+    return values  # type: ignore[return-value]
+
+
+def _last_writes(cells: np.ndarray) -> np.ndarray:
+    """Return the positions of the last occurrence of each value in ``cells``.
+
+    Assignment order for repeated fancy indices is unspecified, so coalesced
+    writes keep only these.
+    """
+
+    _values, first = np.unique(cells[::-1], return_index=True)
+    return cells.size - 1 - first
+
+
+def _plan_batch(edits: Any, shape: Tuple[int, int]) -> Any:
+    """Validate a batch and return its :class:`_Edit` list or an error mapping."""
+
+    if not isinstance(edits, list):
+        return {"code": "bad_request"}
+    plans = []
+    for edit in edits:
+        plan = _plan_edit(edit, shape)
+        if isinstance(plan, dict):
+            return plan
+        plans.append(plan)
+    return plans
+
+
+def _plan_edit(edit: Any, shape: Tuple[int, int]) -> Any:
+    """Validate one edit and return its :class:`_Edit` or an error mapping."""
+
+    if not isinstance(edit, dict):
+        return {"code": "bad_request"}
+    rows, cols = shape
+    op = edit.get("op")
+    if op in ("set_pixel", "flood_fill"):
+        point = _ints(edit, "r", "c")
+        if point is None:
+            return {"code": "bad_request"}
+        r, c = point
+        window = (r, r + 1, c, c + 1)
+        index: Any = None if op == "flood_fill" else (r, c)
+    elif op in ("fill_rect", "set_region"):
+        rect = _ints(edit, "r", "c", "rows", "cols")
+        if rect is None or rect[2] < 1 or rect[3] < 1:
+            return {"code": "bad_request"}
+        r, c, h, w = rect
+        window = (r, r + h, c, c + w)
+        index = (slice(r, r + h), slice(c, c + w))
+    elif op == "line":
+        ends = _ints(edit, "r0", "c0", "r1", "c1")
+        if ends is None:
+            return {"code": "bad_request"}
+        ar, ac, br, bc = ends
+        n = max(abs(br - ar), abs(bc - ac)) + 1
+        index = (
+            np.rint(np.linspace(ar, br, n)).astype(np.intp),
+            np.rint(np.linspace(ac, bc, n)).astype(np.intp),
+        )
+        window = (min(ar, br), max(ar, br) + 1, min(ac, bc), max(ac, bc) + 1)
+    else:
+        return {"code": "bad_request"}
+    r0, r1, c0, c1 = window
+    if r0 < 0 or c0 < 0 or r1 > rows or c1 > cols:
+        return {"code": "index_out_of_bounds"}
+    if op == "set_region":
+        return _plan_region(edit, index, window)
+
+    material = edit.get("material")
+    if material not in VALID_MATERIALS:
+        return {"code": "invalid_material"}
+    depth = edit.get("depth")
+    if depth is not None:
+        try:
+            depth = max(0.0, min(1.0, float(depth)))
+        except (TypeError, ValueError):
+            return {"code": "bad_request"}
+    return _Edit(index, window, MATERIAL_CODES[material], depth, pixel=op == "set_pixel")
+
+
+def _plan_region(edit: Dict[str, Any], index: Any, window: Tuple[int, int, int, int]) -> Any:
+    r0, r1, c0, c1 = window
+    shape = (r1 - r0, c1 - c0)
+    materials = _unpack(edit.get("materials"), MATERIAL_DTYPE, shape)
+    if materials is None:
+        return {"code": "bad_request"}
+    if materials.size and int(materials.max()) >= len(CODE_MATERIALS):
+        return {"code": "invalid_material"}
+    depths = None
+    if edit.get("depths") is not None:
+        depths = _unpack(edit["depths"], np.dtype("<f4"), shape)
+        if depths is None or np.isnan(depths).any():
+            return {"code": "bad_request"}
+        depths = np.clip(depths, 0.0, 1.0)
+    return _Edit(index, window, materials, depths)
+
+
+def _unpack(payload: Any, dtype: Any, shape: Tuple[int, int]) -> Optional[np.ndarray]:
+    """Decode a base64 ``payload`` of ``shape`` values of ``dtype``."""
+
+    if not isinstance(payload, str):
+        return None
+    try:
+        raw = base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
         return None
+    dtype = np.dtype(dtype)
+    if len(raw) != shape[0] * shape[1] * dtype.itemsize:
+        return None
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def _flood_region(materials: np.ndarray, r: int, c: int) -> np.ndarray:
+    """Return the mask of the 4-connected area of ``materials[r, c]``'s material."""
 
+    same = materials == materials[r, c]
+    if ndimage is not None:
+        labels, _count = ndimage.label(same)
+        return labels == labels[r, c]
+    # Without scipy, grow the area one run of equal cells in a row at a time.
+    region = np.zeros_like(same)
+    stack = [(r, c)]
+    while stack:
+        r, c = stack.pop()
+        if region[r, c]:
+            continue
+        row = same[r]
+        left = c - int(np.argmin(row[c::-1])) + 1 if not row[: c + 1].all() else 0
+        right = c + int(np.argmin(row[c:])) if not row[c:].all() else row.size
+        region[r, left:right] = True
+        for nr in (r - 1, r + 1):
+            if 0 <= nr < same.shape[0]:
+                open_ = same[nr, left:right] & ~region[nr, left:right]
+                # One seed per run of open cells is enough.
+                starts = np.flatnonzero(open_ & ~np.concatenate(([False], open_[:-1])))
+                stack.extend((nr, left + int(s)) for s in starts)
+    return region
@@ -1,49 +1,695 @@
+"""Water simulation step kernels.
+
+Two interchangeable implementations of the placeholder physics are provided:
+
+``reference``
+    Straightforward per-cell loops; the executable specification.
+``numpy``
+    Whole-array operations on the grid planes; bit-identical to the reference
+    and the default used by the server.
+``chunked``
+    The ``numpy`` kernel applied only to awake chunks (see
+    :attr:`~server.state.SimState.awake`); settled chunks sleep until a
+    neighbour or an edit wakes them. Also bit-identical to the reference.
+
+Two further solvers replace the placeholder physics with water that is
+conserved and levels out sideways:
+
+``spread``
+    A cellular automaton moving water down, left and right in adaptive
+    substeps (:func:`flow_step_spread`).
+``pressure``
+    Also moves water through connected bodies by pressure, solving a
+    sparse linear system every tick (:func:`flow_step_pressure`).
+
+Every solver takes a :class:`~server.state.SimState` and mutates it in place.
+"""
+
 from __future__ import annotations
 
-from .state import PASSABLE_MATERIALS, SOLID_MATERIALS, SimState
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
 
+import numpy as np
 
-def _is_open(material: str) -> bool:
-    return material in PASSABLE_MATERIALS
+from .state import CHUNK, DEPTH_DTYPE, PASSABLE_LUT, SINK, SOLID_LUT, SPRING, SimState
 
+Solver = Callable[[SimState], None]
 
-def flow_step(state: SimState) -> None:
-    """Advance water simulation by one tick."""
 
-    rows = len(state.grid)
-    if rows == 0:
+def _commit_depths(state: SimState, new: np.ndarray) -> None:
+    """Store ``new`` as the depth plane and stamp the rows that changed.
+
+    ``new`` must be a fresh array: while a frozen copy holds the current
+    plane it is adopted instead of copied in.
+    """
+
+    changed = (new != state.depths).any(axis=1)
+    if changed.any():
+        state.mark_rows(changed)
+    if state.shared(state.depths):
+        state.depths = new
+    else:
+        state.depths[...] = new
+
+
+def flow_step_reference(state: SimState) -> None:
+    """Advance water simulation by one tick using per-cell loops."""
+
+    rows, cols = state.shape
+    if rows == 0 or cols == 0:
         return
-    cols = len(state.grid[0])
+
+    materials = state.materials.tolist()
+    depths = state.depths.tolist()
+    solid = SOLID_LUT.tolist()
+    passable = PASSABLE_LUT.tolist()
 
     # Springs produce water, sinks remove it before each step.
-    for row in state.grid:
-        for cell in row:
-            if cell.material == "spring":
-                cell.depth = 1.0
-            elif cell.material == "sink":
-                cell.depth = 0.0
-
-    new_depths = [[cell.depth for cell in row] for row in state.grid]
+    for mrow, drow in zip(materials, depths):
+        for c, material in enumerate(mrow):
+            if material == SPRING:
+                drow[c] = 1.0
+            elif material == SINK:
+                drow[c] = 0.0
+
+    new_depths = [list(drow) for drow in depths]
     for r in range(rows - 1, -1, -1):
         for c in range(cols):
-            cell = state.grid[r][c]
-            if cell.material in SOLID_MATERIALS:
+            if solid[materials[r][c]]:
                 new_depths[r][c] = 0.0
                 continue
-            if cell.depth <= 0:
+            depth = depths[r][c]
+            if depth <= 0:
                 continue
             below_r = r + 1
-            if below_r < rows:
-                below = state.grid[below_r][c]
-                if _is_open(below.material):
-                    transfer = cell.depth
-                    new_depths[r][c] -= transfer
-                    new_depths[below_r][c] += transfer
+            if below_r < rows and passable[materials[below_r][c]]:
+                transfer = depth
+                new_depths[r][c] -= transfer
+                new_depths[below_r][c] += transfer
 
     for r in range(rows):
+        mrow = materials[r]
+        nrow = new_depths[r]
         for c in range(cols):
-            cell = state.grid[r][c]
-            cell.depth = max(min(new_depths[r][c], 1.0), 0.0)
-            if cell.material == "sink":
-                cell.depth = 0.0
+            nrow[c] = max(min(nrow[c], 1.0), 0.0)
+            if mrow[c] == SINK:
+                nrow[c] = 0.0
+
+    _commit_depths(state, np.asarray(new_depths, dtype=DEPTH_DTYPE))
+
+
+@dataclass
+class _Masks:
+    """Terrain-derived multiplier planes used by :func:`flow_step_vectorized`."""
+
+    keep: np.ndarray  # 0.0 for springs and sinks, 1.0 elsewhere
+    fill: np.ndarray  # 1.0 for springs, 0.0 elsewhere
+    moving: np.ndarray  # 1.0 where water drops into a passable cell below
+    wet: np.ndarray  # 0.0 for solid cells and sinks, 1.0 elsewhere
+
+    def __getitem__(self, window: Any) -> "_Masks":
+        return _Masks(
+            self.keep[window], self.fill[window], self.moving[window], self.wet[window]
+        )
+
+
+def _build_masks(materials: np.ndarray) -> _Masks:
+    spring = materials == SPRING
+    sink = materials == SINK
+    solid = SOLID_LUT[materials]
+    moving = np.zeros(materials.shape, dtype=bool)
+    np.logical_and(~solid[:-1], PASSABLE_LUT[materials[1:]], out=moving[:-1])
+    f32 = DEPTH_DTYPE
+    return _Masks(
+        keep=(~(spring | sink)).astype(f32),
+        fill=spring.astype(f32),
+        moving=moving.astype(f32),
+        wet=(~(solid | sink)).astype(f32),
+    )
+
+
+def _advance(depths: np.ndarray, masks: _Masks) -> np.ndarray:
+    """Return ``depths`` stepped by one tick as a new array.
+
+    ``depths`` may be a window of the grid with ``masks`` cut to the same
+    window; its first row then only supplies inflow and the transfer out of
+    its last row is lost, so callers keep the rows in between.
+    """
+
+    # Springs produce water, sinks remove it before each step.
+    new = depths * masks.keep
+    new += masks.fill
+    # Only positive water moves; the reference skips cells with depth <= 0.
+    transfer = np.maximum(new, 0.0) * masks.moving
+    new -= transfer
+    new[1:] += transfer[:-1]
+    np.clip(new, 0.0, 1.0, out=new)
+    new *= masks.wet
+    return new
+
+
+def flow_step_vectorized(state: SimState) -> None:
+    """Advance water simulation by one tick using whole-array operations.
+
+    Performs the same spring refill, sink drain, downward transfer into
+    passable cells and clamping as :func:`flow_step_reference`. Branches are
+    replaced by multiplication with ``0.0``/``1.0`` planes that depend only on
+    the terrain and are rebuilt when :attr:`SimState.terrain_version` changes.
+    Multiplying a non-negative depth by ``0.0`` or ``1.0`` is exact, so the
+    result matches the reference's assignments bit for bit.
+    """
+
+    depths = state.depths
+    if depths.size == 0:
+        return
+    materials = state.materials
+    masks = state.cached("flow_step_vectorized", lambda: _build_masks(materials))
+    _commit_depths(state, _advance(depths, masks))
+
+
+def _runs(flags: np.ndarray) -> List[Tuple[int, int]]:
+    """Return ``(start, stop)`` index pairs of the runs of ``True`` in ``flags``."""
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], flags.view(np.int8), [0]))))
+    return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+
+def flow_step_chunked(state: SimState) -> None:
+    """Advance water simulation by one tick, stepping only awake chunks.
+
+    Water only enters a cell from the cell above, so a chunk whose depths
+    did not change last tick reaches the same fixed point again unless the
+    chunk next to it changed or an edit touched it. Such chunks are left
+    asleep. Each run of adjacent awake chunks in a chunk row is stepped with
+    the same arithmetic as :func:`flow_step_vectorized`, reading the row
+    above the run for inflow. Chunk rows are processed bottom-up so that row
+    still holds the previous tick's depths when it is read.
+
+    Chunks that changed, and their four neighbours, stay awake for the next
+    tick. The chunks stepped are reported in ``state.stats["chunks"]``.
+    """
+
+    if state.depths.size == 0:
+        return
+    depths = state.writable("depths")
+    materials = state.materials
+    masks = state.cached("flow_step_vectorized", lambda: _build_masks(materials))
+    awake = state.awake
+    changed = np.zeros_like(awake)
+    rows = depths.shape[0]
+    dirty_rows = np.zeros(rows, dtype=bool)
+
+    for cr in range(awake.shape[0] - 1, -1, -1):
+        r0, r1 = cr * CHUNK, min((cr + 1) * CHUNK, rows)
+        top = max(r0 - 1, 0)
+        for a, b in _runs(awake[cr]):
+            c0, c1 = a * CHUNK, b * CHUNK
+            window = (slice(top, r1), slice(c0, c1))
+            new = _advance(depths[window], masks[window])[r0 - top :]
+            old = depths[r0:r1, c0:c1]
+            diff = new != old
+            cols_changed = diff.any(axis=0)
+            offsets = np.arange(0, cols_changed.size, CHUNK)
+            changed[cr, a:b] = np.logical_or.reduceat(cols_changed, offsets)
+            dirty_rows[r0:r1] |= diff.any(axis=1)
+            old[...] = new
+
+    if dirty_rows.any():
+        state.mark_rows(dirty_rows)
+    state.stats["chunks"] = {
+        "size": CHUNK,
+        "active": np.argwhere(awake).tolist(),
+    }
+    woken = changed.copy()
+    woken[1:] |= changed[:-1]
+    woken[:-1] |= changed[1:]
+    woken[:, 1:] |= changed[:, :-1]
+    woken[:, :-1] |= changed[:, 1:]
+    state.awake = woken
+
+
+# Conductance of a link in the pressure solver: the share of a head
+# difference between two cells that flows across their link per tick.
+PRESSURE_CONDUCTANCE = 1.0
+# Root-mean-square equation residual, in cell depths, at which the pressure
+# solve stops, and the most conjugate gradient iterations it runs per tick.
+PRESSURE_TOLERANCE = 1e-4
+PRESSURE_MAX_ITERATIONS = 20
+# Depth from which a cell counts as full.
+FULL = 1.0 - 1e-6
+
+
+@dataclass
+class _Hydraulics:
+    """Terrain-derived structure of the pressure system, plus its warm start.
+
+    ``right`` and ``down`` flag the links from a cell to its right and lower
+    neighbour; both cells must be open (not solid). ``floor`` flags cells
+    resting on a solid cell or the bottom edge and ``ceiling`` cells under a
+    solid cell; the top edge is open to the air.
+    """
+
+    masks: _Masks
+    open: np.ndarray
+    right: np.ndarray
+    down: np.ndarray
+    floor: np.ndarray
+    ceiling: np.ndarray
+    # Solution of the previous tick (heads of the cells solved, NaN
+    # elsewhere), used as the initial guess of the next one, and the flat
+    # indices of the cells it covers.
+    heads: np.ndarray
+    solved: np.ndarray
+    # Scratch map from flat cell index to position in the solved vector.
+    position: np.ndarray
+
+
+def _build_hydraulics(materials: np.ndarray) -> _Hydraulics:
+    solid = SOLID_LUT[materials]
+    open_ = ~solid
+    right = np.zeros(materials.shape, dtype=bool)
+    np.logical_and(open_[:, :-1], open_[:, 1:], out=right[:, :-1])
+    down = np.zeros(materials.shape, dtype=bool)
+    np.logical_and(open_[:-1], open_[1:], out=down[:-1])
+    floor = np.ones(materials.shape, dtype=bool)
+    floor[:-1] = solid[1:]
+    ceiling = np.zeros(materials.shape, dtype=bool)
+    ceiling[1:] = solid[:-1]
+    return _Hydraulics(
+        masks=_build_masks(materials),
+        open=open_,
+        right=right,
+        down=down,
+        floor=floor,
+        ceiling=ceiling,
+        heads=np.full(materials.size, np.nan),
+        solved=np.empty(0, dtype=np.intp),
+        position=np.zeros(materials.size, dtype=np.intp),
+    )
+
+
+def _conjugate_gradient(
+    apply: Callable[[np.ndarray], np.ndarray],
+    b: np.ndarray,
+    x: np.ndarray,
+    inverse_diagonal: np.ndarray,
+    tolerance: float,
+    max_iterations: int,
+) -> Tuple[np.ndarray, int, float]:
+    """Solve ``apply(x) = b`` with Jacobi-preconditioned conjugate gradients.
+
+    Starts from ``x``, which is updated in place, and stops once the
+    root-mean-square residual drops to ``tolerance`` or after
+    ``max_iterations``. Returns the solution, the iterations run and the
+    final root-mean-square residual.
+    """
+
+    r = b - apply(x)
+    limit = tolerance * tolerance * r.size
+    rr = float(r @ r)
+    z = r * inverse_diagonal
+    p = z.copy()
+    rz = float(r @ z)
+    iterations = 0
+    while rr > limit and iterations < max_iterations:
+        q = apply(p)
+        pq = float(p @ q)
+        if pq <= 0.0:
+            break
+        alpha = rz / pq
+        x += alpha * p
+        r -= alpha * q
+        rr = float(r @ r)
+        z = r * inverse_diagonal
+        rz, previous = float(r @ z), rz
+        p *= rz / previous
+        p += z
+        iterations += 1
+    return x, iterations, (rr / max(r.size, 1)) ** 0.5
+
+
+def flow_step_pressure(state: SimState) -> None:
+    """Advance water simulation by one tick with gravity and water pressure.
+
+    Unlike the placeholder kernels this conserves water (apart from springs
+    and sinks) and never fills a cell beyond ``1.0``. A tick has two
+    phases:
+
+    1. Gravity: each cell passes as much water to the open cell below as
+       that cell has room for.
+    2. Pressure: water flows between linked cells along differences of
+       hydraulic head (elevation plus depth), solved implicitly as one
+       sparse symmetric system. Standing water (resting on stone or on full
+       cells) is linked to its wet neighbours in the same row, so it levels
+       out sideways, and a full cell is linked to the cell above it. Full
+       cells with water or stone above them are confined: they keep their
+       water and only pass pressure on, so a connected body behaves like a
+       U-tube and its free surfaces level out. The other linked cells take
+       the depth their solved head leaves them.
+
+    Only the linked cells enter the system, which is solved with
+    Jacobi-preconditioned conjugate gradients, at most
+    :data:`PRESSURE_MAX_ITERATIONS` iterations, starting from the previous
+    tick's heads: settled water needs few iterations, if any, and a
+    disturbed body converges over a few ticks. Which cells are open and may
+    link is derived from the terrain and rebuilt only when
+    :attr:`SimState.terrain_version` changes. Overflow is pushed up a cell
+    and anything outside ``[0, 1]`` is clipped; the water this or an
+    unconverged solve gains or loses is spread back over the solved cells,
+    so the total stays exact. The cells solved, iterations and residual
+    are reported in ``state.stats["pressure"]``.
+    """
+
+    if state.depths.size == 0:
+        return
+    materials = state.materials
+    hyd = state.cached("flow_step_pressure", lambda: _build_hydraulics(materials))
+    masks = hyd.masks
+
+    # Springs produce water, sinks remove it before each step.
+    d = state.depths * masks.keep
+    d += masks.fill
+    d *= hyd.open
+
+    # Gravity, bounded by the room in the cell below.
+    fall = np.minimum(np.maximum(d[:-1], 0.0), np.maximum(1.0 - d[1:], 0.0))
+    fall *= hyd.down[:-1]
+    d[:-1] -= fall
+    d[1:] += fall
+
+    state.stats["pressure"] = _equalize_pressure(d, hyd)
+    d *= masks.wet
+    _commit_depths(state, d)
+
+
+def _equalize_pressure(d: np.ndarray, hyd: _Hydraulics) -> Dict[str, Any]:
+    """Run the pressure phase of :func:`flow_step_pressure` on ``d`` in place."""
+
+    rows, cols = d.shape
+    full = d >= FULL
+    wet = d > 0.0
+    # Cells standing on stone or full cells, and full cells whose water is
+    # held in place by water or stone above.
+    standing = hyd.floor.copy()
+    standing[:-1] |= full[1:]
+    confined = hyd.ceiling.copy()
+    confined[1:] |= wet[:-1]
+    confined &= full
+
+    # Links carrying flow this tick, flagged at both of their cells.
+    right = hyd.right & standing
+    right[:, :-1] &= standing[:, 1:]
+    right[:, :-1] &= wet[:, :-1] | wet[:, 1:]
+    down = np.zeros_like(hyd.down)
+    down[:-1] = hyd.down[:-1] & full[1:]
+    left = np.zeros_like(right)
+    left[:, 1:] = right[:, :-1]
+    up = np.zeros_like(down)
+    up[1:] = down[:-1]
+    cells = np.flatnonzero(right | left | down | up)
+    n = cells.size
+    hyd.heads[hyd.solved] = np.nan
+    hyd.solved = cells
+    if n == 0:
+        return {"cells": 0, "iterations": 0, "residual": 0.0}
+
+    # Cells are in row-major order, so a cell's right-hand link goes to the
+    # next solved cell; vertical links pair ``upper`` with ``lower``.
+    hyd.position[cells] = np.arange(n)
+    across = right.ravel()[cells[:-1]] * PRESSURE_CONDUCTANCE
+    upper_cells = np.flatnonzero(down)
+    upper = hyd.position[upper_cells]
+    lower = hyd.position[upper_cells + cols]
+
+    flat = d.reshape(-1)
+    depth = flat[cells].astype(np.float64)
+    free = ~confined.ravel()[cells]
+    diagonal = free.astype(np.float64)
+    diagonal[:-1] += across
+    diagonal[1:] += across
+    diagonal[upper] += PRESSURE_CONDUCTANCE
+    diagonal[lower] += PRESSURE_CONDUCTANCE
+    elevation = (rows - 1 - cells // cols).astype(np.float64)
+    b = free * (depth + elevation)
+
+    def apply(x: np.ndarray) -> np.ndarray:
+        out = diagonal * x
+        out[:-1] -= across * x[1:]
+        out[1:] -= across * x[:-1]
+        out[upper] -= PRESSURE_CONDUCTANCE * x[lower]
+        out[lower] -= PRESSURE_CONDUCTANCE * x[upper]
+        return out
+
+    guess = hyd.heads[cells]
+    cold = np.isnan(guess)
+    guess[cold] = (depth + elevation)[cold]
+    heads, iterations, residual = _conjugate_gradient(
+        apply, b, guess, 1.0 / diagonal, PRESSURE_TOLERANCE, PRESSURE_MAX_ITERATIONS
+    )
+    hyd.heads[cells] = heads
+
+    new = np.where(free, heads - elevation, depth)
+    excess = np.maximum(new - 1.0, 0.0)
+    new -= excess
+    np.maximum(new, 0.0, out=new)
+    flat[cells] = new
+    # Overflow moves up into the open cell above, solved or not.
+    lifts = (cells >= cols) & hyd.down.ravel()[np.maximum(cells - cols, 0)]
+    targets = cells[lifts] - cols
+    lifted = np.minimum(excess[lifts], 1.0 - flat[targets])
+    flat[targets] += lifted
+    # Repay what clipping and the solve's residual gained or lost.
+    error = float(depth.sum() - new.sum() - lifted.sum())
+    if error:
+        values = flat[cells].astype(np.float64)
+        if error > 0.0:
+            room = (1.0 - values) * (values > 0.0)
+            values += room * min(error / max(float(room.sum()), 1e-300), 1.0)
+        else:
+            values -= values * min(-error / max(float(values.sum()), 1e-300), 1.0)
+        flat[cells] = values
+    return {"cells": int(n), "iterations": iterations, "residual": round(residual, 6)}
+
+
+# Share of the level difference between standing water and a lower
+# neighbour that flows sideways per tick in the spread solver; at most 0.5.
+SPREAD_RATE = 0.25
+# Most water a cell may pass on in one substep of the spread solver, and
+# the most substeps it runs per tick.
+SPREAD_SUBSTEP_FLUX = 0.5
+SPREAD_MAX_SUBSTEPS = 8
+# Water counts as settled, and the tick runs no substeps, once no cell would
+# pass on more than this.
+SPREAD_SETTLED = 1e-6
+
+
+@dataclass
+class _Spread:
+    """Terrain-derived planes used by :func:`flow_step_spread`.
+
+    ``down`` (``rows - 1`` rows, ``1.0`` or ``0.0``) and ``across``
+    (``cols - 1`` columns) flag the links from a cell to the cell below and
+    to its right that join two open cells; ``floor`` flags cells resting on
+    a solid cell or the bottom edge.
+    """
+
+    masks: _Masks
+    open: np.ndarray
+    down: np.ndarray
+    across: np.ndarray
+    floor: np.ndarray
+
+
+def _build_spread(materials: np.ndarray) -> _Spread:
+    solid = SOLID_LUT[materials]
+    open_ = ~solid
+    floor = np.ones(materials.shape, dtype=bool)
+    floor[:-1] = solid[1:]
+    return _Spread(
+        masks=_build_masks(materials),
+        open=open_,
+        down=(open_[:-1] & open_[1:]).astype(DEPTH_DTYPE),
+        across=open_[:, :-1] & open_[:, 1:],
+        floor=floor,
+    )
+
+
+def _fall(d: np.ndarray, spread: _Spread) -> np.ndarray:
+    """Return the water each cell can drop into the room of the cell below."""
+
+    fall = np.minimum(d[:-1], 1.0 - d[1:])
+    np.maximum(fall, 0.0, out=fall)
+    fall *= spread.down
+    return fall
+
+
+def _level(d: np.ndarray, spread: _Spread, rate: float) -> np.ndarray:
+    """Return the water flowing right (negative: left) across each link.
+
+    Only standing water, on a solid cell, the bottom edge or a full cell,
+    flows sideways, ``rate`` of the difference towards the lower side.
+    """
+
+    standing = spread.floor.copy()
+    standing[:-1] |= d[1:] >= FULL
+    flow = d[:, :-1] - d[:, 1:]
+    rightward = flow > 0.0
+    source = standing[:, :-1] & rightward
+    source |= standing[:, 1:] & ~rightward
+    source &= spread.across
+    flow *= source
+    flow *= rate
+    return flow
+
+
+def flow_step_spread(state: SimState) -> None:
+    """Advance water simulation by one tick with falling and spreading water.
+
+    A cellular automaton between the placeholder physics and
+    :func:`flow_step_pressure`: water falls into the room of the cell below
+    and standing water levels out with its left and right neighbours, so
+    basins fill up flat. Each substep first lets water fall, then spread,
+    every transfer taken from one cell and added to another. Falling never
+    takes more than a cell holds or gives more than the cell below has
+    room for, and with a rate of at most ``0.5`` a cell spreading to both
+    sides keeps its depth between its neighbours', so depths stay within
+    ``[0, 1]`` without clipping and water is conserved apart from springs
+    and sinks.
+
+    The tick is split into just enough substeps for no cell to pass on more
+    than :data:`SPREAD_SUBSTEP_FLUX` in one of them, judged from the flow at
+    the start of the tick: at most :data:`SPREAD_MAX_SUBSTEPS`, and none
+    once the water has settled (see :data:`SPREAD_SETTLED`). Every substep moves its share of a tick's
+    flow with whole-array operations. The substeps run and the total water
+    volume (in full cells) are reported in ``state.stats["spread"]``.
+    """
+
+    if state.depths.size == 0:
+        return
+    materials = state.materials
+    spread = state.cached("flow_step_spread", lambda: _build_spread(materials))
+    masks = spread.masks
+
+    # Springs produce water, sinks remove it before each step.
+    d = state.depths * masks.keep
+    d += masks.fill
+    d *= spread.open
+    np.maximum(d, 0.0, out=d)
+
+    # Falling water does not spread, so a cell's outflow is either its fall
+    # or what it sends to both sides.
+    fall = _fall(d, spread)
+    flow = _level(d, spread, SPREAD_RATE)
+    sideways = np.maximum(flow, 0.0)
+    sideways[:, 1:] -= np.minimum(flow[:, :-1], 0.0)
+    peak = max(float(fall.max(initial=0.0)), float(sideways.max(initial=0.0)))
+    peak = max(peak, -float(flow[:, -1].min(initial=0.0)))
+    substeps = 0
+    if peak > SPREAD_SETTLED:
+        substeps = min(int(np.ceil(peak / SPREAD_SUBSTEP_FLUX)), SPREAD_MAX_SUBSTEPS)
+
+    for step in range(substeps):
+        if step:
+            fall = _fall(d, spread)
+        fall /= substeps
+        d[:-1] -= fall
+        d[1:] += fall
+        flow = _level(d, spread, SPREAD_RATE / substeps)
+        d[:, :-1] -= flow
+        d[:, 1:] += flow
+
+    d *= masks.wet
+    _commit_depths(state, d)
+    state.stats["spread"] = {
+        "substeps": substeps,
+        "volume": round(float(d.sum(dtype=np.float64)), 3),
+    }
+
+
+SOLVERS: Dict[str, Solver] = {
+    "reference": flow_step_reference,
+    "numpy": flow_step_vectorized,
+    "chunked": flow_step_chunked,
+    "pressure": flow_step_pressure,
+    "spread": flow_step_spread,
+}
+
+DEFAULT_SOLVER = "numpy"
+
+
+def get_solver(name: str) -> Solver:
+    """Return the solver registered as ``name``.
+
+    Raises ``ValueError`` for unknown names.
+    """
+
+    try:
+        return SOLVERS[name]
+    except KeyError:
+        raise ValueError(
+            f"unknown solver {name!r}; choose from {', '.join(sorted(SOLVERS))}"
+        ) from None
+
+
+def flow_step(state: SimState) -> None:
+    """Advance water simulation by one tick."""
+
+    flow_step_vectorized(state)
+
+
+@dataclass
+class FixedTimestep:
+    """Fixed-timestep accumulator driven by a monotonic clock.
+
+    :meth:`advance` converts elapsed wall time into a whole number of ticks.
+    Because elapsed time is measured against the clock rather than summed
+    from requested sleeps, oversleeping is repaid on the next call instead of
+    drifting. When more than ``max_catchup`` ticks are due at once the excess
+    is dropped and added to :attr:`dropped` so an overloaded server slows
+    down instead of spiralling.
+    """
+
+    max_catchup: int = 5
+    accumulator: float = 0.0
+    last: float | None = None
+    dropped: int = 0
+    behind: float = 0.0
+
+    def advance(self, now: float, dt: float) -> int:
+        """Return how many ticks of length ``dt`` are due at ``now``."""
+
+        if self.last is None:
+            self.last = now
+            return 1
+        self.accumulator += max(0.0, now - self.last)
+        self.last = now
+        steps = int(self.accumulator // dt)
+        self.accumulator -= steps * dt
+        self.behind = self.accumulator
+        if steps > self.max_catchup:
+            self.dropped += steps - self.max_catchup
+            self.behind += (steps - self.max_catchup) * dt
+            steps = self.max_catchup
+        return steps
+
+    def reset(self, now: float) -> None:
+        """Forget accumulated time, e.g. while the simulation is paused."""
+
+        self.last = now
+        self.accumulator = 0.0
+        self.behind = 0.0
+
+    def lag(self) -> float:
+        """Return how far the most recent tick ran behind its due time.
+
+        Ticks dropped by the catch-up cap count towards the lag, so an
+        overloaded server reports more than one tick period.
+        """
+
+        return self.behind
+
+    def until_next(self, dt: float) -> float:
+        """Return seconds from the last :meth:`advance` to the next due tick."""
 
+        return max(0.0, dt - self.accumulator)
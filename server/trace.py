@@ -0,0 +1,203 @@
+"""Event-loop lag watchdog and per-tick span traces.
+
+:class:`LoopMonitor` runs on the event loop and measures how late it wakes
+up from a short sleep. That delay is the time the loop spent stuck in
+something that did not yield (a large ``json.dumps``, a synchronous solver
+step or edit batch, a slow send), so every other connection waited for it
+too. Each measurement goes to the ``pszcz_loop_lag_seconds`` histogram and
+``/health`` reports the latest one; a stall longer than ``stall`` seconds
+is logged.
+
+:class:`SpanRecorder` keeps the most recent ``capacity`` timed spans of the
+tick and broadcast phases in a ring buffer: ``edit_drain``, ``solve`` and
+the enclosing ``tick``; ``broadcast`` with its ``snapshot_build``,
+``fanout`` and ``encode`` parts; and every ``send`` to a client, each
+client on its own track. :meth:`SpanRecorder.trace` returns them in the
+Chrome trace-event format that ``chrome://tracing`` and Perfetto open.
+:func:`server.net.start_server` enables it with ``trace_spans`` and then
+serves the trace as ``GET /debug/trace`` on the health port; with a dump
+directory a trace is also written there whenever a tick takes longer than
+the budget or the event loop stalls.
+
+Recording a span is one :func:`time.perf_counter` pair and an append to a
+bounded :class:`collections.deque`, which is safe from the worker thread
+and the event loop at once. Spans are only turned into trace events when
+a trace is requested.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# A recorded span: name, track, start and end (perf_counter seconds), args.
+_Span = Tuple[str, str, float, float, Optional[Dict[str, Any]]]
+
+
+class SpanRecorder:
+    """Ring buffer of the latest ``capacity`` spans.
+
+    ``budget`` is the longest a tick may take, in seconds. When a tick
+    exceeds it, or :meth:`flag` is called, and ``dump_dir`` is set, the
+    buffer is written there as a trace file, at most once every
+    ``dump_every`` seconds.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 20000,
+        budget: Optional[float] = None,
+        dump_dir: str | Path | None = None,
+        dump_every: float = 10.0,
+    ) -> None:
+        self.budget = budget
+        self.dump_dir = Path(dump_dir) if dump_dir is not None else None
+        self.dump_every = dump_every
+        self.dumps = 0
+        self._spans: Deque[_Span] = collections.deque(maxlen=capacity)
+        self._last_dump = -float("inf")
+        self._dump_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+    def add(
+        self, name: str, start: float, end: float, track: Optional[str] = None, **args: Any
+    ) -> None:
+        """Record a span from ``start`` to ``end`` (:func:`time.perf_counter`).
+
+        ``track`` defaults to the name of the calling thread.
+        """
+
+        if track is None:
+            track = threading.current_thread().name
+        self._spans.append((name, track, start, end, args or None))
+
+    def tick(self, start: float, end: float, tick: int) -> None:
+        """Record tick ``tick`` and dump a trace if it ran over the budget."""
+
+        self.add("tick", start, end, tick=tick)
+        if self.budget is not None and end - start > self.budget:
+            self.flag(f"tick {tick} took {(end - start) * 1000.0:.1f} ms")
+
+    def flag(self, reason: str) -> Optional[Path]:
+        """Write the buffer to ``dump_dir`` in the background because of ``reason``.
+
+        Returns the path being written, or ``None`` if there is no dump
+        directory or the previous dump was less than ``dump_every`` ago.
+        """
+
+        if self.dump_dir is None:
+            return None
+        now = time.monotonic()
+        with self._dump_lock:
+            if now - self._last_dump < self.dump_every:
+                return None
+            self._last_dump = now
+            self.dumps += 1
+        path = self.dump_dir / f"trace-{time.strftime('%Y%m%d-%H%M%S')}-{self.dumps}.json"
+        spans = self._spans.copy()
+        logger.warning("%s; writing trace to %s", reason, path)
+        threading.Thread(target=self._dump, args=(path, spans), daemon=True).start()
+        return path
+
+    def trace(self) -> Dict[str, Any]:
+        """Return the buffered spans as a Chrome trace-event document."""
+
+        return _trace(self._spans.copy())
+
+    def _dump(self, path: Path, spans: Deque[_Span]) -> None:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(_trace(spans)), encoding="utf-8")
+        except OSError:
+            logger.exception("could not write trace %s", path)
+
+
+def _trace(spans: Deque[_Span]) -> Dict[str, Any]:
+    pid = os.getpid()
+    tracks: Dict[str, int] = {}
+    events: List[Dict[str, Any]] = []
+    for name, track, start, end, args in spans:
+        tid = tracks.get(track)
+        if tid is None:
+            tid = tracks[track] = len(tracks) + 1
+        event: Dict[str, Any] = {
+            "name": name,
+            "cat": "pszcz",
+            "ph": "X",
+            "ts": round(start * 1e6, 3),
+            "dur": round((end - start) * 1e6, 3),
+            "pid": pid,
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        events.append(event)
+    metadata: List[Dict[str, Any]] = [
+        {"name": "process_name", "ph": "M", "pid": pid, "args": {"name": "pszcz-server"}}
+    ]
+    for track, tid in tracks.items():
+        metadata.append(
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": track}}
+        )
+    return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+
+class LoopMonitor:
+    """Measure event-loop lag by sleeping ``interval`` seconds at a time.
+
+    ``lag`` and ``max_lag`` hold the latest and largest lag in seconds.
+    Every measurement is observed by ``histogram``, if given; lags of at
+    least ``stall`` seconds are logged and, with ``spans``, recorded as a
+    ``loop_stall`` span and flagged for a trace dump.
+    """
+
+    def __init__(
+        self,
+        histogram: Optional[Histogram] = None,
+        spans: Optional[SpanRecorder] = None,
+        interval: float = 0.05,
+        stall: float = 0.1,
+    ) -> None:
+        self.histogram = histogram
+        self.spans = spans
+        self.interval = interval
+        self.stall = stall
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    async def run(self) -> None:
+        """Measure until cancelled."""
+
+        while True:
+            due = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            woke = time.perf_counter()
+            self.observe(due, woke)
+
+    def observe(self, due: float, woke: float) -> None:
+        """Record a wake-up at ``woke`` that was due at ``due``."""
+
+        lag = max(woke - due, 0.0)
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        if self.histogram is not None:
+            self.histogram.observe(lag)
+        if lag < self.stall:
+            return
+        logger.warning("event loop stalled for %.1f ms", lag * 1000.0)
+        if self.spans is not None:
+            self.spans.add("loop_stall", due, woke, track="event loop lag")
+            self.spans.flag(f"event loop stalled for {lag * 1000.0:.1f} ms")
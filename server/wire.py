@@ -0,0 +1,207 @@
+"""Wire encodings for the ``binary-1`` and ``zstd-1`` feature flags.
+
+A binary frame is sent as a binary WebSocket message: a fixed little-endian
+header followed by packed planes.
+
+Header (``HEADER``, 72 bytes)::
+
+    magic        4s   b"PSZB"
+    version      u8   1
+    kind         u8   KIND_FULL or KIND_DELTA
+    flags        u16  FLAG_WINDOW or 0
+    seq          u64
+    ts           u64  ms since Unix epoch
+    frame        u64
+    base         u64  frame a delta applies to (0 for full frames)
+    tick         u64
+    rows         u32
+    cols         u32
+    cm_per_pixel f32
+    solve_ms     f32
+    tick_lag_ms  f32
+    count        u32  number of cells in a delta (0 for full frames)
+
+Full frames continue with ``rows * cols`` material codes (``u8``) and then
+``rows * cols`` depths (``f32``), both row-major. Delta frames continue with
+``count`` flat cell indices ``r * cols + c`` (``u32``), ``count`` material
+codes (``u8``) and ``count`` depths (``f32``). Material codes are the indices
+of :data:`~server.state.CODE_MATERIALS`.
+
+Frames for a viewport subscription set ``FLAG_WINDOW`` and insert
+``WINDOW`` (``r0`` and ``c0`` as ``u32``) right after the header. ``rows`` and
+``cols`` are then the window size and delta indices are relative to the
+window origin.
+
+With ``zstd-1`` every server message after ``welcome`` is sent as a binary
+WebSocket message holding one zstd frame; decompressing it yields either
+UTF-8 JSON text or a binary frame as above. Compression needs the optional
+``zstandard`` package; without it the feature is simply not offered.
+"""
+
+from __future__ import annotations
+
+import base64
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+try:  # optional dependency
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None  # type: ignore[assignment]
+
+from .delta import CellChanges
+from .state import SimState
+
+MAGIC = b"PSZB"
+VERSION = 1
+KIND_FULL = 0
+KIND_DELTA = 1
+FLAG_WINDOW = 1
+
+HEADER = struct.Struct("<4sBBHQQQQQIIfffI")
+WINDOW = struct.Struct("<II")
+
+# ``(r0, c0, r1, c1)`` with exclusive ends.
+Window = Tuple[int, int, int, int]
+
+
+@dataclass
+class FrameHeader:
+    """Fields shared by every binary frame."""
+
+    seq: int
+    ts: int
+    frame: int
+    tick: int
+    cm_per_pixel: float = 1.0
+    solve_ms: float = 0.0
+    tick_lag_ms: float = 0.0
+
+
+def _pack_header(
+    kind: int,
+    header: FrameHeader,
+    base: int,
+    rows: int,
+    cols: int,
+    count: int,
+    window: Optional[Window],
+) -> bytes:
+    packed = HEADER.pack(
+        MAGIC,
+        VERSION,
+        kind,
+        FLAG_WINDOW if window is not None else 0,
+        header.seq,
+        header.ts,
+        header.frame,
+        base,
+        header.tick,
+        rows,
+        cols,
+        header.cm_per_pixel,
+        header.solve_ms,
+        header.tick_lag_ms,
+        count,
+    )
+    if window is not None:
+        packed += WINDOW.pack(window[0], window[1])
+    return packed
+
+
+def encode_full(
+    sim: SimState, header: FrameHeader, window: Optional[Window] = None
+) -> bytes:
+    """Return a full binary snapshot of ``sim`` or of its ``window``."""
+
+    materials, depths = sim.materials, sim.depths
+    if window is not None:
+        r0, c0, r1, c1 = window
+        materials = materials[r0:r1, c0:c1]
+        depths = depths[r0:r1, c0:c1]
+    rows, cols = materials.shape
+    return b"".join(
+        (
+            _pack_header(KIND_FULL, header, 0, rows, cols, 0, window),
+            np.ascontiguousarray(materials).tobytes(),
+            depths.astype("<f4", copy=False).tobytes(),
+        )
+    )
+
+
+def encode_delta(
+    sim: SimState,
+    changes: CellChanges,
+    header: FrameHeader,
+    window: Optional[Window] = None,
+) -> bytes:
+    """Return a binary delta holding ``changes`` relative to frame ``frame - 1``.
+
+    With a ``window`` the caller must already have dropped changes outside it.
+    """
+
+    rows, cols = sim.shape
+    r_idx = changes.rows.astype("<u4")
+    c_idx = changes.cols.astype("<u4")
+    if window is not None:
+        r0, c0, r1, c1 = window
+        rows, cols = r1 - r0, c1 - c0
+        r_idx -= np.uint32(r0)
+        c_idx -= np.uint32(c0)
+    index = r_idx * np.uint32(cols) + c_idx
+    return b"".join(
+        (
+            _pack_header(
+                KIND_DELTA, header, header.frame - 1, rows, cols, len(changes), window
+            ),
+            index.tobytes(),
+            changes.materials.astype(np.uint8, copy=False).tobytes(),
+            changes.depths.astype("<f4", copy=False).tobytes(),
+        )
+    )
+
+
+ZSTD_AVAILABLE = zstandard is not None
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class Compressor:
+    """Shared zstd compressor for ``zstd-1`` sessions.
+
+    ``level`` is the zstd compression level; ``dictionary`` optionally names
+    a trained zstd dictionary file. Clients need the same dictionary to
+    decompress, so it is offered to them in ``welcome`` (see
+    :meth:`welcome_fields`).
+    """
+
+    def __init__(self, level: int = 3, dictionary: str | Path | None = None) -> None:
+        if zstandard is None:
+            raise RuntimeError("zstd-1 requires the 'zstandard' package")
+        self.level = level
+        self.dictionary: Optional[bytes] = (
+            Path(dictionary).read_bytes() if dictionary is not None else None
+        )
+        dict_data = (
+            zstandard.ZstdCompressionDict(self.dictionary)
+            if self.dictionary is not None
+            else None
+        )
+        self._cctx = zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+
+    def compress(self, message: str | bytes) -> bytes:
+        """Return ``message`` (text is UTF-8 encoded) as one zstd frame."""
+
+        data = message.encode("utf-8") if isinstance(message, str) else message
+        return self._cctx.compress(data)
+
+    def welcome_fields(self) -> dict[str, Any]:
+        """Return extra ``welcome`` fields describing the compression setup."""
+
+        fields: dict[str, Any] = {"level": self.level}
+        if self.dictionary is not None:
+            fields["dict"] = base64.b64encode(self.dictionary).decode("ascii")
+        return {"zstd": fields}
@@ -0,0 +1,249 @@
+"""Simulation worker running the physics off the event loop.
+
+:class:`SimulationWorker` owns the authoritative :class:`~server.state.SimState`
+and steps it on its own thread with the same fixed-timestep schedule as the
+in-loop tick task. The network side never touches that grid: edits travel
+over a command queue and are applied between ticks, and every completed
+tick is copied into one of two :class:`Frame` buffers. Readers lease the
+most recently completed buffer (:meth:`SimulationWorker.frame`) while the
+worker fills the other one, so they always see a whole tick and never a
+grid that is half-way through a step. A tick that completes while the
+previous frame is still leased is simply not published; the next one is.
+Edits wait in an :class:`~server.editqueue.EditQueue` that the worker
+drains at the start of each tick.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import cProfile
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .editqueue import EditQueue, EditResult
+from .metrics import Histogram
+from .replay import Recorder
+from .state import SimState
+from .tick import FixedTimestep, Solver
+from .trace import SpanRecorder
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Frame:
+    """A completed tick published by the worker."""
+
+    sim: SimState = field(default_factory=SimState)
+    tick: int = 0
+    solve_ms: float = 0.0
+    tick_lag_ms: float = 0.0
+
+
+def _copy_into(frame: Frame, sim: SimState) -> None:
+    """Copy ``sim``'s planes and change-tracking counters into ``frame``."""
+
+    dst = frame.sim
+    if dst.shape != sim.shape or dst.shared(dst.materials) or dst.shared(dst.depths):
+        # Frozen copies of the frame (see SimState.freeze) keep the old planes.
+        dst = frame.sim = SimState(sim.materials.copy(), sim.depths.copy())
+    else:
+        dst.materials[...] = sim.materials
+        dst.depths[...] = sim.depths
+    dst.row_version[...] = sim.row_version
+    dst.version = sim.version
+    dst.terrain_version = sim.terrain_version
+    dst.stats = dict(sim.stats)
+
+
+class SimulationWorker:
+    """Step ``sim`` with ``solver`` on a background thread.
+
+    ``control`` is the server's :class:`~server.net.ControlParams`; its
+    ``pause`` and ``tick_hz`` are read before every tick. ``clock`` is the
+    fixed-timestep accumulator to schedule ticks with and ``edits`` the
+    queue of pending edits (a private one if not given). ``recorder``, if
+    given, is told about every edit batch and tick on the worker thread,
+    ``solve_times``, if given, records every solver call in seconds and
+    ``spans``, if given, records the phases of every tick.
+    """
+
+    def __init__(
+        self,
+        sim: SimState,
+        solver: Solver,
+        control: Any,
+        clock: Optional[FixedTimestep] = None,
+        recorder: Optional[Recorder] = None,
+        edits: Optional[EditQueue] = None,
+        solve_times: Optional[Histogram] = None,
+        spans: Optional[SpanRecorder] = None,
+    ) -> None:
+        self.sim = sim
+        self.solver = solver
+        self.control = control
+        self.clock = clock if clock is not None else FixedTimestep()
+        self.recorder = recorder
+        self.solve_times = solve_times
+        self.spans = spans
+        self.tick = 0
+        self.edits = edits if edits is not None else EditQueue()
+        self._buffers = [Frame(), Frame()]
+        for buffer in self._buffers:
+            _copy_into(buffer, sim)
+        self._front = 0
+        self._leased: Optional[Frame] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._profiler: Optional[cProfile.Profile] = None
+        self._profile_request: Optional[Tuple[Optional[cProfile.Profile], threading.Event]] = None
+
+    def start(self) -> None:
+        """Start the worker thread."""
+
+        self._thread = threading.Thread(target=self._run, name="simulation", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the worker thread and wait for it to finish."""
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    async def apply_edits(self, edits: List[Dict[str, Any]]) -> EditResult:
+        """Queue ``edits`` for the next tick boundary and return the result.
+
+        The result is that of :meth:`SimState.apply_edits`.
+        """
+
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[EditResult] = loop.create_future()
+
+        def done(result: EditResult) -> None:
+            loop.call_soon_threadsafe(_resolve, future, result)
+
+        self.edits.put(None, edits, done)
+        return await future
+
+    def profile(self, profiler: Optional[cProfile.Profile]) -> threading.Event:
+        """Run the worker thread under ``profiler`` from now on (``None`` stops).
+
+        The worker switches at the top of its next loop iteration and sets
+        the returned event once it has.
+        """
+
+        switched = threading.Event()
+        self._profile_request = (profiler, switched)
+        return switched
+
+    def _switch_profiler(self) -> None:
+        request, self._profile_request = self._profile_request, None
+        if request is None:
+            return
+        profiler, switched = request
+        if self._profiler is not None:
+            self._profiler.disable()
+        if profiler is not None:
+            profiler.enable()
+        self._profiler = profiler
+        switched.set()
+
+    @contextlib.contextmanager
+    def frame(self) -> Iterator[Frame]:
+        """Lease the latest completed frame for reading.
+
+        The worker does not write to the leased buffer until the ``with``
+        block ends. Only one lease may be held at a time.
+        """
+
+        with self._lock:
+            frame = self._buffers[self._front]
+            self._leased = frame
+        try:
+            yield frame
+        finally:
+            with self._lock:
+                self._leased = None
+
+    def _publish(self, solve_ms: float) -> None:
+        with self._lock:
+            back = self._buffers[1 - self._front]
+            if back is self._leased:
+                return
+        # Readers only lease the front buffer, so ``back`` stays ours.
+        _copy_into(back, self.sim)
+        back.tick = self.tick
+        back.solve_ms = solve_ms
+        back.tick_lag_ms = self.clock.lag() * 1000.0
+        with self._lock:
+            self._front = 1 - self._front
+
+    def _drain(self, timeout: float) -> bool:
+        """Apply queued edits, waiting up to ``timeout`` for the first one.
+
+        Returns whether any edits were applied.
+        """
+
+        if not self.edits.wait(timeout):
+            return False
+        return self.edits.drain(self.sim, self.recorder, self.tick) > 0
+
+    def _run(self) -> None:
+        clock = self.clock
+        solve_ms = 0.0
+        while not self._stop.is_set():
+            if self._profile_request is not None:
+                self._switch_profiler()
+            hz = self.control.tick_hz
+            now = time.monotonic()
+            if self.control.pause or hz <= 0:
+                clock.reset(now)
+                if self._drain(timeout=1.0 / hz if hz > 0 else 0.1):
+                    self._publish(solve_ms)
+                continue
+            dt = 1.0 / hz
+            steps = clock.advance(now, dt)
+            for _ in range(steps):
+                drain = time.perf_counter()
+                self.edits.drain(self.sim, self.recorder, self.tick)
+                start = time.perf_counter()
+                try:
+                    self.solver(self.sim)
+                except Exception:
+                    logger.exception("solver failed at tick %d; pausing", self.tick)
+                    self.control.pause = True
+                    break
+                end = time.perf_counter()
+                solve = end - start
+                if self.solve_times is not None:
+                    self.solve_times.observe(solve)
+                solve_ms = solve * 1000.0
+                self.tick += 1
+                if self.spans is not None:
+                    self.spans.add("edit_drain", drain, start)
+                    self.spans.add("solve", start, end)
+                    self.spans.tick(drain, end, self.tick)
+                if self.recorder is not None:
+                    self.recorder.ticked(self.sim, self.tick)
+            if steps:
+                start = time.perf_counter()
+                self._publish(solve_ms)
+                if self.spans is not None:
+                    self.spans.add("publish", start, time.perf_counter())
+            wait = max(0.0, clock.until_next(dt) - (time.monotonic() - now))
+            # Edits wait for the next tick; sleep on the stop event so stop()
+            # is not held up by a long tick period.
+            self._stop.wait(wait)
+        if self._profiler is not None:
+            self._profiler.disable()
+
+
+def _resolve(future: "asyncio.Future[EditResult]", result: EditResult) -> None:
+    if not future.done():
+        future.set_result(result)
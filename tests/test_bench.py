@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from server.bench import compare, run_benchmarks, synthetic_level
+from server.state import MATERIAL_CODES
+
+BASELINE = Path(__file__).with_name("bench_baseline.json")
+
+
+def test_synthetic_level_is_reproducible() -> None:
+    level = synthetic_level(96, 128, seed=3)
+    assert level == synthetic_level(96, 128, seed=3)
+    assert level != synthetic_level(96, 128, seed=4)
+    counts = np.bincount(level.materials.ravel(), minlength=len(MATERIAL_CODES))
+    assert all(counts[MATERIAL_CODES[name]] for name in ("stone", "spring", "sink", "space"))
+    assert level.depths.sum() > 0
+    assert not level.depths[level.materials == MATERIAL_CODES["stone"]].any()
+
+
+def test_run_benchmarks_reports_every_hot_path() -> None:
+    report = run_benchmarks(rows=48, cols=64, repeats=1, clients=4, edit_ops=100)
+    assert set(report["results"]) == set(json.loads(BASELINE.read_text())["results"])
+    assert all(result["ms"] >= 0 for result in report["results"].values())
+    json.dumps(report)
+
+    only = run_benchmarks(rows=8, cols=8, repeats=1, only=["flow", "load_level"])
+    assert list(only["results"]) == ["flow_step", "load_level_json", "load_level_binary"]
+
+
+def test_compare_flags_regressions_only() -> None:
+    baseline = json.loads(BASELINE.read_text())
+    current = json.loads(BASELINE.read_text())
+    assert compare(current, baseline, 0.25) == []
+    current["results"]["flow_step"]["ms"] *= 1.5
+    current["results"]["apply_edits"]["ms"] *= 0.5
+    [line] = compare(current, baseline, 0.25)
+    assert line.startswith("flow_step:")
+    current["params"]["rows"] += 1
+    with pytest.raises(ValueError):
+        compare(current, baseline, 0.25)
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import shutil
+import sys
+from pathlib import Path
+
+import websockets
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from client.net import build_hello
+from server import net as server_net
+from server.checkpoint import JOURNAL_HEADER, JOURNAL_NAME, Checkpointer, resume
+from server.state import SimState
+from server.tick import flow_step
+
+
+def _checkpoint(checkpoints: Checkpointer, sim: SimState, tick: int) -> None:
+    checkpoints.write(checkpoints.capture(sim, tick))
+
+
+def test_checkpoints_journal_only_changed_rows(tmp_path: Path) -> None:
+    sim = SimState.empty(64, 16)
+    checkpoints = Checkpointer(tmp_path, cm_per_pixel=2.0)
+    _checkpoint(checkpoints, sim, 0)
+    journal = tmp_path / JOURNAL_NAME
+    assert journal.stat().st_size == JOURNAL_HEADER.size
+
+    sim.apply_edits([{"op": "set_pixel", "r": 40, "c": 3, "material": "spring"}])
+    flow_step(sim)
+    pending = checkpoints.capture(sim, 1)
+    assert pending.rows is not None and pending.rows.tolist() == [40, 41]
+    checkpoints.write(pending)
+    _checkpoint(checkpoints, sim, 2)  # nothing changed: nothing written
+
+    restored = SimState()
+    assert resume(tmp_path, restored) == (2.0, 1)
+    assert restored == sim
+
+
+def test_resume_stops_at_torn_record(tmp_path: Path) -> None:
+    sim = SimState.empty(4, 4)
+    checkpoints = Checkpointer(tmp_path)
+    _checkpoint(checkpoints, sim, 0)
+    sim.apply_edits([{"op": "set_pixel", "r": 1, "c": 1, "material": "stone"}])
+    _checkpoint(checkpoints, sim, 5)
+    expected = SimState(sim.materials.copy(), sim.depths.copy())
+    sim.apply_edits([{"op": "set_pixel", "r": 2, "c": 2, "material": "stone"}])
+    _checkpoint(checkpoints, sim, 9)
+    journal = tmp_path / JOURNAL_NAME
+    journal.write_bytes(journal.read_bytes()[:-3])
+
+    restored = SimState()
+    assert resume(tmp_path, restored) == (1.0, 5)
+    assert restored == expected
+
+
+def test_compaction_replaces_base_and_ignores_stale_journal(tmp_path: Path) -> None:
+    sim = SimState.empty(2, 2)
+    checkpoints = Checkpointer(tmp_path, compact_ratio=0.0)
+    _checkpoint(checkpoints, sim, 0)
+    sim.apply_edits([{"op": "set_pixel", "r": 0, "c": 0, "material": "stone"}])
+    _checkpoint(checkpoints, sim, 1)
+    stale = tmp_path / "stale.bin"
+    shutil.copy(tmp_path / JOURNAL_NAME, stale)
+    # The journal now outgrows the (tiny) base, so this checkpoint compacts.
+    sim.apply_edits([{"op": "set_pixel", "r": 1, "c": 1, "material": "sink"}])
+    _checkpoint(checkpoints, sim, 2)
+    assert (tmp_path / JOURNAL_NAME).stat().st_size == JOURNAL_HEADER.size
+    assert checkpoints.generation == 2
+
+    # A crash between writing the base and the new journal leaves the old
+    # journal, which must not be replayed over the newer base.
+    shutil.copy(stale, tmp_path / JOURNAL_NAME)
+    restored = SimState()
+    assert resume(tmp_path, restored) == (1.0, 2)
+    assert restored == sim
+    # A new checkpointer continues the generation count.
+    assert Checkpointer(tmp_path).generation == 2
+
+
+async def test_server_resumes_from_checkpoint(tmp_path: Path) -> None:
+    state = server_net.ServerState(checkpoints=Checkpointer(tmp_path), tick=7)
+    state.sim.clear(3, 3)
+    await server_net._write_checkpoint(state)
+    state.sim.apply_edits([{"op": "set_pixel", "r": 2, "c": 0, "material": "stone"}])
+    state.tick = 8
+    await server_net._write_checkpoint(state)
+
+    server, simulation, health = await server_net.start_server(
+        tick_hz=0, checkpoint_dir=tmp_path, resume=True
+    )
+    try:
+        async with websockets.connect("ws://127.0.0.1:7777/ws") as ws:
+            await ws.send(json.dumps(build_hello()))
+            await asyncio.wait_for(ws.recv(), timeout=1)
+            snapshot = json.loads(await asyncio.wait_for(ws.recv(), timeout=2))
+            assert snapshot["meta"]["tick"] == 8
+            assert snapshot["grid"]["cells"][2][0]["material"] == "stone"
+    finally:
+        server.close()
+        await server.wait_closed()
+        simulation.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await simulation
+        await health.cleanup()
@@ -1,9 +1,11 @@
+import asyncio
+import json
 import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from client.t0.net import Seq, parse_command
+from client.t0.net import Seq, _recv_loop, parse_command
 from client.t0.state import ClientState
 
 
@@ -28,3 +30,50 @@ def test_parse_set_depth_uses_state() -> None:
         {"op": "set_pixel", "r": 0, "c": 0, "material": "spring", "depth": 0.3}
     ]
 
+
+def test_client_state_applies_deltas_in_order() -> None:
+    state = ClientState()
+    cells = [[{"material": "space", "depth": 0.0}, {"material": "space", "depth": 0.0}]]
+    state.update({"frame": 4, "grid": {"cells": cells}})
+    delta = {"t": "delta", "frame": 5, "base": 4, "cells": [
+        {"r": 0, "c": 1, "material": "stone", "depth": 0.0}
+    ]}
+    assert state.apply_delta(delta)
+    assert state.material_at(0, 1) == "stone"
+    assert state.frame == 5
+    # A gap means the client fell behind and has to resync.
+    assert not state.apply_delta({"t": "delta", "frame": 7, "base": 6, "cells": []})
+    assert state.frame is None
+
+
+class _ScriptedWS:
+    def __init__(self, messages: list) -> None:
+        self.messages = [json.dumps(m) for m in messages]
+        self.sent: list = []
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        if not self.messages:
+            raise StopAsyncIteration
+        return self.messages.pop(0)
+
+    async def send(self, message: str) -> None:
+        self.sent.append(json.loads(message))
+
+
+def test_recv_loop_sends_one_resync_per_gap(capsys) -> None:
+    cells = [[{"material": "space", "depth": 0.0}]]
+    ws = _ScriptedWS(
+        [
+            {"t": "snapshot", "frame": 1, "grid": {"cells": cells}},
+            {"t": "delta", "frame": 3, "base": 2, "cells": []},
+            {"t": "delta", "frame": 4, "base": 3, "cells": []},
+            {"t": "delta", "frame": 5, "base": 4, "cells": []},
+            {"t": "snapshot", "frame": 6, "grid": {"cells": cells}},
+            {"t": "delta", "frame": 8, "base": 7, "cells": []},
+        ]
+    )
+    asyncio.run(_recv_loop(ws, ClientState(), Seq()))
+    assert [m["t"] for m in ws.sent] == ["resync", "resync"]
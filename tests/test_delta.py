@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from server.delta import DeltaTracker
+from server.state import MATERIAL_CODES, SimState
+from server.tick import flow_step
+
+
+def test_delta_tracker_reports_only_changed_cells() -> None:
+    sim = SimState.empty(4, 3)
+    tracker = DeltaTracker()
+    assert tracker.diff(sim) is None  # first frame needs a keyframe
+    assert len(tracker.diff(sim)) == 0
+
+    sim.apply_edits([{"op": "set_pixel", "r": 2, "c": 1, "material": "stone"}])
+    changes = tracker.diff(sim)
+    assert changes is not None
+    assert changes.rows.tolist() == [2]
+    assert changes.cols.tolist() == [1]
+    assert changes.materials.tolist() == [MATERIAL_CODES["stone"]]
+    assert len(tracker.diff(sim)) == 0
+
+
+def test_delta_tracker_follows_solver() -> None:
+    sim = SimState.empty(3, 1)
+    sim.apply_edits([{"op": "set_pixel", "r": 0, "c": 0, "material": "space", "depth": 1.0}])
+    tracker = DeltaTracker()
+    tracker.diff(sim)
+    flow_step(sim)
+    changes = tracker.diff(sim)
+    assert changes is not None
+    assert sorted(zip(changes.rows.tolist(), changes.depths.tolist())) == [(0, 0.0), (1, 1.0)]
+    flow_step(sim)
+    flow_step(sim)
+    assert len(tracker.diff(sim)) == 2
+    flow_step(sim)  # water rests on the bottom row
+    assert len(tracker.diff(sim)) == 0
+
+
+def test_delta_tracker_resets_on_resize() -> None:
+    sim = SimState.empty(2, 2)
+    tracker = DeltaTracker()
+    tracker.diff(sim)
+    sim.clear(3, 3)
+    assert tracker.diff(sim) is None
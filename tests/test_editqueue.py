@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from server.editqueue import EditQueue
+from server.state import MATERIAL_CODES, SimState
+
+
+def _pixel(c: int, material: str = "stone") -> dict:
+    return {"op": "set_pixel", "r": 0, "c": c, "material": material}
+
+
+def test_drain_applies_batches_up_to_the_tick_budget() -> None:
+    sim = SimState.empty(1, 8)
+    edits = EditQueue(tick_budget=4)
+    results: list = []
+    assert edits.put("a", [_pixel(0), _pixel(1), _pixel(2)], results.append)
+    assert edits.put("b", [_pixel(3), _pixel(4)], results.append)
+    assert edits.put("a", [_pixel(9)], results.append)
+    assert edits.pending("a") == 4
+
+    assert edits.drain(sim) == 1  # the second batch would exceed the budget
+    assert results == [None]
+    assert sim.materials[0].tolist() == [1, 1, 1, 0, 0, 0, 0, 0]
+    assert edits.drain(sim) == 2
+    assert results == [None, None, {"code": "index_out_of_bounds"}]
+    assert sim.materials[0, 3:5].tolist() == [1, 1]
+    assert edits.drain(sim) == 0
+    assert len(edits) == 0 and edits.pending("a") == 0
+
+
+def test_oversized_batch_is_applied_alone() -> None:
+    sim = SimState.empty(1, 8)
+    edits = EditQueue(tick_budget=2)
+    edits.put("a", [_pixel(c) for c in range(5)], lambda result: None)
+    edits.put("a", [_pixel(7)], lambda result: None)
+    assert edits.drain(sim) == 1
+    assert sim.materials[0].tolist() == [1] * 5 + [0] * 3
+
+
+def test_last_write_to_a_cell_wins() -> None:
+    sim = SimState.empty(1, 2)
+    edits = EditQueue()
+    edits.put("a", [_pixel(0, "spring"), _pixel(1, "sink")], lambda result: None)
+    edits.put("b", [_pixel(0, "stone")], lambda result: None)
+    edits.put("a", [_pixel(1, "space")], lambda result: None)
+    edits.drain(sim)
+    assert sim.materials[0].tolist() == [MATERIAL_CODES["stone"], MATERIAL_CODES["space"]]
+
+
+def test_flood_limit_refuses_batches_per_client() -> None:
+    sim = SimState.empty(1, 8)
+    edits = EditQueue(client_limit=3)
+    assert edits.put("a", [_pixel(0), _pixel(1)], lambda result: None)
+    assert not edits.put("a", [_pixel(2), _pixel(3)], lambda result: None)
+    assert edits.put("b", [_pixel(4), _pixel(5), _pixel(6)], lambda result: None)
+    assert edits.put("a", [_pixel(2)], lambda result: None)
+    edits.drain(sim)
+    # Once drained the client may queue again.
+    assert edits.put("a", [_pixel(3), _pixel(7)], lambda result: None)
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import itertools
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from client.t0.state import ClientState
+from server.delta import DeltaTracker
+from server.frames import TILE, FrameCache, tile_region
+from server.state import SimState
+
+
+def _sim(rows: int, cols: int) -> SimState:
+    rng = np.random.default_rng(3)
+    sim = SimState.empty(rows, cols)
+    sim.set_planes(
+        rng.integers(0, 4, (rows, cols), dtype=np.uint8),
+        rng.random((rows, cols), dtype=np.float32),
+    )
+    return sim
+
+
+def _cache(sim: SimState, frame: int = 1, changes=None) -> FrameCache:
+    return FrameCache(
+        sim=sim,
+        frame=frame,
+        tick=frame,
+        seq=itertools.count(1),
+        cm_per_pixel=1.0,
+        meta={"solve_ms": 0.0},
+        changes=changes,
+    )
+
+
+def test_tile_region_rounds_out_and_clips() -> None:
+    assert tile_region(5, 40, 10, 10, (100, 100)) == (0, 32, 32, 64)
+    assert tile_region(90, 90, 50, 50, (100, 100)) == (64, 64, 100, 100)
+    assert tile_region(200, 0, 10, 10, (100, 100)) is None
+
+
+def test_window_snapshot_matches_full_grid() -> None:
+    sim = _sim(80, 70)
+    cache = _cache(sim)
+    full = json.loads(cache.message(None, False, False, False))["grid"]["cells"]
+    region = tile_region(40, 10, 30, 30, sim.shape)
+    assert region == (32, 0, 80, 64)
+    window = json.loads(cache.message(region, False, False, False))
+    assert window["grid"]["origin"] == [32, 0]
+    assert window["grid"]["cells"] == [row[0:64] for row in full[32:80]]
+
+    state = ClientState()
+    assert state.apply_binary(cache.message(region, False, True, False))
+    assert state.origin == (32, 0)
+    # Binary frames carry raw float32 depths, JSON their shortest form.
+    assert [
+        [(cell["material"], np.float32(cell["depth"])) for cell in row] for row in state.grid
+    ] == [
+        [(cell["material"], np.float32(cell["depth"])) for cell in row]
+        for row in window["grid"]["cells"]
+    ]
+
+
+def test_overlapping_viewports_share_tiles() -> None:
+    sim = _sim(4 * TILE, 4 * TILE)
+    cache = _cache(sim)
+    cache.message((0, 0, 2 * TILE, 2 * TILE), False, False, False)
+    assert cache.encoded_tiles == 4
+    cache.message((TILE, TILE, 3 * TILE, 3 * TILE), False, False, False)
+    assert cache.encoded_tiles == 7
+    # The same window is encoded once and handed out again.
+    first = cache.message((0, 0, TILE, TILE), False, True, False)
+    assert cache.message((0, 0, TILE, TILE), False, True, False) is first
+
+
+def test_window_delta_keeps_only_cells_inside() -> None:
+    sim = SimState.empty(64, 64)
+    tracker = DeltaTracker()
+    tracker.diff(sim)
+    region = (32, 32, 64, 64)
+    state = ClientState()
+    assert state.apply_binary(_cache(sim).message(region, False, True, False))
+
+    sim.apply_edits(
+        [
+            {"op": "set_pixel", "r": 1, "c": 1, "material": "stone"},
+            {"op": "set_pixel", "r": 40, "c": 50, "material": "sink", "depth": 0.5},
+        ]
+    )
+    cache = _cache(sim, frame=2, changes=tracker.diff(sim))
+    delta = json.loads(cache.message(region, True, False, False))
+    assert [(c["r"], c["c"]) for c in delta["cells"]] == [(40, 50)]
+    assert state.apply_binary(cache.message(region, True, True, False))
+    assert state.material_at(40, 50) == "sink"
+    assert state.grid[8][18] == {"material": "sink", "depth": 0.5}
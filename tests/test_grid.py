@@ -1,14 +1,29 @@
 from __future__ import annotations
 
+import base64
+import dataclasses
+import json
 import sys
 from pathlib import Path
 
+import numpy as np
+import pytest
+
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 from client.t1.model import default_map
-from client.t1.serialize import export_map, import_map
-from server.state import Pixel as SPixel, SimState
-from server.tick import flow_step
+from client.t1.serialize import export_map, import_map, load_map, save_map
+from server.state import MATERIAL_CODES, Pixel as SPixel, SimState
+from server.state import CHUNK
+from server.tick import (
+    flow_step,
+    SOLVERS,
+    flow_step_chunked,
+    flow_step_pressure,
+    flow_step_reference,
+    flow_step_spread,
+    flow_step_vectorized,
+)
 
 
 def test_map_serialization_roundtrip() -> None:
@@ -23,26 +38,357 @@ def test_map_serialization_roundtrip() -> None:
     assert loaded.cm_per_pixel == 1.0
 
 
+def test_map_file_roundtrip(tmp_path: Path) -> None:
+    state = default_map(3, 2, cm_per_pixel=0.5)
+    state.grid[1][1].material = "spring"
+    state.grid[2][0].depth = 0.25
+    path = tmp_path / "map.json"
+    save_map(state, path)
+    assert json.loads(path.read_text()) == export_map(state)
+    loaded = load_map(path)
+    assert loaded == state
+
+
 def test_water_flows_down() -> None:
     sim = SimState()
     sim.grid = [[SPixel("space", 1.0)], [SPixel("space", 0.0)]]
     flow_step(sim)
-    assert sim.grid[0][0].depth == 0.0
-    assert sim.grid[1][0].depth == 1.0
+    assert sim.depths[0, 0] == 0.0
+    assert sim.depths[1, 0] == 1.0
 
 
 def test_spring_and_sink_behaviour() -> None:
     sim = SimState()
     sim.grid = [[SPixel("spring", 0.0)], [SPixel("sink", 0.5)]]
     flow_step(sim)
-    assert sim.grid[0][0].depth == 0.0  # spring empties after emission
-    assert sim.grid[1][0].depth == 0.0  # sink removes incoming water
+    assert sim.depths[0, 0] == 0.0  # spring empties after emission
+    assert sim.depths[1, 0] == 0.0  # sink removes incoming water
 
 
 def test_spring_emits_water() -> None:
     sim = SimState()
     sim.grid = [[SPixel("spring", 0.0)], [SPixel("space", 0.0)]]
     flow_step(sim)
-    assert sim.grid[0][0].depth == 0.0
-    assert sim.grid[1][0].depth == 1.0
+    assert sim.depths[0, 0] == 0.0
+    assert sim.depths[1, 0] == 1.0
+
+
+def test_grid_is_backed_by_planes() -> None:
+    sim = SimState()
+    sim.grid = [[SPixel("stone", 0.0), SPixel("space", 0.25)]]
+    assert sim.materials.dtype == np.uint8
+    assert sim.depths.dtype == np.float32
+    assert sim.shape == (1, 2)
+    assert sim.materials.tolist() == [[MATERIAL_CODES["stone"], MATERIAL_CODES["space"]]]
+    assert sim.grid[0][1] == SPixel("space", 0.25)
+
+
+def test_grid_pixels_are_read_only() -> None:
+    sim = SimState.empty(1, 1)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        sim.grid[0][0].depth = 1.0  # type: ignore[misc]
+
+
+def test_states_compare_by_value() -> None:
+    assert SimState.empty(2, 2) == SimState.empty(2, 2)
+    other = SimState.empty(2, 2)
+    other.apply_edits([{"op": "set_pixel", "r": 0, "c": 0, "material": "stone"}])
+    assert SimState.empty(2, 2) != other
+
+
+@pytest.mark.parametrize(
+    "solver",
+    [
+        flow_step_reference,
+        flow_step_vectorized,
+        flow_step_chunked,
+        flow_step_pressure,
+        flow_step_spread,
+    ],
+)
+def test_frozen_copy_is_not_changed(solver) -> None:
+    sim = SimState.empty(3, 2)
+    sim.apply_edits([{"op": "set_pixel", "r": 0, "c": 0, "material": "spring"}])
+    frozen = sim.freeze()
+    before = SimState(frozen.materials.copy(), frozen.depths.copy())
+    assert sim.shared(sim.depths)
+    solver(sim)
+    sim.apply_edits([{"op": "set_pixel", "r": 2, "c": 1, "material": "stone", "depth": 0.5}])
+    assert frozen == before
+    assert sim != before
+    with pytest.raises(ValueError):
+        frozen.depths[0, 0] = 1.0
+    del frozen, before
+    assert not sim.shared(sim.depths) and not sim.shared(sim.materials)
+
+
+def test_apply_edits_writes_planes() -> None:
+    sim = SimState.empty(2, 2)
+    ops = [{"op": "set_pixel", "r": 1, "c": 0, "material": "sink", "depth": 0.5}]
+    assert sim.apply_edits(ops) is None
+    assert sim.materials[1, 0] == MATERIAL_CODES["sink"]
+    assert sim.depths[1, 0] == 0.5
+    assert sim.snapshot()["grid"][1][0] == {"material": "sink", "depth": 0.5}
+    sim.apply_edits([{"op": "set_pixel", "r": 0, "c": 1, "material": "space", "depth": 0.3}])
+    assert sim.snapshot()["grid"][0][1]["depth"] == 0.3
+    bad = [{"op": "set_pixel", "r": 2, "c": 0, "material": "sink"}]
+    assert sim.apply_edits(bad) == {"code": "index_out_of_bounds"}
+
+
+def test_failed_batch_changes_nothing() -> None:
+    sim = SimState.empty(3, 3)
+    before = SimState(sim.materials.copy(), sim.depths.copy())
+    version = sim.version
+    ops = [
+        {"op": "fill_rect", "r": 0, "c": 0, "rows": 3, "cols": 3, "material": "stone"},
+        {"op": "set_pixel", "r": 1, "c": 1, "material": "space", "depth": "deep"},
+    ]
+    assert sim.apply_edits(ops) == {"code": "bad_request"}
+    assert sim == before and sim.version == version
+    ops[1] = {"op": "line", "r0": 0, "c0": 0, "r1": 3, "c1": 0, "material": "sink"}
+    assert sim.apply_edits(ops) == {"code": "index_out_of_bounds"}
+    ops[1] = {"op": "flood_fill", "r": 0, "c": 0, "material": "mud"}
+    assert sim.apply_edits(ops) == {"code": "invalid_material"}
+    assert sim == before
+
+
+def test_bulk_edit_ops() -> None:
+    sim = SimState.empty(6, 8)
+    ops = [
+        # A stone box with an opening at the top right...
+        {"op": "fill_rect", "r": 1, "c": 1, "rows": 4, "cols": 5, "material": "stone"},
+        {"op": "fill_rect", "r": 2, "c": 2, "rows": 2, "cols": 3, "material": "space"},
+        {"op": "set_pixel", "r": 1, "c": 4, "material": "space"},
+        # ...flooded from inside: the water escapes through the opening.
+        {"op": "flood_fill", "r": 2, "c": 2, "material": "space", "depth": 0.25},
+        {"op": "line", "r0": 5, "c0": 0, "r1": 3, "c1": 7, "material": "sink"},
+    ]
+    assert sim.apply_edits(ops) is None
+    rows = ["00000000", "01110100", "01000100", "01000133", "01333300", "33000000"]
+    expected = np.array([[int(ch) for ch in row] for row in rows])
+    assert np.array_equal(sim.materials, expected)
+    # Every space cell is connected to the box interior and got water.
+    assert (sim.depths[expected == 0] == np.float32(0.25)).all()
+    assert (sim.depths[expected == 1] == 0.0).all()
+
+
+def test_flood_fill_stays_in_its_area() -> None:
+    sim = SimState.empty(5, 5)
+    wall = {"op": "line", "r0": 0, "c0": 2, "r1": 4, "c1": 2, "material": "stone"}
+    fill = {"op": "flood_fill", "r": 4, "c": 0, "material": "spring"}
+    assert sim.apply_edits([wall, fill]) is None
+    assert (sim.materials[:, :2] == MATERIAL_CODES["spring"]).all()
+    assert (sim.materials[:, 3:] == MATERIAL_CODES["space"]).all()
+
+
+def test_set_region_unpacks_planes() -> None:
+    sim = SimState.empty(4, 4)
+    materials = np.array([[1, 2, 3], [0, 1, 2]], dtype=np.uint8)
+    depths = np.array([[0.5, 2.0, 0.0], [0.25, 0.0, 1.0]], dtype="<f4")
+    op = {
+        "op": "set_region",
+        "r": 1,
+        "c": 1,
+        "rows": 2,
+        "cols": 3,
+        "materials": base64.b64encode(materials.tobytes()).decode(),
+        "depths": base64.b64encode(depths.tobytes()).decode(),
+    }
+    assert sim.apply_edits([op]) is None
+    assert np.array_equal(sim.materials[1:3, 1:4], materials)
+    assert np.array_equal(sim.depths[1:3, 1:4], np.clip(depths, 0.0, 1.0))
+    assert sim.materials[0].sum() == 0 and sim.materials[:, 0].sum() == 0
+
+    assert sim.apply_edits([{**op, "cols": 2}]) == {"code": "bad_request"}
+    bad = np.full(6, 7, dtype=np.uint8).tobytes()
+    assert sim.apply_edits([{**op, "materials": base64.b64encode(bad).decode()}]) == {
+        "code": "invalid_material"
+    }
+    assert sim.apply_edits([{**op, "r": 3}]) == {"code": "index_out_of_bounds"}
+
+
+def test_coalesced_batches_match_sequential_edits() -> None:
+    rng = np.random.default_rng(5)
+    names = sorted(MATERIAL_CODES)
+    batches = []
+    for _ in range(20):
+        batch = []
+        for _ in range(rng.integers(1, 30)):
+            op = {
+                "op": "set_pixel",
+                "r": int(rng.integers(0, 6)),
+                "c": int(rng.integers(0, 70)),
+                "material": names[rng.integers(0, len(names))],
+            }
+            if rng.random() < 0.5:
+                op["depth"] = float(rng.random())
+            batch.append(op)
+        batches.append(batch)
+    rect = {"op": "fill_rect", "r": 1, "c": 1, "rows": 3, "cols": 40, "material": "stone"}
+    batches[4].append(rect)
+    batches[7].append({"op": "set_pixel", "r": 99, "c": 0, "material": "stone"})
+
+    sequential = SimState.empty(6, 70)
+    expected = [sequential.apply_edits(batch) for batch in batches]
+    coalesced = SimState.empty(6, 70)
+    assert coalesced.apply_batches(batches) == expected
+    assert expected[7] == {"code": "index_out_of_bounds"}
+    assert coalesced == sequential
+    assert np.array_equal(coalesced.awake, sequential.awake)
+
+
+def _random_state(rng: np.random.Generator, rows: int, cols: int) -> SimState:
+    materials = rng.integers(0, len(MATERIAL_CODES), (rows, cols)).astype(np.uint8)
+    depths = rng.random((rows, cols)).astype(np.float32)
+    depths[rng.random((rows, cols)) < 0.5] = 0.0
+    return SimState(materials, depths)
+
+
+def test_vectorized_matches_reference() -> None:
+    scenarios = [
+        [[SPixel("space", 1.0)], [SPixel("space", 0.0)]],
+        [[SPixel("spring", 0.0)], [SPixel("sink", 0.5)]],
+        [[SPixel("spring", 0.0)], [SPixel("space", 0.0)]],
+        [[SPixel("space", 0.0), SPixel("space", -0.5)], [SPixel("space", 0.0), SPixel("space", 0.8)]],
+    ]
+    states = []
+    for grid in scenarios:
+        a, b = SimState(), SimState()
+        a.grid = grid
+        b.grid = grid
+        states.append((a, b))
+    rng = np.random.default_rng(7)
+    for _ in range(10):
+        a = _random_state(rng, 17, 23)
+        states.append((a, SimState(a.materials.copy(), a.depths.copy())))
+
+    for ref, vec in states:
+        for _ in range(4):
+            flow_step_reference(ref)
+            flow_step_vectorized(vec)
+            assert np.array_equal(ref.depths.view(np.uint32), vec.depths.view(np.uint32))
+
+
+def test_vectorized_sees_terrain_edits() -> None:
+    sim = SimState.empty(2, 1)
+    sim.apply_edits([{"op": "set_pixel", "r": 0, "c": 0, "material": "space", "depth": 1.0}])
+    sim.apply_edits([{"op": "set_pixel", "r": 1, "c": 0, "material": "stone"}])
+    flow_step_vectorized(sim)
+    assert sim.depths.tolist() == [[1.0], [0.0]]
+    sim.apply_edits([{"op": "set_pixel", "r": 1, "c": 0, "material": "space"}])
+    flow_step_vectorized(sim)
+    assert sim.depths.tolist() == [[0.0], [1.0]]
+
+
+def test_chunked_matches_reference_and_sleeps() -> None:
+    rng = np.random.default_rng(11)
+    rows, cols = 3 * CHUNK + 5, 2 * CHUNK + 7
+    ref = _random_state(rng, rows, cols)
+    ref.materials[-CHUNK:] = MATERIAL_CODES["stone"]
+    ref.materials[ref.materials == MATERIAL_CODES["spring"]] = MATERIAL_CODES["space"]
+    chunked = SimState(ref.materials.copy(), ref.depths.copy())
+    for _ in range(rows + 2):
+        flow_step_reference(ref)
+        flow_step_chunked(chunked)
+        assert np.array_equal(ref.depths.view(np.uint32), chunked.depths.view(np.uint32))
+    # Without springs everything settles and every chunk goes to sleep.
+    assert not chunked.awake.any()
+    assert chunked.stats["chunks"]["size"] == CHUNK
+
+    edit = {"op": "set_pixel", "r": 5, "c": CHUNK + 3, "material": "spring"}
+    for state in (ref, chunked):
+        state.apply_edits([edit])
+    assert chunked.awake.sum() == 4  # the chunk and its three in-grid neighbours
+    for step in range(rows):
+        flow_step_reference(ref)
+        flow_step_chunked(chunked)
+        assert np.array_equal(ref.depths.view(np.uint32), chunked.depths.view(np.uint32))
+        if step == 0:
+            assert chunked.stats["chunks"]["active"] == [[0, 0], [0, 1], [0, 2], [1, 1]]
+
+
+def _level(*rows: str) -> SimState:
+    codes = {".": "space", "#": "stone", "S": "spring", "K": "sink"}
+    materials = np.array(
+        [[MATERIAL_CODES[codes[ch]] for ch in row] for row in rows], dtype=np.uint8
+    )
+    return SimState(materials, np.zeros(materials.shape, dtype=np.float32))
+
+
+def test_pressure_levels_a_u_tube() -> None:
+    sim = _level("#.#.#", "#.#.#", "#.#.#", "#.#.#", "#...#", "#####")
+    sim.depths[:5, 1] = 1.0
+    sim.depths[4, 2] = 1.0
+    for _ in range(100):
+        flow_step_pressure(sim)
+    assert sim.depths.sum() == pytest.approx(6.0, abs=1e-4)
+    # Both arms full to row 3 with the last cell of water split between them.
+    assert sim.depths[3:5, 1:4].tolist() == [[1.0, 0.0, 1.0], [1.0, 1.0, 1.0]]
+    assert sim.depths[2, 1] == pytest.approx(0.5, abs=0.01)
+    assert sim.depths[2, 3] == pytest.approx(0.5, abs=0.01)
+    assert not sim.depths[:2].any()
+
+
+def test_pressure_spreads_standing_water() -> None:
+    sim = _level(".......", ".......", "#######")
+    sim.depths[0:2, 3] = 1.0
+    for _ in range(50):
+        flow_step_pressure(sim)
+    assert sim.depths[1] == pytest.approx(np.full(7, 2.0 / 7.0), abs=1e-3)
+    assert not sim.depths[0].any()
+
+
+@pytest.mark.parametrize("solver", [flow_step_pressure, flow_step_spread])
+def test_conserving_solvers_conserve_water(solver) -> None:
+    rng = np.random.default_rng(5)
+    sim = _random_state(rng, 40, 30)
+    sim.materials[sim.materials > MATERIAL_CODES["stone"]] = MATERIAL_CODES["space"]
+    sim.depths[sim.materials == MATERIAL_CODES["stone"]] = 0.0
+    total = sim.depths.sum(dtype=np.float64)
+    for _ in range(60):
+        solver(sim)
+        assert sim.depths.min() >= 0.0 and sim.depths.max() <= 1.0
+        assert sim.depths.sum(dtype=np.float64) == pytest.approx(total, rel=1e-5)
+
+
+def test_pressure_caches_terrain_and_warm_starts() -> None:
+    sim = _level("#.....#", "#.....#", "#######")
+    sim.depths[1] = [0.0, 1.0, 1.0, 1.0, 0.0, 0.0, 0.0]
+    flow_step_pressure(sim)
+    system = sim.cache["flow_step_pressure"][1]
+    for _ in range(40):
+        flow_step_pressure(sim)
+    assert sim.cache["flow_step_pressure"][1] is system
+    # Settled water starts at last tick's solution and needs no iterations.
+    assert sim.stats["pressure"]["iterations"] == 0
+    sim.apply_edits([{"op": "set_pixel", "r": 0, "c": 3, "material": "stone"}])
+    flow_step_pressure(sim)
+    assert sim.cache["flow_step_pressure"][1] is not system
+    assert "pressure" in SOLVERS
+
+
+def test_spread_fills_a_basin_flat() -> None:
+    sim = _level("#.......#", "#.......#", "#.......#", "#########")
+    sim.depths[0, 2] = 1.0
+    sim.depths[1, 6] = 0.8
+    flow_step_spread(sim)
+    assert sim.stats["spread"] == {"substeps": 2, "volume": 1.8}
+    for _ in range(400):
+        flow_step_spread(sim)
+    assert sim.depths[2, 1:8] == pytest.approx(np.full(7, 1.8 / 7.0), abs=1e-3)
+    assert not sim.depths[:2].any()
+    # Settled water needs no substeps.
+    assert sim.stats["spread"]["substeps"] == 0
+
 
+def test_spread_substeps_follow_the_largest_flow() -> None:
+    sim = _level("...", "...", "###")
+    sim.depths[1, 1] = 0.4
+    flow_step_spread(sim)
+    assert sim.stats["spread"]["substeps"] == 1
+    sim.depths[0, 1] = 1.0
+    flow_step_spread(sim)
+    assert sim.stats["spread"]["substeps"] == 2
+    sim.apply_edits([{"op": "set_pixel", "r": 0, "c": 0, "material": "spring"}])
+    flow_step_spread(sim)
+    assert sim.stats["spread"]["volume"] == pytest.approx(sim.depths.sum(), abs=1e-3)
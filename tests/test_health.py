@@ -1,13 +1,20 @@
 import asyncio
 import contextlib
 import json
+import marshal
+import urllib.error
 import urllib.request
 from pathlib import Path
 import sys
 from typing import Any
 
+import pytest
+import websockets
+
 sys.path.append(str(Path(__file__).resolve().parents[1]))
+from client.net import build_hello
 from server import net as server_net
+from server.metrics import Histogram
 
 
 async def _start() -> tuple[asyncio.AbstractServer, asyncio.Task, Any]:
@@ -32,3 +39,109 @@ async def test_health_endpoint() -> None:
         assert data["ok"] is True
     finally:
         await _stop(server, broadcaster, health)
+
+
+def test_histogram_exposition() -> None:
+    histogram = Histogram("t_seconds", "Test.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    assert histogram.render() == [
+        "# HELP t_seconds Test.",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{le="0.1"} 2',
+        't_seconds_bucket{le="1.0"} 3',
+        't_seconds_bucket{le="+Inf"} 4',
+        "t_seconds_sum 3.65",
+        "t_seconds_count 4",
+    ]
+
+
+async def test_metrics_endpoint() -> None:
+    server, broadcaster, health = await server_net.start_server(tick_hz=100, snapshot_hz=50)
+    try:
+        async with websockets.connect("ws://127.0.0.1:7777/ws") as ws:
+            await ws.send(json.dumps(build_hello()))
+            await asyncio.wait_for(ws.recv(), timeout=1)
+            good = [{"op": "set_pixel", "r": 0, "c": 0, "material": "spring"}]
+            bad = [{"op": "set_pixel", "r": 5, "c": 0, "material": "stone"}] * 2
+            for ops in (good, bad):
+                await ws.send(json.dumps({"t": "edit_grid", "seq": "2", "ts": 0, "ops": ops}))
+            await asyncio.sleep(0.2)
+            resp = await asyncio.to_thread(
+                urllib.request.urlopen, "http://127.0.0.1:7778/metrics"
+            )
+            assert resp.headers["Content-Type"].startswith("text/plain")
+            text = resp.read().decode()
+    finally:
+        await _stop(server, broadcaster, health)
+
+    samples = {}
+    for line in text.splitlines():
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    for histogram in ("tick_solve", "snapshot_build", "snapshot_encode", "broadcast_fanout"):
+        assert samples[f"pszcz_{histogram}_seconds_count"] > 0
+    assert samples["pszcz_save_seconds_count"] == 0
+    assert samples['pszcz_edit_ops_total{result="applied"}'] == 1
+    assert samples['pszcz_edit_ops_total{code="index_out_of_bounds",result="rejected"}'] == 2
+    assert samples["pszcz_active_cells"] == 1
+    [sent] = [v for k, v in samples.items() if k.startswith("pszcz_client_sent_bytes_total")]
+    assert sent > 0
+    [recv] = [v for k, v in samples.items() if k.startswith("pszcz_client_received_messages")]
+    assert recv == 3
+
+
+async def _get(url: str) -> tuple[int, bytes]:
+    def fetch() -> tuple[int, bytes]:
+        try:
+            with urllib.request.urlopen(url) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.read()
+
+    return await asyncio.to_thread(fetch)
+
+
+@pytest.mark.parametrize("sim_thread", [False, True])
+async def test_profiling_endpoints(sim_thread: bool) -> None:
+    server, broadcaster, health = await server_net.start_server(
+        tick_hz=200, snapshot_hz=50, sim_thread=sim_thread, profiling=True
+    )
+    base = "http://127.0.0.1:7778/debug"
+    try:
+        status, body = await _get(f"{base}/profile?seconds=0.3&sort=tottime&limit=200")
+        assert status == 200
+        text = body.decode()
+        for hot in ("flow_step", "snapshot", "_broadcast_snapshots"):
+            assert hot in text, hot
+
+        status, body = await _get(f"{base}/profile?seconds=0.1&format=pstats")
+        assert status == 200 and marshal.loads(body)
+
+        status, body = await _get(f"{base}/profile?seconds=0.3&mode=sample&interval=0.001")
+        assert status == 200
+        stacks = body.decode().splitlines()
+        assert stacks and all(line.rsplit(" ", 1)[1].isdigit() for line in stacks)
+        thread = "simulation" if sim_thread else "MainThread"
+        assert any(line.startswith(thread + ";") for line in stacks)
+
+        status, body = await _get(f"{base}/tracemalloc?seconds=0.2&top=5")
+        assert status == 200 and len(body.decode().splitlines()) <= 5
+
+        assert (await _get(f"{base}/profile?seconds=-1"))[0] == 400
+        assert (await _get(f"{base}/profile?sort=bogus"))[0] == 400
+        busy = asyncio.create_task(_get(f"{base}/profile?seconds=0.3"))
+        await asyncio.sleep(0.1)
+        assert (await _get(f"{base}/tracemalloc?seconds=0"))[0] == 409
+        assert (await busy)[0] == 200
+    finally:
+        await _stop(server, broadcaster, health)
+
+
+async def test_profiling_endpoints_are_off_by_default() -> None:
+    server, broadcaster, health = await _start()
+    try:
+        assert (await _get("http://127.0.0.1:7778/debug/profile?seconds=0"))[0] == 404
+    finally:
+        await _stop(server, broadcaster, health)
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from client.loadgen import ClientStats, _percentiles, run_load, summarize
+from server import net as server_net
+
+LEVEL = Path(__file__).resolve().parents[1] / "levels" / "level.sample.v1.json"
+
+
+def test_summary_percentiles_and_jitter() -> None:
+    assert _percentiles([]) == {"count": 0}
+    assert _percentiles([float(v) for v in range(1, 101)]) == {
+        "count": 100,
+        "p50": 50.0,
+        "p90": 90.0,
+        "p99": 99.0,
+        "max": 100.0,
+    }
+    stats = [
+        ClientStats(frames=3, bytes=300, arrivals=[0.0, 0.1, 0.3]),
+        ClientStats(failed="refused", errors={"rate_limited": 2}),
+    ]
+    report = summarize(stats, 2.0)
+    assert report["connected"] == 1 and report["failures"] == ["refused"]
+    assert report["bytes_per_s"] == 150.0 and report["frames_per_s"] == 1.5
+    assert report["interarrival_ms"]["mean"] == 150.0
+    assert report["interarrival_ms"]["jitter"] == 50.0
+    assert report["errors"] == {"rate_limited": 2}
+
+
+async def test_loadgen_against_local_server() -> None:
+    server, simulation, health = await server_net.start_server(
+        tick_hz=50, snapshot_hz=20, level_path=LEVEL
+    )
+    try:
+        report = await run_load(
+            clients=3, duration=1.0, features=["delta-1"], edit_every=0.1, edit_burst=5
+        )
+    finally:
+        server.close()
+        await server.wait_closed()
+        simulation.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await simulation
+        await health.cleanup()
+
+    assert report["connected"] == 3 and not report["failures"]
+    assert report["frames"] > 3 * 5
+    assert report["bytes_per_s"] > 0
+    assert report["latency_ms"]["count"] == report["frames"]
+    assert report["interarrival_ms"]["p50"] > 0
+    assert report["edits_sent"] > 0 and report["edit_rtt_ms"]["count"] > 0
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+from typing import Any, List
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from server import net as server_net
+from server.net import ClientSession, ServerState
+from server.outbox import Outbox, OutboxOverflow
+
+
+async def test_outbox_latest_frame_wins() -> None:
+    outbox = Outbox(limit=2)
+    assert outbox.put_frame("f1")
+    outbox.put("e1")
+    assert not outbox.put_frame("f2")
+    outbox.put("e2")
+    assert outbox.dropped == 1
+    assert len(outbox) == 3
+    assert [await outbox.get() for _ in range(3)] == ["e1", "e2", "f2"]
+    outbox.put("e3")
+    outbox.put("e4")
+    with pytest.raises(OutboxOverflow):
+        outbox.put("e5")
+
+
+class _FakeWS:
+    def __init__(self, delay: float) -> None:
+        self.delay = delay
+        self.remote_address = ("test", 0)
+        self.sent: List[Any] = []
+
+    async def send(self, message: Any) -> None:
+        await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+
+async def test_slow_client_does_not_delay_others() -> None:
+    state = ServerState()
+    state.sim.clear(2, 2)
+    fast, slow = _FakeWS(0.0), _FakeWS(10.0)
+    writers = []
+    for ws in (fast, slow):
+        session = ClientSession(features={"delta-1"})
+        state.sessions[ws] = session
+        writers.append(asyncio.create_task(server_net._write_loop(ws, state, session.outbox)))
+    try:
+        for _ in range(5):
+            server_net._broadcast_frame(state)
+            await asyncio.sleep(0.01)
+        assert len(fast.sent) == 5
+        assert [json.loads(m)["t"] for m in fast.sent] == ["snapshot"] + ["delta"] * 4
+        assert slow.sent == []
+        # One frame is in flight, one is pending, the rest were dropped.
+        assert state.drop_counts[slow] == 3
+        assert state.queue_depths[slow] == 1
+        assert state.sessions[slow].needs_keyframe is False
+    finally:
+        for writer in writers:
+            writer.cancel()
+
+
+class _BrokenWS(_FakeWS):
+    """Accepts the handshake, then fails every queued write."""
+
+    def __init__(self) -> None:
+        super().__init__(0.0)
+        self.incoming = [json.dumps({"t": "hello", "seq": "1", "ts": 0, "accept_major": [2], "min_minor": 0})]
+
+    def __aiter__(self) -> "_BrokenWS":
+        return self
+
+    async def __anext__(self) -> str:
+        if self.incoming:
+            return self.incoming.pop(0)
+        await asyncio.sleep(0.05)
+        raise StopAsyncIteration
+
+    async def recv(self) -> str:
+        return await self.__anext__()
+
+    async def send(self, message: Any) -> None:
+        if self.sent:
+            raise RuntimeError("socket broke")
+        self.sent.append(message)
+
+
+async def test_failed_writer_still_forgets_client() -> None:
+    state = ServerState()
+    state.sim.clear(1, 1)
+    ws = _BrokenWS()
+    handler = asyncio.create_task(server_net._handle_client(ws, state))
+    await asyncio.sleep(0.01)
+    server_net._broadcast_frame(state)
+    await handler
+    assert ws not in state.sessions
+    assert ws not in state.sent_counts and ws not in state.queue_depths
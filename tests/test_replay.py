@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import sys
+from pathlib import Path
+
+import pytest
+import websockets
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from client.net import build_hello
+from server import net as server_net
+from server.replay import Recorder, Replay
+from server.state import SimState
+from server.tick import flow_step_chunked, flow_step_reference, flow_step_vectorized
+
+
+def _record(directory: Path) -> dict[int, SimState]:
+    """Record 25 ticks of a small session and return the grid after each."""
+
+    sim = SimState.empty(12, 6)
+    recorder = Recorder(directory, cm_per_pixel=2.0, keyframe_every=10)
+    recorder.start(sim, 0)
+    grids = {}
+    for tick in range(1, 26):
+        flow_step_vectorized(sim)
+        recorder.ticked(sim, tick)
+        grids[tick] = SimState(sim.materials.copy(), sim.depths.copy())
+        if tick in (3, 14):
+            ops = [{"op": "set_pixel", "r": 0, "c": tick % 6, "material": "spring"}]
+            recorder.edits(tick, ops)
+            sim.apply_edits(ops)
+        if tick == 17:
+            recorder.control(tick, {"pause": False})
+            ops = [{"op": "set_pixel", "r": 6, "c": 2, "material": "stone", "depth": 0.5}]
+            recorder.edits(tick, ops)
+            sim.apply_edits(ops)
+    recorder.close(25)
+    return grids
+
+
+@pytest.mark.parametrize("solver", [flow_step_vectorized, flow_step_reference, flow_step_chunked])
+def test_replay_reproduces_recorded_grids(tmp_path: Path, solver) -> None:
+    grids = _record(tmp_path)
+    replay = Replay(tmp_path, solver)
+    assert [k[0] for k in replay.keyframes] == [0, 10, 20]
+    assert (replay.first, replay.last(), replay.cm_per_pixel) == (0, 25, 2.0)
+    assert replay.verify() == []
+    for tick in (1, 3, 4, 10, 14, 17, 19, 25):
+        assert replay.seek(tick) == grids[tick], tick
+    with pytest.raises(ValueError):
+        replay.seek(-1)
+
+
+def test_verify_reports_diverging_keyframes(tmp_path: Path) -> None:
+    _record(tmp_path)
+
+    def lossy(sim: SimState) -> None:
+        flow_step_vectorized(sim)
+        sim.depths *= 0.5
+
+    assert Replay(tmp_path, lossy).verify() == [10, 20]
+
+
+async def test_server_records_session(tmp_path: Path) -> None:
+    server, simulation, health = await server_net.start_server(
+        tick_hz=200, record_dir=tmp_path, record_keyframe_every=5
+    )
+    try:
+        async with websockets.connect("ws://127.0.0.1:7777/ws") as ws:
+            await ws.send(json.dumps(build_hello()))
+            await asyncio.wait_for(ws.recv(), timeout=1)
+            ops = [{"op": "set_pixel", "r": 0, "c": 0, "material": "stone"}]
+            await ws.send(json.dumps({"t": "edit_grid", "seq": "2", "ts": 0, "ops": ops}))
+            await ws.send(json.dumps({"t": "control", "seq": "3", "ts": 0, "tick_hz": 100}))
+            await asyncio.sleep(0.2)
+    finally:
+        server.close()
+        await server.wait_closed()
+        simulation.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await simulation
+        await health.cleanup()
+
+    replay = Replay(tmp_path)
+    assert replay.end is not None and replay.end > 5
+    assert replay.verify() == []
+    assert replay.seek(replay.end).grid[0][0].material == "stone"
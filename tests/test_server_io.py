@@ -6,7 +6,11 @@ from pathlib import Path
 import sys
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from server.io import load_level, save_level
+import numpy as np
+import pytest
+
+from server import jsonstream
+from server.io import convert_level, load_level, save_level
 from server.state import Pixel, SimState
 
 
@@ -17,15 +21,120 @@ def test_save_and_load_level(tmp_path: Path) -> None:
         [Pixel("spring", 0.5), Pixel("sink", 0.0)],
     ]
     path = tmp_path / "level.json"
-    save_level(path, sim, cm_per_pixel=1.0, meta={"note": "test"})
+    save_level(path, sim, cm_per_pixel=2.5, meta={"note": "test"})
 
     data = json.loads(path.read_text())
     assert data["rows"] == 2
     assert data["cols"] == 2
-    assert data["cm_per_pixel"] == 1.0
+    assert data["cm_per_pixel"] == 2.5
     assert data["grid"][1][0]["material"] == "spring"
 
     loaded = SimState()
-    load_level(path, loaded)
-    assert loaded.grid[1][0].material == "spring"
-    assert loaded.grid[1][0].depth == 0.5
+    assert load_level(path, loaded) == 2.5
+    assert loaded == sim
+    assert loaded.depths[1, 0] == 0.5
+
+
+def test_saved_depths_keep_their_short_form(tmp_path: Path) -> None:
+    sim = SimState.empty(1, 1)
+    sim.apply_edits([{"op": "set_pixel", "r": 0, "c": 0, "material": "space", "depth": 0.3}])
+    path = tmp_path / "level.json"
+    save_level(path, sim)
+    assert '"depth": 0.3}' in path.read_text()
+
+
+def test_gzip_level_roundtrip(tmp_path: Path) -> None:
+    sim = SimState.empty(2, 3)
+    sim.apply_edits([{"op": "set_pixel", "r": 1, "c": 2, "material": "spring", "depth": 0.5}])
+    path = tmp_path / "level.json.gz"
+    save_level(path, sim, cm_per_pixel=3.0)
+    assert path.read_bytes()[:2] == b"\x1f\x8b"
+    loaded = SimState()
+    assert load_level(path, loaded) == 3.0
+    assert loaded == sim
+    assert [p.name for p in tmp_path.iterdir()] == ["level.json.gz"]
+
+
+def test_failed_save_keeps_previous_file(tmp_path: Path) -> None:
+    path = tmp_path / "level.json"
+    save_level(path, SimState.empty(1, 1))
+    before = path.read_text()
+    broken = SimState.empty(1, 1)
+    broken.depths = np.zeros((0, 0), dtype=np.float32)  # planes disagree
+    with pytest.raises(Exception):
+        save_level(path, broken)
+    assert path.read_text() == before
+    assert [p.name for p in tmp_path.iterdir()] == ["level.json"]
+
+
+def test_level_json_is_read_row_by_row(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Members after the grid, legacy "pixels" rows and numbers split
+    # across reads all have to survive the incremental parser.
+    monkeypatch.setattr(jsonstream, "READ_SIZE", 3)
+    path = tmp_path / "level.json"
+    path.write_text(
+        '{ "pixels" : [[{"material": "spring", "depth": 12.25}],'
+        ' [{"material": "sink", "depth": 0}]], "cm_per_pixel": 1234.5 ,'
+        ' "rows": 2, "cols": 1 }'
+    )
+    sim = SimState()
+    assert load_level(path, sim) == 1234.5
+    assert sim.shape == (2, 1)
+    assert sim.depths[0, 0] == np.float32(12.25)
+    assert sim.grid[1][0].material == "sink"
+
+    with path.open() as fp:
+        events = list(jsonstream.iter_level(fp))
+    assert [key for key, _ in events[:2]] == [jsonstream.ROW, jsonstream.ROW]
+
+
+def test_level_json_rejects_truncated_documents(tmp_path: Path) -> None:
+    path = tmp_path / "level.json"
+    path.write_text('{"rows": 1, "cols": 1, "grid": [[{"material": "space"}]')
+    with pytest.raises(ValueError):
+        load_level(path, SimState())
+
+
+def test_binary_level_roundtrip_is_memory_mapped(tmp_path: Path) -> None:
+    rng = np.random.default_rng(2)
+    sim = SimState(
+        rng.integers(0, 4, (5, 7)).astype(np.uint8), rng.random((5, 7), dtype=np.float32)
+    )
+    path = tmp_path / "level.pszl"
+    save_level(path, sim, cm_per_pixel=2.5, meta={"note": "test"})
+
+    loaded = SimState()
+    assert load_level(path, loaded) == 2.5
+    assert loaded == sim
+    assert isinstance(loaded.materials.base, np.memmap)
+    assert isinstance(loaded.depths.base, np.memmap)
+    # Copy-on-write: edits stay in memory, and saving over the mapped file works.
+    loaded.apply_edits([{"op": "set_pixel", "r": 0, "c": 0, "material": "stone"}])
+    again = SimState()
+    load_level(path, again)
+    assert again == sim
+    save_level(path, loaded)
+    load_level(path, again)
+    assert again == loaded
+
+
+def test_convert_sample_level(tmp_path: Path) -> None:
+    sample = Path(__file__).resolve().parents[1] / "levels" / "level.sample.v1.json"
+    binary = tmp_path / "sample.pszl"
+    convert_level(sample, binary)
+    expected, converted = SimState(), SimState()
+    load_level(sample, expected)
+    load_level(binary, converted)
+    assert converted == expected
+    back = tmp_path / "sample.json"
+    convert_level(binary, back)
+    assert json.loads(back.read_text())["grid"] == json.loads(sample.read_text())["grid"]
+
+
+def test_binary_level_rejects_garbage(tmp_path: Path) -> None:
+    path = tmp_path / "bad.pszl"
+    path.write_bytes(b"nope")
+    with pytest.raises(ValueError):
+        load_level(path, SimState())
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from server import net as server_net
+from server.net import ServerState
+from server.state import Pixel
+from server.tick import FixedTimestep
+
+
+def test_fixed_timestep_repays_oversleep() -> None:
+    clock = FixedTimestep()
+    assert clock.advance(0.0, 0.02) == 1
+    # Woke up late: the 5 ms overshoot shortens the next wait.
+    assert clock.advance(0.025, 0.02) == 1
+    assert abs(clock.until_next(0.02) - 0.015) < 1e-9
+    assert clock.advance(0.04, 0.02) == 1
+    assert clock.advance(0.05, 0.02) == 0
+
+
+def test_fixed_timestep_caps_catchup() -> None:
+    clock = FixedTimestep(max_catchup=3)
+    clock.advance(0.0, 0.02)
+    assert clock.advance(0.2, 0.02) == 3
+    assert clock.dropped == 7
+    # The dropped ticks show up as lag.
+    assert abs(clock.lag() - 0.14) < 1e-6
+
+
+def test_fixed_timestep_reset_discards_backlog() -> None:
+    clock = FixedTimestep()
+    clock.advance(0.0, 0.02)
+    clock.reset(10.0)
+    assert clock.advance(10.01, 0.02) == 0
+
+
+async def test_tick_loop_drives_solver() -> None:
+    state = ServerState()
+    state.sim.grid = [[Pixel("spring", 0.0)], [Pixel("space", 0.0)]]
+    task = asyncio.create_task(server_net._tick_loop(state))
+    await asyncio.sleep(0.1)
+    state.control.pause = True
+    await asyncio.sleep(0.05)
+    ticks = state.tick
+    await asyncio.sleep(0.05)
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+    assert ticks > 0
+    assert state.tick == ticks  # paused
+    assert state.sim.depths[1, 0] == 1.0
+
+
+async def test_tick_loop_pauses_on_solver_error() -> None:
+    state = ServerState()
+
+    def broken(sim) -> None:
+        raise RuntimeError("boom")
+
+    state.solver = broken
+    task = asyncio.create_task(server_net._tick_loop(state))
+    await asyncio.sleep(0.05)
+    assert state.control.pause
+    assert not task.done()
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+
+async def test_run_simulation_stops_both_loops_on_error(monkeypatch) -> None:
+    broadcasts = 0
+
+    def failing_frame(state: ServerState) -> None:
+        nonlocal broadcasts
+        broadcasts += 1
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(server_net, "_broadcast_frame", failing_frame)
+    state = ServerState()
+    task = asyncio.create_task(server_net._run_simulation(state))
+    await asyncio.sleep(0.05)
+    assert task.done() and isinstance(task.exception(), RuntimeError)
+    ticks = state.tick
+    await asyncio.sleep(0.05)
+    assert state.tick == ticks
+    assert broadcasts == 1
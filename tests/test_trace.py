@@ -0,0 +1,101 @@
+import asyncio
+import contextlib
+import json
+import time
+import urllib.request
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from server import net as server_net
+from server.metrics import Histogram
+from server.trace import LoopMonitor, SpanRecorder
+
+
+def test_span_recorder_keeps_the_latest_spans_as_a_chrome_trace() -> None:
+    spans = SpanRecorder(capacity=3)
+    for i in range(4):
+        spans.add("solve", i, i + 0.5, tick=i)
+    spans.add("send", 10.0, 10.001, "send 1.2.3.4:5")
+    assert len(spans) == 3
+
+    trace = spans.trace()
+    events = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert [(e["name"], e["ts"], e["dur"]) for e in events] == [
+        ("solve", 2e6, 5e5),
+        ("solve", 3e6, 5e5),
+        ("send", 10e6, 1e3),
+    ]
+    assert events[0]["args"] == {"tick": 2} and "args" not in events[2]
+    names = {
+        e["tid"]: e["args"]["name"] for e in trace["traceEvents"] if e["name"] == "thread_name"
+    }
+    assert names[events[0]["tid"]] == "MainThread"
+    assert names[events[2]["tid"]] == "send 1.2.3.4:5"
+
+
+def test_slow_tick_dumps_a_trace(tmp_path: Path) -> None:
+    spans = SpanRecorder(budget=0.01, dump_dir=tmp_path)
+    spans.tick(0.0, 0.005, 1)
+    assert spans.dumps == 0
+    spans.tick(1.0, 1.05, 2)
+    spans.tick(2.0, 2.05, 3)  # within dump_every of the first dump
+    assert spans.dumps == 1
+    for _ in range(100):
+        files = list(tmp_path.glob("trace-*.json"))
+        if files:
+            break
+        time.sleep(0.01)
+    [path] = files
+    for _ in range(100):
+        with contextlib.suppress(json.JSONDecodeError):
+            trace = json.loads(path.read_text(encoding="utf-8"))
+            break
+        time.sleep(0.01)
+    ticks = [e["args"]["tick"] for e in trace["traceEvents"] if e["name"] == "tick"]
+    assert ticks == [1, 2]
+
+
+def test_loop_monitor_records_stalls() -> None:
+    histogram = Histogram("lag", "Lag.", buckets=(0.01,))
+    spans = SpanRecorder()
+    monitor = LoopMonitor(histogram, spans, stall=0.1)
+    monitor.observe(1.0, 1.002)
+    monitor.observe(2.0, 2.25)
+    monitor.observe(3.0, 2.99)
+    assert monitor.lag == 0.0 and monitor.max_lag == 0.25
+    assert histogram.counts == [2, 1]
+    [stall] = [e for e in spans.trace()["traceEvents"] if e["name"] == "loop_stall"]
+    assert stall["ts"] == 2e6 and stall["dur"] == 2.5e5
+
+
+@pytest.mark.parametrize("sim_thread", [False, True])
+async def test_trace_endpoint_and_loop_lag(sim_thread: bool) -> None:
+    server, broadcaster, health = await server_net.start_server(
+        tick_hz=100, snapshot_hz=50, sim_thread=sim_thread, trace_spans=5000
+    )
+    try:
+        await asyncio.sleep(0.3)
+        resp = await asyncio.to_thread(urllib.request.urlopen, "http://127.0.0.1:7778/health")
+        assert json.loads(resp.read().decode())["loop_lag_ms"] >= 0
+        resp = await asyncio.to_thread(
+            urllib.request.urlopen, "http://127.0.0.1:7778/debug/trace"
+        )
+        trace = json.loads(resp.read().decode())
+        resp = await asyncio.to_thread(urllib.request.urlopen, "http://127.0.0.1:7778/metrics")
+        metrics = resp.read().decode()
+    finally:
+        server.close()
+        await server.wait_closed()
+        broadcaster.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await broadcaster
+        await health.cleanup()
+
+    names = {e["name"] for e in trace["traceEvents"] if e["ph"] == "X"}
+    for phase in ("edit_drain", "solve", "tick", "snapshot_build", "fanout", "broadcast"):
+        assert phase in names, phase
+    assert ("publish" in names) == sim_thread
+    assert "pszcz_loop_lag_seconds_count" in metrics
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from client.t0.state import (
+    ClientState,
+    decode_binary_frame,
+    make_decompressor,
+    unwrap_message,
+)
+from server import wire
+from server.delta import DeltaTracker
+from server.state import Pixel, SimState
+
+
+def _header(frame: int) -> wire.FrameHeader:
+    return wire.FrameHeader(seq=9, ts=123, frame=frame, tick=40, cm_per_pixel=2.0)
+
+
+def test_binary_full_frame_roundtrip() -> None:
+    sim = SimState()
+    sim.grid = [
+        [Pixel("space", 0.0), Pixel("stone", 0.0)],
+        [Pixel("spring", 0.5), Pixel("sink", 0.25)],
+    ]
+    data = wire.encode_full(sim, _header(3))
+    assert len(data) == wire.HEADER.size + 4 * 5
+
+    frame = decode_binary_frame(data)
+    assert (frame.seq, frame.ts, frame.frame, frame.tick) == (9, 123, 3, 40)
+    assert (frame.rows, frame.cols, frame.cm_per_pixel) == (2, 2, 2.0)
+
+    state = ClientState()
+    assert state.apply_binary(data)
+    assert state.grid[1][0] == {"material": "spring", "depth": 0.5}
+    assert state.frame == 3
+
+
+def test_binary_frame_rejects_bad_version_and_materials() -> None:
+    sim = SimState.empty(1, 2)
+    data = bytearray(wire.encode_full(sim, _header(1)))
+    data[4] = 2
+    with pytest.raises(ValueError):
+        decode_binary_frame(bytes(data))
+    data[4] = wire.VERSION
+    data[wire.HEADER.size] = 9
+    with pytest.raises(ValueError):
+        ClientState().apply_binary(bytes(data))
+
+def test_binary_delta_roundtrip() -> None:
+    sim = SimState.empty(2, 3)
+    tracker = DeltaTracker()
+    tracker.diff(sim)
+    state = ClientState()
+    state.apply_binary(wire.encode_full(sim, _header(1)))
+
+    sim.apply_edits([{"op": "set_pixel", "r": 1, "c": 2, "material": "sink", "depth": 0.5}])
+    changes = tracker.diff(sim)
+    assert changes is not None
+    delta = wire.encode_delta(sim, changes, _header(2))
+    assert state.apply_binary(delta)
+    assert state.grid[1][2] == {"material": "sink", "depth": 0.5}
+    # Replaying the same delta is a gap: frame 2 does not follow frame 2.
+    assert not state.apply_binary(delta)
+
+
+def test_zstd_compressed_frames_unwrap() -> None:
+    pytest.importorskip("zstandard")
+    sim = SimState.empty(64, 64)
+    raw = wire.encode_full(sim, _header(1))
+    compressor = wire.Compressor(level=3)
+    packed = compressor.compress(raw)
+    assert packed.startswith(wire.ZSTD_MAGIC)
+    assert len(packed) < len(raw) // 10
+
+    welcome = {"features": ["zstd-1"], **compressor.welcome_fields()}
+    decompressor = make_decompressor(welcome)
+    assert unwrap_message(packed, decompressor) == raw
+    text = '{"t": "error"}'
+    assert unwrap_message(compressor.compress(text), decompressor) == text
+    assert make_decompressor({"features": []}) is None
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from server.net import ControlParams
+from server.state import SimState
+from server.worker import SimulationWorker
+
+
+async def test_worker_steps_and_applies_edits() -> None:
+    sim = SimState.empty(4, 1)
+    control = ControlParams(tick_hz=200)
+    worker = SimulationWorker(sim, lambda s: None, control)
+    worker.start()
+    try:
+        edit = {"op": "set_pixel", "r": 0, "c": 0, "material": "stone"}
+        assert await worker.apply_edits([edit]) is None
+        bad = {"op": "set_pixel", "r": 9, "c": 0, "material": "stone"}
+        assert await worker.apply_edits([bad]) == {"code": "index_out_of_bounds"}
+        await asyncio.sleep(0.05)
+        with worker.frame() as frame:
+            assert frame.tick > 0
+            assert frame.sim.materials[0, 0] == 1
+            assert frame.sim is not sim
+    finally:
+        worker.stop()
+
+
+def test_leased_frame_is_never_written() -> None:
+    sim = SimState.empty(64, 64)
+
+    def fill(state: SimState) -> None:
+        state.depths[...] = (state.depths[0, 0] + 1.0) % 7.0
+
+    worker = SimulationWorker(sim, fill, ControlParams(tick_hz=1000))
+    worker.start()
+    try:
+        time.sleep(0.02)
+        for _ in range(20):
+            with worker.frame() as frame:
+                before = frame.sim.depths.copy()
+                time.sleep(0.005)
+                # Every cell belongs to the same completed tick.
+                assert np.array_equal(frame.sim.depths, before)
+                assert np.unique(before).size == 1
+    finally:
+        worker.stop()
@@ -5,15 +5,17 @@ from pathlib import Path
 import sys
 from typing import Any
 
+import pytest
 import websockets
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 from server import net as server_net
 from client.net import build_hello
+from client.t0.state import ClientState, make_decompressor, unwrap_message
 
 
-async def _start() -> tuple[asyncio.AbstractServer, asyncio.Task, Any]:
-    server, broadcaster, health = await server_net.start_server()
+async def _start(**kwargs: Any) -> tuple[asyncio.AbstractServer, asyncio.Task, Any]:
+    server, broadcaster, health = await server_net.start_server(**kwargs)
     return server, broadcaster, health
 
 
@@ -35,6 +37,8 @@ async def test_ws_roundtrip() -> None:
             assert welcome["t"] == "welcome"
             snapshot = json.loads(await asyncio.wait_for(ws.recv(), timeout=2))
             assert "grid" in snapshot and "cells" in snapshot["grid"]
+            assert snapshot["meta"]["solve_ms"] >= 0
+            assert "tick_lag_ms" in snapshot["meta"]
             ops = [{"op": "set_pixel", "r": 0, "c": 0, "material": "spring"}]
             await ws.send(json.dumps({"t": "edit_grid", "seq": "2", "ts": 0, "ops": ops}))
             errors = []
@@ -51,3 +55,143 @@ async def test_ws_roundtrip() -> None:
     finally:
         await _stop(server, broadcaster, health)
 
+
+async def test_delta_snapshots() -> None:
+    server, broadcaster, health = await _start()
+    try:
+        async with websockets.connect("ws://127.0.0.1:7777/ws") as ws:
+            await ws.send(json.dumps(build_hello(features=["delta-1"])))
+            welcome = json.loads(await asyncio.wait_for(ws.recv(), timeout=1))
+            assert welcome["features"] == ["delta-1"]
+            keyframe = json.loads(await asyncio.wait_for(ws.recv(), timeout=2))
+            assert keyframe["t"] == "snapshot"
+            ops = [{"op": "set_pixel", "r": 0, "c": 0, "material": "stone"}]
+            await ws.send(json.dumps({"t": "edit_grid", "seq": "2", "ts": 0, "ops": ops}))
+            frame = keyframe["frame"]
+            changed = []
+            while not changed:
+                msg = json.loads(await asyncio.wait_for(ws.recv(), timeout=2))
+                assert msg["t"] == "delta"
+                assert msg["base"] == frame
+                frame = msg["frame"]
+                changed = msg["cells"]
+            assert changed == [{"r": 0, "c": 0, "material": "stone", "depth": 0.0}]
+            await ws.send(json.dumps({"t": "resync", "seq": "3", "ts": 0}))
+            while (msg := json.loads(await asyncio.wait_for(ws.recv(), timeout=2)))["t"] != "snapshot":
+                pass
+            assert msg["grid"]["cells"][0][0]["material"] == "stone"
+    finally:
+        await _stop(server, broadcaster, health)
+
+
+async def test_binary_snapshots() -> None:
+    server, broadcaster, health = await _start()
+    try:
+        async with websockets.connect("ws://127.0.0.1:7777/ws") as ws:
+            await ws.send(json.dumps(build_hello(features=["binary-1", "bogus-9"])))
+            welcome = json.loads(await asyncio.wait_for(ws.recv(), timeout=1))
+            assert welcome["features"] == ["binary-1"]
+            data = await asyncio.wait_for(ws.recv(), timeout=2)
+            assert isinstance(data, bytes)
+            state = ClientState()
+            assert state.apply_binary(data)
+            assert state.grid == [[{"material": "space", "depth": 0.0}]]
+    finally:
+        await _stop(server, broadcaster, health)
+
+
+async def test_zstd_snapshots() -> None:
+    pytest.importorskip("zstandard")
+    server, broadcaster, health = await _start()
+    try:
+        async with websockets.connect("ws://127.0.0.1:7777/ws") as ws:
+            await ws.send(json.dumps(build_hello(features=["zstd-1"])))
+            welcome = json.loads(await asyncio.wait_for(ws.recv(), timeout=1))
+            assert welcome["features"] == ["zstd-1"]
+            data = await asyncio.wait_for(ws.recv(), timeout=2)
+            assert isinstance(data, bytes)
+            snapshot = json.loads(unwrap_message(data, make_decompressor(welcome)))
+            assert snapshot["t"] == "snapshot"
+    finally:
+        await _stop(server, broadcaster, health)
+
+
+async def test_subscribe_viewport() -> None:
+    server, broadcaster, health = await _start()
+    try:
+        async with websockets.connect("ws://127.0.0.1:7777/ws") as ws:
+            await ws.send(json.dumps(build_hello()))
+            await asyncio.wait_for(ws.recv(), timeout=1)
+
+            async def recv_until(pred) -> dict:
+                async def loop() -> dict:
+                    while not pred(msg := json.loads(await ws.recv())):
+                        pass
+                    return msg
+
+                return await asyncio.wait_for(loop(), timeout=2)
+
+            viewport = {"r": 0, "c": 0, "rows": -1, "cols": 1}
+            sub = {"t": "subscribe", "seq": "2", "ts": 0, "viewport": viewport}
+            await ws.send(json.dumps(sub))
+            msg = await recv_until(lambda m: m["t"] == "error")
+            assert msg["code"] == "bad_request"
+            viewport["rows"] = 10
+            await ws.send(json.dumps(sub))
+            msg = await recv_until(lambda m: "origin" in m.get("grid", {}))
+            assert msg["grid"]["origin"] == [0, 0]
+            assert (msg["grid"]["rows"], msg["grid"]["cols"]) == (1, 1)
+            assert msg["grid"]["cells"] == [[{"material": "space", "depth": 0.0}]]
+    finally:
+        await _stop(server, broadcaster, health)
+
+
+async def test_sim_thread_roundtrip() -> None:
+    server, broadcaster, health = await _start(sim_thread=True)
+    try:
+        async with websockets.connect("ws://127.0.0.1:7777/ws") as ws:
+            await ws.send(json.dumps(build_hello()))
+            await asyncio.wait_for(ws.recv(), timeout=1)
+            ops = [{"op": "set_pixel", "r": 0, "c": 0, "material": "stone"}]
+            await ws.send(json.dumps({"t": "edit_grid", "seq": "2", "ts": 0, "ops": ops}))
+
+            async def until_stone() -> dict:
+                while True:
+                    msg = json.loads(await ws.recv())
+                    if msg["t"] == "snapshot" and msg["grid"]["cells"][0][0]["material"] == "stone":
+                        return msg
+
+            msg = await asyncio.wait_for(until_stone(), timeout=2)
+            assert msg["meta"]["tick"] > 0
+    finally:
+        await _stop(server, broadcaster, health)
+
+
+async def test_save_replies_save_done(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    server, broadcaster, health = await _start(save_gzip=True)
+    try:
+        async with websockets.connect("ws://127.0.0.1:7777/ws") as ws:
+            await ws.send(json.dumps(build_hello()))
+            await asyncio.wait_for(ws.recv(), timeout=1)
+            for seq in ("2", "3", "4"):
+                await ws.send(json.dumps({"t": "save", "seq": seq, "ts": 0, "note": "n"}))
+
+            async def saves_done() -> list:
+                done = []
+                while len(done) < 3:
+                    msg = json.loads(await ws.recv())
+                    if msg["t"] == "save_done":
+                        done.append(msg)
+                return done
+
+            done = await asyncio.wait_for(saves_done(), timeout=5)
+            assert all(msg["ok"] for msg in done)
+            paths = {msg["path"] for msg in done}
+            # The first save is written at once; the two requests made while
+            # it was in progress share the next one.
+            assert len(paths) <= 2
+            assert sorted(p.name for p in tmp_path.iterdir()) == sorted(paths)
+            assert all(path.endswith(".json.gz") for path in paths)
+    finally:
+        await _stop(server, broadcaster, health)